@@ -0,0 +1,117 @@
+# autopost_queue.py
+"""
+Материализованная очередь автопоста.
+
+Вместо выборки всех кандидатов и сортировки в Python каждый цикл приоритет
+считается один раз при изменении товара и хранится в `autopost_queue`.
+Очередь своя у каждого канала (channels.py). Следующий товар — это индексный
+lookup по (channel, priority, last_posted_at, product_id):
+внутри одного приоритета по кругу (давно не постились — первыми),
+недавно опубликованные ждут AUTOPOST_COOLDOWN.
+"""
+import json
+import time
+
+from config import AUTOPOST_RULES_FILE
+from channels import CHANNELS
+import queries
+import metrics
+
+MIN_STOCK_TO_POST = 2             # “если больше 1”
+AUTOPOST_COOLDOWN = 7 * 24 * 3600  # не постить тот же товар чаще раза в неделю
+DEFAULT_PRIORITY = 99
+
+# (приоритет, подстроки категории, подстроки названия) — первый совпавший выигрывает
+DEFAULT_PRIORITY_RULES = [
+    (1, ["каталог/рюкзаки"], ["рюкзак"]),
+    (2, ["каталог/плечевые сумки"], ["сумка"]),
+    (3, ["каталог/багаж", "ручная кладь"], ["чемодан"]),
+]
+
+
+def load_priority_rules(path: str | None = AUTOPOST_RULES_FILE) -> list:
+    """
+    Правила из JSON-файла (AUTOPOST_RULES_FILE), если задан:
+    [{"priority": 1, "category": ["каталог/рюкзаки"], "name": ["рюкзак"]}, ...]
+    """
+    if not path:
+        return DEFAULT_PRIORITY_RULES
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    return [
+        (int(r["priority"]),
+         [s.lower() for s in r.get("category", [])],
+         [s.lower() for s in r.get("name", [])])
+        for r in raw
+    ]
+
+
+PRIORITY_RULES = load_priority_rules()
+
+
+def get_type_priority(name: str, category: str, rules: list = None) -> int:
+    n = (name or "").lower()
+    c = (category or "").lower()
+
+    for priority, categories, names in (rules or PRIORITY_RULES):
+        if any(s in c for s in categories) or any(s in n for s in names):
+            return priority
+    return DEFAULT_PRIORITY
+
+
+async def refresh_queue(db, product_ids: list[int] | None = None, channels: dict = None):
+    """
+    Пересчитывает очередь каждого канала: по списку id (из ленты изменений) или целиком (None).
+    В очередь канала попадают только товары под его фильтр. db — database.Database.
+    """
+    channels = channels or CHANNELS
+    if product_ids is not None and not product_ids:
+        return
+    for key, channel in channels.items():
+        with metrics.timer("db_query_seconds", query="autopost_candidates"):
+            if product_ids is None:
+                rows = await db.fetchall(queries.AUTOPOST_CANDIDATES, (key, MIN_STOCK_TO_POST))
+            else:
+                marks = ",".join("?" * len(product_ids))
+                rows = await db.fetchall(queries.AUTOPOST_CANDIDATES + f" AND p.id IN ({marks})",
+                                         (key, MIN_STOCK_TO_POST, *product_ids))
+        queued = [
+            (key, pid, get_type_priority(name, category), posted_at)
+            for pid, name, category, posted_at in rows
+            if channel.matches(name, category)
+        ]
+        async with db.transaction() as tx:
+            if product_ids is None:
+                await tx.execute("DELETE FROM autopost_queue WHERE channel = ?", (key,))
+            else:
+                await tx.executemany(
+                    "DELETE FROM autopost_queue WHERE channel = ? AND product_id = ?",
+                    [(key, pid) for pid in product_ids]
+                )
+            await tx.executemany(
+                "INSERT INTO autopost_queue (channel, product_id, priority, last_posted_at) VALUES (?, ?, ?, ?)",
+                queued
+            )
+
+    if product_ids is None:
+        # каналы, убранные из реестра
+        marks = ",".join("?" * len(channels))
+        await db.execute(f"DELETE FROM autopost_queue WHERE channel NOT IN ({marks})", list(channels))
+
+
+async def mark_posted(tx, channel: str, product_id: int, posted_at: float | None = None):
+    """Вызывается внутри транзакции отправки поста: товар уходит из очереди канала."""
+    posted_at = time.time() if posted_at is None else posted_at
+    await tx.execute("UPDATE products SET last_posted_at = ? WHERE id = ?", (posted_at, product_id))
+    await tx.execute(
+        "INSERT INTO channel_posts (channel, product_id, last_posted_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(channel, product_id) DO UPDATE SET last_posted_at = excluded.last_posted_at",
+        (channel, product_id, posted_at)
+    )
+    await tx.execute("DELETE FROM autopost_queue WHERE channel = ? AND product_id = ?", (channel, product_id))
+
+
+async def next_for_autopost(db, channel: str, limit: int, cooldown: float = AUTOPOST_COOLDOWN) -> list[int]:
+    with metrics.timer("db_query_seconds", query="autopost_next"):
+        rows = await db.fetchall(queries.AUTOPOST_NEXT, (channel, time.time() - cooldown, limit))
+    return [row[0] for row in rows]
@@ -0,0 +1,372 @@
+# bench.py
+"""
+Офлайн-бенчмарк всего конвейера бота — без настоящего Telegram.
+
+    python bench.py                                   # каталог 1k, лимиты Telegram сняты
+    python bench.py --sizes 1000 10000 100000 --latency 80 --jitter 40 --rate-429 0.01
+    python bench.py --save bench_baseline.json        # запомнить результат как baseline
+    python bench.py --baseline bench_baseline.json    # сравнить; exit 1 при просадке > --tolerance
+
+На каждый размер: синтетический каталог по схеме tumi_excel_stock_updated_red.xlsx
+(строки-шаблоны берутся из него), затем по очереди
+  import     — import_data.import_file в пустую базу;
+  images     — images.prepare_images проверяет и уменьшает картинки (локальные файлы
+               --images штук, по кругу на товары) в кэш;
+  autopost   — слоты автопоста (main.autopost) подряд публикуют --posts товаров через pipeline;
+  reimport   — повторный импорт, где 10% товаров распроданы и 5% с новым описанием:
+               watch_products удаляет и редактирует посты по ленте изменений;
+  purge      — purge_channel_posts.purge удаляет все оставшиеся посты.
+
+Вместо Bot API — FakeBot в том же процессе: задержка (--latency ± --jitter мс)
+и 429 с retry_after с вероятностью --rate-429. По каждому этапу: штук/сек,
+запросов к SQLite на штуку, p50/p99 времени задачи (мс) и пиковый RSS.
+"""
+import argparse
+import asyncio
+import contextlib
+import copy
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+TEMPLATE_FILE = "tumi_excel_stock_updated_red.xlsx"
+DEFAULT_POSTS = 2000          # сколько товаров публиковать на этапе autopost (не больше каталога)
+SOLD_OUT_SHARE = 0.10         # доля товаров, распроданных при повторном импорте
+EDITED_SHARE = 0.05           # доля товаров с новым описанием при повторном импорте
+DEFAULT_IMAGES = 200          # разных исходных картинок (по кругу на товары)
+IMAGE_SIZE = (2400, 1800)     # исходники больше лимита — этап images их уменьшает
+DRAIN_TIMEOUT = 600           # сколько ждать, пока вотчер и pipeline разберут изменения
+UNLIMITED = (100000.0, 100000)  # rate / burst, когда лимиты Telegram сняты
+
+
+class FakeBot:
+    """Заглушка aiogram.Bot: любой метод — await с задержкой, иногда TelegramRetryAfter."""
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, rate_429: float = 0.0,
+                 retry_after: int = 1, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.message_ids = itertools.count(1)
+        self.calls: dict[str, int] = {}
+        self.flood: dict[str, int] = {}
+
+    def _message(self):
+        message_id = next(self.message_ids)
+        return types.SimpleNamespace(message_id=message_id,
+                                     photo=[types.SimpleNamespace(file_id=f"bench-file-{message_id}")])
+
+    def __getattr__(self, method: str):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        async def call(**kwargs):
+            from aiogram.exceptions import TelegramRetryAfter
+
+            self.calls[method] = self.calls.get(method, 0) + 1
+            await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+            if self.rate_429 and self.random.random() < self.rate_429:
+                self.flood[method] = self.flood.get(method, 0) + 1
+                raise TelegramRetryAfter(method=None, message="Too Many Requests",
+                                         retry_after=self.retry_after)
+            if method == "send_media_group":
+                return [self._message() for _ in kwargs.get("media", ())]
+            if method.startswith("delete"):
+                return True
+            return self._message()
+        return call
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux: KB
+
+
+def percentile(samples: list[float], q: float):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def stage_result(items: int, seconds: float, db_ops: int | None = None, samples: list[float] = ()) -> dict:
+    p50, p99 = percentile(list(samples), 0.5), percentile(list(samples), 0.99)
+    return {
+        "items": items,
+        "seconds": round(seconds, 3),
+        "per_sec": round(items / seconds, 1) if seconds else None,
+        "db_ops_per_item": round(db_ops / items, 1) if db_ops is not None and items else None,
+        "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+        "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def write_images(directory: str, count: int, seed: int = 0) -> list[str]:
+    """count разных JPEG IMAGE_SIZE с шумом (чтобы не сжимались в ничто) — источники для этапа images."""
+    from PIL import Image
+
+    os.makedirs(directory, exist_ok=True)
+    rnd = random.Random(seed)
+    paths = []
+    for i in range(count):
+        small = (IMAGE_SIZE[0] // 8, IMAGE_SIZE[1] // 8)
+        noise = Image.frombytes("L", small, rnd.randbytes(small[0] * small[1]))
+        image = Image.merge("RGB", (noise, noise.rotate(90), noise.transpose(Image.FLIP_LEFT_RIGHT)))
+        path = os.path.join(directory, f"source_{i}.jpg")
+        image.resize(IMAGE_SIZE).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def write_catalog(path: str, size: int, template: str = TEMPLATE_FILE, seed: int = 0,
+                  sold_out: float = 0.0, edited: float = 0.0, images: list[str] = ()):
+    """Синтетический каталог на size товаров со схемой и содержимым строк шаблона."""
+    import openpyxl
+
+    rnd = random.Random(seed)
+    source = openpyxl.load_workbook(template, read_only=True)
+    rows = source.active.iter_rows(values_only=True)
+    header = list(next(rows))
+    templates = [row for row in rows if any(row)]
+    source.close()
+    col = {name: i for i, name in enumerate(header)}
+
+    book = openpyxl.Workbook(write_only=True)
+    sheet = book.create_sheet()
+    sheet.append(header)
+    change = random.Random(seed + 1)
+    for i in range(size):
+        row = list(templates[i % len(templates)])
+        row[col["Артикул"]] = f"BENCH{i:07d}"
+        row[col["Название товара или услуги"]] = f"{row[col['Название товара или услуги']]} #{i}"
+        row[col["Видимость на витрине"]] = "выставлен"
+        row[col["Остаток"]] = rnd.randint(2, 12)
+        if images:
+            row[col["Изображения"]] = images[i % len(images)]
+        draw = change.random()
+        if draw < sold_out:
+            row[col["Остаток"]] = 0
+        elif draw < sold_out + edited:
+            row[col["Описание"]] = f"{row[col['Описание']] or ''} Обновлено."
+        sheet.append(row)
+    book.save(path)
+
+
+class DbOps:
+    """Счётчик SQL-запросов через sqlite3 trace callback."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement: str):
+        self.count += 1
+
+
+async def wait_drained(db, pipeline, timeout: float = DRAIN_TIMEOUT):
+    """Ждёт, пока не останется ни постов к удалению/обновлению, ни задач в pipeline."""
+    import queries
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if (not await db.fetchall(queries.PRODUCTS_TO_DELETE) and not await db.fetchall(queries.PRODUCTS_TO_UPDATE)
+                and await pipeline.depth() == 0):
+            return
+        await asyncio.sleep(0.05)
+    raise TimeoutError("pipeline did not drain in time")
+
+
+async def run_size(args, size: int, workdir: str) -> dict:
+    import main
+    import rate_limiter
+    from autopost_queue import refresh_queue
+    from database import Database
+    import images
+    from import_data import import_file
+    from purge_channel_posts import purge
+
+    results = {}
+    db_path = os.path.join(workdir, f"bench_{size}.db")
+    catalog = os.path.join(workdir, f"catalog_{size}.xlsx")
+    changed = os.path.join(workdir, f"catalog_{size}_changed.xlsx")
+    sources = write_images(os.path.join(workdir, "sources"), min(args.images, size), args.seed)
+    write_catalog(catalog, size, args.template, args.seed, images=sources)
+    write_catalog(changed, size, args.template, args.seed, SOLD_OUT_SHARE, EDITED_SHARE, images=sources)
+
+    start = time.perf_counter()
+    await import_file(catalog, db_path)
+    results["import"] = stage_result(size, time.perf_counter() - start)
+
+    # images: пока есть ждущие картинки; одинаковые источники готовятся один раз за проход
+    async with Database(db_path) as db:
+        ops = DbOps()
+        await db.trace(ops)
+        prepared, start = 0, time.perf_counter()
+        with ThreadPoolExecutor(images.IMAGE_WORKERS) as pool:
+            while True:
+                counts = await images.prepare_images(db, cache_dir=os.path.join(workdir, "image_cache"),
+                                                     pool=pool)
+                if not sum(counts.values()):
+                    break
+                prepared += sum(counts.values())
+        results["images"] = stage_result(prepared, time.perf_counter() - start, ops.count)
+
+    bot = FakeBot(args.latency / 1000, args.jitter / 1000, args.rate_429, seed=args.seed)
+    ops = DbOps()
+    samples = {"send": [], "delete": []}
+    async with rate_limiter.TelegramSender(bot) as sender, Database(db_path) as db:
+        await db.trace(ops)
+        async with main.make_pipeline(sender, db) as pipeline:
+            handler = pipeline.handler
+
+            async def timed(job, checkpoint):
+                started = time.perf_counter()
+                await handler(job, checkpoint)
+                samples[job.kind].append(time.perf_counter() - started)
+            pipeline.handler = timed
+
+            # autopost: слоты каналов без пауз расписания, пока не поставлено нужное число товаров
+            await refresh_queue(db)
+            posts = min(args.posts, size)
+            channels = []
+            for channel in main.CHANNELS.values():
+                channel = copy.copy(channel)
+                channel.autopost_batch = 50
+                channels.append(channel)
+            ops.count, start = 0, time.perf_counter()
+            while (await db.fetchone("SELECT COUNT(*) FROM jobs WHERE kind = 'send'"))[0] < posts:
+                for channel in channels:
+                    await main.autopost(pipeline, db, channel)
+                await asyncio.sleep(0.01)
+            await wait_drained(db, pipeline)
+            results["autopost"] = stage_result(len(samples["send"]), time.perf_counter() - start,
+                                               ops.count, samples["send"])
+
+            # reimport: вотчер разбирает ленту изменений (удаление распроданных, правка постов)
+            watcher = asyncio.create_task(main.watch_products(pipeline, db))
+            await wait_drained(db, pipeline)
+            samples = {"send": [], "delete": []}
+            ops.count, start = 0, time.perf_counter()
+            await import_file(changed, db_path)
+            await asyncio.sleep(0.5)  # вотчер замечает изменения по PRAGMA data_version
+            await wait_drained(db, pipeline)
+            watcher.cancel()
+            await asyncio.gather(watcher, return_exceptions=True)
+            handled = len(samples["send"]) + len(samples["delete"])
+            results["reimport"] = stage_result(handled, time.perf_counter() - start, ops.count,
+                                               samples["send"] + samples["delete"])
+
+        ops.count, start = 0, time.perf_counter()
+        _, deleted, _ = await purge(sender, db)
+        results["purge"] = stage_result(deleted, time.perf_counter() - start, ops.count)
+
+    results["telegram"] = {"calls": dict(bot.calls), "flood_429": dict(bot.flood)}
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Этапы, где штук/сек упали больше чем на tolerance относительно baseline."""
+    regressions = []
+    for size, stages in results.items():
+        for stage, current in stages.items():
+            before = baseline.get(size, {}).get(stage, {})
+            if not before.get("per_sec") or not current.get("per_sec"):
+                continue
+            delta = current["per_sec"] / before["per_sec"] - 1
+            print(f"  {size:>7} {stage:<9} {before['per_sec']:>9} -> {current['per_sec']:>9} /s ({delta:+.0%})")
+            if delta < -tolerance:
+                regressions.append(f"{size}/{stage}: {delta:+.0%}")
+    return regressions
+
+
+def report(size: int, results: dict):
+    print(f"\n=== {size} products ===")
+    print(f"  {'stage':<9} {'items':>7} {'sec':>8} {'/sec':>9} {'db/item':>8} {'p50 ms':>8} {'p99 ms':>8} {'RSS MB':>7}")
+    for stage, r in results.items():
+        if stage == "telegram":
+            continue
+        cells = [r["items"], r["seconds"], r["per_sec"], r["db_ops_per_item"], r["p50_ms"], r["p99_ms"],
+                 r["peak_rss_mb"]]
+        print(f"  {stage:<9} " + " ".join(f"{'-' if c is None else c:>{w}}"
+                                          for c, w in zip(cells, (7, 8, 9, 8, 8, 8, 7))))
+    print(f"  telegram calls: {results['telegram']['calls']}, 429: {results['telegram']['flood_429']}")
+
+
+async def run(args):
+    import rate_limiter
+
+    if not args.real_limits:
+        # меряем сам бот, а не квоты Telegram (20 постов/мин в канал)
+        rate_limiter.GLOBAL_RATE, rate_limiter.GLOBAL_BURST = UNLIMITED
+        for kind in rate_limiter.CHAT_LIMITS:
+            rate_limiter.CHAT_LIMITS[kind] = UNLIMITED
+
+    all_results = {}
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                results = await run_size(args, size, workdir)
+        all_results[str(size)] = results
+        report(size, results)
+    return all_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark against a fake Bot API")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000], help="catalog sizes (products)")
+    parser.add_argument("--posts", type=int, default=DEFAULT_POSTS, help="posts to publish in the autopost stage")
+    parser.add_argument("--images", type=int, default=DEFAULT_IMAGES, help="distinct source images")
+    parser.add_argument("--latency", type=float, default=50, help="fake Bot API latency, ms")
+    parser.add_argument("--jitter", type=float, default=20, help="latency jitter, ± ms")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of calls answered with 429")
+    parser.add_argument("--real-limits", action="store_true", help="keep Telegram rate limits (slow)")
+    parser.add_argument("--template", default=TEMPLATE_FILE, help="XLSX whose schema and rows are cloned")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", metavar="FILE", help="write results as JSON (e.g. a new baseline)")
+    parser.add_argument("--baseline", metavar="FILE", help="compare with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed throughput drop vs baseline")
+    args = parser.parse_args()
+    args.template = os.path.abspath(args.template)
+
+    # каналы из окружения; без CHANNEL_ID — фиктивный, FakeBot всё равно
+    os.environ.setdefault("CHANNEL_ID", "-1000000000000")
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+    # bot.log / errors.log бенча — во временной папке, консоль только для предупреждений
+    logdir = tempfile.mkdtemp(prefix="bench_logs_")
+    cwd = os.getcwd()
+    sys.path.insert(0, cwd)
+    os.chdir(logdir)
+    try:
+        import log_setup
+        log_setup.setup_logging()  # тот же вызов, что при импорте main, — файлы логов в logdir
+        log_setup.set_console_level(logging.WARNING)
+        results = asyncio.run(run(args))
+    finally:
+        os.chdir(cwd)
+    print(f"\nbot logs: {logdir}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=1)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nvs {args.baseline}:")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"❌ regressions: {', '.join(regressions)}")
+            sys.exit(1)
+        print("✅ no regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# change_feed.py
+"""
+Лента изменений товаров (outbox) вместо опроса каждые CHECK_INTERVAL секунд.
+
+Триггеры на `products` пишут id изменённых товаров в таблицу `product_changes`.
+Вотчер ждёт изменений (PRAGMA data_version + in-process уведомления),
+читает только новые записи после своего курсора и обрабатывает только
+затронутые id.
+"""
+import asyncio
+import time
+from typing import TYPE_CHECKING
+
+import aiosqlite
+
+import metrics
+
+if TYPE_CHECKING:
+    from database import Database  # database.py сам импортирует notify_changes отсюда
+
+CHANGE_POLL_INTERVAL = 0.5   # как часто проверять PRAGMA data_version (дёшево, без чтения таблиц)
+CHANGE_BATCH_SIZE = 500      # сколько записей outbox читать за раз
+
+CREATE_TABLE_PRODUCT_CHANGES = """
+CREATE TABLE IF NOT EXISTS product_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,
+    op TEXT NOT NULL,           -- insert / update / delete
+    changed_at REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)
+);
+"""
+
+CREATE_TABLE_CHANGE_CURSORS = """
+CREATE TABLE IF NOT EXISTS change_cursors (
+    name TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+"""
+
+# Пишем в outbox только то, что важно вотчеру: остаток, видимость, флаг needs_update,
+# поля, от которых зависит приоритет автопоста (название, категория), и content_hash —
+# любая правка импорта / stock_sync сбрасывает товар в product_cache.
+CREATE_CHANGE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS products_changes_ai
+    AFTER INSERT ON products
+    BEGIN
+        INSERT INTO product_changes (product_id, op) VALUES (NEW.id, 'insert');
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_changes_au
+    AFTER UPDATE OF stock, visible, needs_update, name, category, content_hash ON products
+    WHEN NEW.stock IS NOT OLD.stock
+      OR NEW.visible IS NOT OLD.visible
+      OR (NEW.needs_update = 1 AND OLD.needs_update IS NOT 1)
+      OR NEW.name IS NOT OLD.name
+      OR NEW.category IS NOT OLD.category
+      OR NEW.content_hash IS NOT OLD.content_hash
+    BEGIN
+        INSERT INTO product_changes (product_id, op) VALUES (NEW.id, 'update');
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_changes_ad
+    AFTER DELETE ON products
+    BEGIN
+        INSERT INTO product_changes (product_id, op) VALUES (OLD.id, 'delete');
+    END;
+    """,
+]
+
+# картинка товара прошла / не прошла проверку (images.py): товар может войти в очередь автопоста
+# или поменять фото — вотчер узнаёт об этом из той же ленты; отдельно — колонки status нет до v14
+CREATE_IMAGE_CHANGE_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS product_images_changes_au
+    AFTER UPDATE OF status ON product_images
+    WHEN NEW.status IS NOT OLD.status
+    BEGIN
+        INSERT INTO product_changes (product_id, op) VALUES (NEW.product_id, 'update');
+    END;
+"""
+
+
+# --- in-process уведомления (импорт/апдейт в том же процессе) ---
+
+_listeners: set[asyncio.Event] = set()
+
+
+def notify_changes():
+    """Разбудить все ChangeFeed в этом процессе сразу, не дожидаясь data_version."""
+    for event in _listeners:
+        event.set()
+
+
+class ChangeFeed:
+    """Инкрементальный курсор по таблице product_changes."""
+
+    def __init__(self, db: "Database", name: str = "watcher",
+                 poll_interval: float = CHANGE_POLL_INTERVAL):
+        self.db = db
+        self.conn: aiosqlite.Connection | None = None  # своё соединение: data_version считается на соединение
+        self.name = name
+        self.poll_interval = poll_interval
+        self.cursor = 0
+        self.changed_at: dict[int, float] = {}  # product_id -> время изменения (последний read)
+        self._data_version = None
+        self._event = asyncio.Event()
+        self.resumed = False  # курсор сохранён прошлым запуском — изменения с тех пор есть в outbox
+
+    async def start(self):
+        self.conn = await self.db.open_dedicated()
+        async with self.conn.execute("SELECT seq FROM change_cursors WHERE name = ?", (self.name,)) as cur:
+            row = await cur.fetchone()
+        if row:
+            self.cursor = row[0]
+            self.resumed = True
+        else:
+            # первый запуск: всё, что было до нас, покрывает полный проход вотчера
+            async with self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM product_changes") as cur:
+                self.cursor = (await cur.fetchone())[0]
+        self._data_version = await self._read_data_version()
+        _listeners.add(self._event)
+
+    async def close(self):
+        _listeners.discard(self._event)
+        if self.conn is not None:
+            await self.conn.close()
+            self.conn = None
+
+    async def _read_data_version(self) -> int:
+        async with self.conn.execute("PRAGMA data_version") as cur:
+            return (await cur.fetchone())[0]
+
+    async def _has_pending(self) -> bool:
+        async with self.conn.execute(
+            "SELECT 1 FROM product_changes WHERE seq > ? LIMIT 1", (self.cursor,)
+        ) as cur:
+            return await cur.fetchone() is not None
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Ждёт новых записей в outbox не дольше timeout секунд.
+        True — есть изменения, False — вышел таймаут.
+        """
+        if await self._has_pending():
+            return True
+
+        deadline = time.monotonic() + timeout
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return False
+            self._event.clear()
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout=min(self.poll_interval, left))
+            except asyncio.TimeoutError:
+                pass
+
+            # data_version меняется, когда коммитит любое ДРУГОЕ соединение (включая писателя бота)
+            version = await self._read_data_version()
+            if version != self._data_version or self._event.is_set():
+                self._data_version = version
+                if await self._has_pending():
+                    return True
+
+    async def read(self, limit: int = CHANGE_BATCH_SIZE) -> tuple[list[int], int]:
+        """Возвращает (уникальные id товаров, последний seq) после курсора."""
+        async with self.conn.execute(
+            "SELECT seq, product_id, changed_at FROM product_changes WHERE seq > ? ORDER BY seq LIMIT ?",
+            (self.cursor, limit)
+        ) as cur:
+            rows = await cur.fetchall()
+        if not rows:
+            return [], self.cursor
+        # самое раннее изменение каждого товара в пачке — от него метрики считают задержку до поста/удаления
+        self.changed_at = {}
+        for _, pid, changed_at in rows:
+            self.changed_at.setdefault(pid, changed_at)
+        metrics.observe("change_feed_lag_seconds", time.time() - rows[0][2])
+        ids = list(self.changed_at)
+        return ids, rows[-1][0]
+
+    async def ack(self, seq: int):
+        """Сдвигает курсор и подчищает обработанные записи outbox."""
+        if seq <= self.cursor:
+            return
+        async with self.db.transaction() as tx:
+            await tx.execute(
+                "INSERT INTO change_cursors (name, seq) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET seq = excluded.seq",
+                (self.name, seq)
+            )
+            await tx.execute(
+                "DELETE FROM product_changes WHERE seq <= (SELECT MIN(seq) FROM change_cursors)"
+            )
+        self.cursor = seq
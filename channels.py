@@ -0,0 +1,87 @@
+# channels.py
+"""
+Реестр каналов: один процесс бота ведёт несколько брендовых каналов.
+
+Без CHANNELS_FILE — один канал "default" из CHANNEL_ID / MANAGER_URL (как раньше).
+С CHANNELS_FILE — JSON-список:
+
+    [{"key": "tumi", "chat_id": "-1001234", "manager_url": "https://t.me/tumi_manager",
+      "categories": ["каталог/tumi"], "names": ["tumi"],
+      "autopost_batch": 1,
+      "schedule": [{"days": "mon-fri", "from": "18:00", "to": "23:00", "per_hour": 3}]}]
+
+categories / names — подстроки категории / названия товара (без учёта регистра);
+пустой фильтр — в канал идут все товары. schedule / catch_up — окна автопоста
+(см. scheduler.py); без schedule — круглосуточно раз в autopost_interval.
+product_messages, очередь автопоста и задачи pipeline хранятся по (channel, product_id).
+"""
+import json
+
+from config import CHANNEL_ID, CHANNELS_FILE, MANAGER_URL
+from product_cache import product_cache
+from scheduler import DEFAULT_CATCH_UP, Schedule
+
+DEFAULT_CHANNEL = "default"
+DEFAULT_AUTOPOST_INTERVAL = 60 * 60   # 60 минут
+DEFAULT_AUTOPOST_BATCH = 1            # 1 товар за цикл
+
+
+class Channel:
+    def __init__(self, key: str, chat_id, manager_url: str = MANAGER_URL,
+                 categories: list[str] = (), names: list[str] = (),
+                 autopost_interval: float = DEFAULT_AUTOPOST_INTERVAL,
+                 autopost_batch: int = DEFAULT_AUTOPOST_BATCH,
+                 schedule: list[dict] | None = None, catch_up: int = DEFAULT_CATCH_UP):
+        self.key = key
+        self.chat_id = chat_id
+        self.manager_url = manager_url
+        self.categories = [s.lower() for s in categories]
+        self.names = [s.lower() for s in names]
+        self.autopost_interval = autopost_interval
+        self.autopost_batch = autopost_batch
+        self.schedule = Schedule.parse(schedule) if schedule is not None else Schedule.every(autopost_interval)
+        self.catch_up = catch_up
+
+    def __repr__(self):
+        return f"Channel({self.key!r}, {self.chat_id!r})"
+
+    def matches(self, name: str | None, category: str | None) -> bool:
+        """Подходит ли товар под фильтр канала."""
+        if not self.categories and not self.names:
+            return True
+        n = (name or "").lower()
+        c = (category or "").lower()
+        return any(s in c for s in self.categories) or any(s in n for s in self.names)
+
+
+def load_channels(path: str | None = CHANNELS_FILE) -> dict[str, Channel]:
+    if not path:
+        return {DEFAULT_CHANNEL: Channel(DEFAULT_CHANNEL, CHANNEL_ID)}
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    channels = {}
+    for item in raw:
+        channel = Channel(**item)
+        if channel.key in channels:
+            raise ValueError(f"duplicate channel key {channel.key!r} in {path}")
+        channels[channel.key] = channel
+    return channels
+
+
+CHANNELS = load_channels()
+
+
+async def route(db, product_ids: list[int], channels: dict[str, Channel] = None) -> dict[str, list[int]]:
+    """
+    {channel key: [product_id, ...]} — в какие каналы идут товары по фильтрам.
+    Снимки товаров грузятся одной пачкой в product_cache — задачи send потом не ходят в базу.
+    """
+    channels = channels or CHANNELS
+    routed = {key: [] for key in channels}
+    if not product_ids:
+        return routed
+    for product_id, product in (await product_cache.get_many(db, product_ids)).items():
+        for key, channel in channels.items():
+            if channel.matches(product.name, product.category):
+                routed[key].append(product_id)
+    return routed
@@ -5,5 +5,15 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 CHANNEL_ID = os.getenv("CHANNEL_ID")
+MANAGER_URL = os.getenv("MANAGER_URL", "https://t.me/tumi_kazakhstan")  # ссылка «Написать менеджеру»
+CHANNELS_FILE = os.getenv("CHANNELS_FILE")  # JSON с несколькими каналами (optional), иначе один CHANNEL_ID
 DB_NAME = os.getenv("DB_NAME", "products.db")  # fallback just in case
-EXCEL_FILE = os.getenv("EXCEL_FILE")
\ No newline at end of file
+EXCEL_FILE = os.getenv("EXCEL_FILE")
+AUTOPOST_RULES_FILE = os.getenv("AUTOPOST_RULES_FILE")  # JSON с правилами приоритета автопоста (optional)
+PREWARM_CHAT_ID = os.getenv("PREWARM_CHAT_ID")  # служебный чат для предзагрузки картинок (optional)
+METRICS_PORT = os.getenv("METRICS_PORT")  # локальный HTTP /metrics для Prometheus (optional)
+METRICS_FILE = os.getenv("METRICS_FILE")  # куда писать JSON-снимок метрик раз в минуту (optional)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text | json (структурированные записи)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))  # доля логов «на каждое сообщение», 0..1
+SCHEDULE_TZ = os.getenv("SCHEDULE_TZ")  # часовой пояс окон автопоста, например Asia/Almaty (optional)
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "image_cache")  # проверенные и уменьшенные картинки
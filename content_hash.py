@@ -0,0 +1,57 @@
+# content_hash.py
+"""
+Хэш содержимого строки товара из Excel и сводка изменений импорта.
+
+Хэш хранится в products.content_hash: при повторном импорте строки с тем же
+хэшем пропускаются целиком (без записи в базу и без перепоста).
+"""
+import hashlib
+import json
+
+# Все поля, которые импорт пишет в products, + список картинок
+HASH_FIELDS = ("name", "description", "price", "old_price", "stock", "category", "url", "visible", "images")
+
+
+def _norm(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)  # 100.0 из Excel и 100 из базы — одно и то же
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+def row_hash(values: dict) -> str:
+    """values: {field: value} по HASH_FIELDS (images — кортеж url)."""
+    payload = json.dumps([_norm(values.get(f)) for f in HASH_FIELDS], ensure_ascii=False, default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def changed_fields(old: dict, new: dict) -> list[str]:
+    return [f for f in HASH_FIELDS if _norm(old.get(f)) != _norm(new.get(f))]
+
+
+class DiffSummary:
+    """Счётчики добавленных / изменённых / удалённых строк с разбивкой по полям."""
+
+    def __init__(self):
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+        self.unchanged = 0
+        self.removal_skipped = None  # почему пропавшие из файла товары не скрыты
+        self.by_field = {f: 0 for f in HASH_FIELDS}
+
+    def record_change(self, fields: list[str]):
+        self.changed += 1
+        for f in fields:
+            self.by_field[f] += 1
+
+    def report(self) -> str:
+        lines = [f"added: {self.added}, changed: {self.changed}, "
+                 f"removed: {self.removed}, unchanged: {self.unchanged}"]
+        per_field = [f"{f}={n}" for f, n in self.by_field.items() if n]
+        if per_field:
+            lines.append("changed fields: " + ", ".join(per_field))
+        if self.removal_skipped:
+            lines.append(f"⚠️ removal skipped: {self.removal_skipped}")
+        return "\n".join(lines)
@@ -1,91 +1,209 @@
 # database.py
 import aiosqlite
 import asyncio
-import datetime
+import contextlib
+import sqlite3
 
 from config import DB_NAME
+from change_feed import notify_changes
 
-CREATE_TABLE_PRODUCTS = """
-CREATE TABLE IF NOT EXISTS products (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT,            -- Название товара или услуги
-    url TEXT,             -- URL
-    description TEXT,     -- Описание (HTML ok)
-    visible BOOLEAN ,      -- 1 => выставлен, 0 => скрыт
-    category TEXT,        -- Размещение на сайте
-    article TEXT,         -- Артикул 
-    price REAL,           -- Цена продажи
-    old_price REAL,       -- Старая цена
-    stock INTEGER,        -- Остаток
-    message_id INTEGER    -- message_id in Telegram channel (optional)
-);
-"""
-
-CREATE_TABLE_IMAGES = """
-CREATE TABLE IF NOT EXISTS product_images (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    product_id INTEGER NOT NULL,
-    image_url TEXT NOT NULL,
-    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
-);
-"""
-
-
-async def init_db():
-    """Create the DB file and products table if they don't exist."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(CREATE_TABLE_IMAGES)
-        await db.execute(CREATE_TABLE_PRODUCTS)
-        await db.commit()
+# --- Connection layer: WAL, pragmas, один писатель + пул читателей ---
+
+PRAGMAS = (
+    ("journal_mode", "WAL"),          # читатели не блокируют писателя и наоборот
+    ("synchronous", "NORMAL"),        # в WAL безопасно, fsync только на checkpoint
+    ("busy_timeout", 30000),          # ждать чужую блокировку, а не падать с "database is locked"
+    ("cache_size", -20000),           # ~20 MB page cache
+    ("mmap_size", 256 * 1024 * 1024),
+    ("temp_store", "MEMORY"),
+)
+STATEMENT_CACHE_SIZE = 256  # кэш подготовленных выражений sqlite3 на соединение
+READER_POOL_SIZE = 3
+DB_TIMEOUT = 30
+
+
+def apply_pragmas_sync(conn: sqlite3.Connection):
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+def connect_sync(path: str = DB_NAME) -> sqlite3.Connection:
+    """Синхронное соединение с теми же настройками — для sqlite3-скриптов."""
+    conn = sqlite3.connect(path, timeout=DB_TIMEOUT, cached_statements=STATEMENT_CACHE_SIZE)
+    apply_pragmas_sync(conn)
+    return conn
+
+
+async def connect(path: str = DB_NAME, readonly: bool = False) -> aiosqlite.Connection:
+    db = await aiosqlite.connect(path, timeout=DB_TIMEOUT, cached_statements=STATEMENT_CACHE_SIZE)
+    for name, value in PRAGMAS:
+        await db.execute(f"PRAGMA {name} = {value}")
+    if readonly:
+        await db.execute("PRAGMA query_only = ON")
+    return db
+
+
+class Database:
+    """
+    Общий слой доступа к SQLite для бота и скриптов.
+
+    Все записи идут через одно соединение-писатель под asyncio.Lock и
+    группируются в транзакции (`async with db.transaction() as tx`) —
+    один commit (fsync) на логическую операцию. Чтения идут через пул
+    read-only соединений и в WAL не ждут писателя.
+    """
+
+    def __init__(self, path: str = DB_NAME, readers: int = READER_POOL_SIZE):
+        self.path = path
+        self.readers = readers
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        self._pool: asyncio.Queue | None = None
+        self._all_readers: list[aiosqlite.Connection] = []
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        if self._writer is not None:
+            return
+        self._writer = await connect(self.path)
+        self._pool = asyncio.Queue()
+        for _ in range(self.readers):
+            conn = await connect(self.path, readonly=True)
+            self._all_readers.append(conn)
+            self._pool.put_nowait(conn)
+
+    async def close(self):
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers.clear()
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    async def trace(self, callback):
+        """sqlite3 trace callback на писателя и все читатели (счётчик запросов в bench.py); None — снять."""
+        for conn in (self._writer, *self._all_readers):
+            await conn.set_trace_callback(callback)
+
+    async def open_dedicated(self, readonly: bool = True) -> aiosqlite.Connection:
+        """Отдельное соединение (например, для PRAGMA data_version в ленте изменений)."""
+        return await connect(self.path, readonly=readonly)
+
+    @contextlib.asynccontextmanager
+    async def reader(self):
+        conn = await self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put_nowait(conn)
+
+    async def fetchall(self, sql: str, params=()) -> list:
+        async with self.reader() as conn:
+            async with conn.execute(sql, params) as cur:
+                return await cur.fetchall()
+
+    async def fetchone(self, sql: str, params=()):
+        async with self.reader() as conn:
+            async with conn.execute(sql, params) as cur:
+                return await cur.fetchone()
+
+    @contextlib.asynccontextmanager
+    async def transaction(self, immediate: bool = True):
+        """
+        Одна транзакция на писателе: commit при выходе, rollback при ошибке.
+        immediate=False — для записи только во TEMP-таблицы: основная база при этом не блокируется.
+        """
+        async with self._write_lock:
+            await self._writer.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+
+    async def execute(self, sql: str, params=()):
+        async with self.transaction() as tx:
+            await tx.execute(sql, params)
+
+    async def executemany(self, sql: str, seq_of_params):
+        async with self.transaction() as tx:
+            await tx.executemany(sql, seq_of_params)
+
+
+_shared: Database | None = None
+
+
+async def get_db() -> Database:
+    """Общий на процесс экземпляр Database (бот, скрипты, хелперы ниже)."""
+    global _shared
+    if _shared is None:
+        _shared = Database()
+        await _shared.open()
+    return _shared
+
+
+async def close_db():
+    global _shared
+    if _shared is not None:
+        await _shared.close()
+        _shared = None
 
 
 async def add_product(product: dict):
     """Insert a new product record.
     product keys: name, url, description, visible (0/1), category, article, price, old_price, stock, message_id(optional)
     """
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(
-            """
-            INSERT INTO products
-            (name, url, description, visible, category, article, price, old_price, stock, message_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                product.get("name"),
-                product.get("url"),
-                product.get("description"),
-                1 if product.get("visible") else 0,
-                product.get("category"),
-                product.get("article"),
-                product.get("price"),
-                product.get("old_price"),
-                product.get("stock"),
-                product.get("message_id"),
-            ),
-        )
-        await db.commit()
+    db = await get_db()
+    await db.execute(
+        """
+        INSERT INTO products
+        (name, url, description, visible, category, article, price, old_price, stock, message_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            product.get("name"),
+            product.get("url"),
+            product.get("description"),
+            1 if product.get("visible") else 0,
+            product.get("category"),
+            product.get("article"),
+            product.get("price"),
+            product.get("old_price"),
+            product.get("stock"),
+            product.get("message_id"),
+        ),
+    )
+    notify_changes()
 
 
 async def get_all_products():
     """Return a list of rows (tuples) for all products."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT * FROM products") as cursor:
-            rows = await cursor.fetchall()
-            return rows
+    db = await get_db()
+    return await db.fetchall("SELECT * FROM products")
 
 
 async def update_stock(product_id: int, new_stock: int):
     """Update stock for a product by id."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE products SET stock = ? WHERE id = ?", (new_stock, product_id))
-        await db.commit()
+    db = await get_db()
+    await db.execute("UPDATE products SET stock = ? WHERE id = ?", (new_stock, product_id))
+    notify_changes()
 
 
 async def delete_product(product_id: int):
     """Delete product by id."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM products WHERE id = ?", (product_id,))
-        await db.commit()
+    db = await get_db()
+    await db.execute("DELETE FROM products WHERE id = ?", (product_id,))
+    notify_changes()
 
 if __name__ == "__main__":
-    asyncio.run(init_db())
\ No newline at end of file
+    # схема теперь создаётся миграциями
+    from migrations import migrate
+    asyncio.run(migrate())
\ No newline at end of file
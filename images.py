@@ -0,0 +1,241 @@
+# images.py
+"""
+Проверка и подготовка картинок товаров до публикации.
+
+Импорт кладёт ссылки из «Изображения» в product_images как есть (status NULL).
+Этот этап для первой годной картинки каждого товара на витрине:
+  - берёт источник: http(s)-ссылку, file://… или локальный путь;
+  - проверяет, что это картинка (Pillow), и лимиты фото Telegram (соотношение сторон);
+  - уменьшает до IMAGE_MAX_SIDE по длинной стороне, JPEG, и кладёт в IMAGE_CACHE_DIR
+    под именем sha256 содержимого (одинаковые картинки хранятся один раз);
+  - пишет status = 'ready' + path или 'failed' + error.
+Сетевые ошибки не окончательны: картинка остаётся NULL и повторяется через IMAGE_RETRY_AFTER.
+В очередь автопоста попадают только товары с готовой картинкой (или вовсе без картинок),
+send_product загружает файл из кэша вместо ссылки — без сбоев на битых URL в момент отправки.
+
+Декодирование и ресайз — в пуле потоков (Pillow отпускает GIL), скачивание — aiohttp.
+В боте этап крутится в image_loop; после импорта можно прогнать сразу:
+
+    python images.py [--limit 500]
+    python images.py --gc          # удалить из кэша файлы, на которые больше нет ссылок
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiogram import types
+
+import metrics
+import queries
+from config import DB_NAME, IMAGE_CACHE_DIR
+from database import Database
+
+logger = logging.getLogger("errors")
+bot_logger = logging.getLogger("bot")
+
+IMAGE_MAX_SIDE = 1280            # Telegram показывает фото не больше 1280 по длинной стороне
+IMAGE_MAX_RATIO = 20             # лимит send_photo на соотношение сторон
+IMAGE_QUALITY = 87
+MAX_SOURCE_BYTES = 30 * 1024 * 1024
+DOWNLOAD_TIMEOUT = 30            # секунд
+DOWNLOAD_CONCURRENCY = 8
+IMAGE_WORKERS = min(4, os.cpu_count() or 1)
+IMAGE_BATCH = 200                # картинок за проход
+IMAGE_INTERVAL = 60              # пауза image_loop, когда проверять нечего
+IMAGE_RETRY_AFTER = 30 * 60      # повтор после сетевой ошибки
+GONE_STATUSES = (404, 410)       # источник точно пропал — failed, а не повтор
+
+
+class ImageRejected(Exception):
+    """Источник есть, но это не картинка или Telegram её не примет — повторять бессмысленно."""
+
+
+def prepare(source: bytes | str, cache_dir: str = IMAGE_CACHE_DIR) -> str:
+    """
+    Проверка + ресайз + запись в кэш (в потоке пула). source — байты или локальный путь.
+    Возвращает путь к JPEG в кэше.
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+            # JPEG декодируется сразу в уменьшенном масштабе (1/2, 1/4, 1/8) — в разы быстрее полного
+            image.draft("RGB", (IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+            image.load()
+            width, height = image.size
+            if max(width, height) > IMAGE_MAX_RATIO * min(width, height):
+                raise ImageRejected(f"aspect ratio {width}x{height} exceeds 1:{IMAGE_MAX_RATIO}")
+            image = ImageOps.exif_transpose(image)
+            if image.mode != "RGB":
+                # прозрачность — на белом фоне, как на витрине
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", rgba.size, "white")
+                image.paste(rgba, mask=rgba.getchannel("A"))
+            image.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.LANCZOS)
+            out = io.BytesIO()
+            image.save(out, "JPEG", quality=IMAGE_QUALITY)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError, ValueError) as e:
+        if isinstance(e, FileNotFoundError):
+            raise ImageRejected(f"file not found: {e.filename}")
+        raise ImageRejected(f"not a valid image: {e}")
+
+    data = out.getvalue()
+    digest = hashlib.sha256(data).hexdigest()
+    path = os.path.abspath(os.path.join(cache_dir, digest[:2], f"{digest}.jpg"))
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return path
+
+
+def cached_photo(path: str | None) -> types.FSInputFile | None:
+    """Готовая картинка из кэша для send_photo, если файл на месте."""
+    return types.FSInputFile(path) if path and os.path.exists(path) else None
+
+
+async def fetch(session: aiohttp.ClientSession, url: str) -> bytes | str:
+    """Байты по http(s) или локальный путь. ImageRejected — источник недоступен окончательно."""
+    if url.startswith("file://"):
+        return url[len("file://"):]
+    if not url.startswith(("http://", "https://")):
+        return url  # локальный путь; существование проверит prepare
+    async with session.get(url) as response:
+        if response.status in GONE_STATUSES:
+            raise ImageRejected(f"HTTP {response.status}")
+        response.raise_for_status()
+        if (response.content_length or 0) > MAX_SOURCE_BYTES:
+            raise ImageRejected(f"source is {response.content_length} bytes")
+        data = await response.content.read(MAX_SOURCE_BYTES + 1)
+        if len(data) > MAX_SOURCE_BYTES:
+            raise ImageRejected(f"source is over {MAX_SOURCE_BYTES} bytes")
+        return data
+
+
+async def prepare_images(db: Database, limit: int = IMAGE_BATCH, cache_dir: str = IMAGE_CACHE_DIR,
+                         pool: ThreadPoolExecutor | None = None) -> dict[str, int]:
+    """Один проход по ждущим картинкам; {"ready": n, "failed": n, "retry": n}."""
+    rows = await db.fetchall(queries.IMAGES_PENDING, (time.time() - IMAGE_RETRY_AFTER, limit))
+    counts = {"ready": 0, "failed": 0, "retry": 0}
+    if not rows:
+        return counts
+
+    # та же ссылка у другого товара уже готова (варианты цвета / размера с общим фото) — берём её файл
+    urls = list({url for _, _, url in rows})
+    marks = ",".join("?" * len(urls))
+    known = await db.fetchall(
+        f"SELECT image_url, path FROM product_images WHERE status = 'ready' AND image_url IN ({marks})", urls
+    )
+
+    loop = asyncio.get_running_loop()
+    downloads = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+    done: dict[str, asyncio.Future] = {}  # одна и та же ссылка у нескольких товаров — готовим один раз
+    for url, path in known:
+        if url not in done and os.path.exists(path):
+            done[url] = loop.create_future()
+            done[url].set_result(path)
+    updates = []  # (status, path, error, checked_at, id)
+
+    async def resolve(url: str) -> str:
+        async with downloads:
+            source = await fetch(session, url)
+        return await loop.run_in_executor(pool, prepare, source, cache_dir)
+
+    async def handle(image_id: int, product_id: int, url: str):
+        if url not in done:
+            done[url] = asyncio.ensure_future(resolve(url))
+        with metrics.timer("image_prepare_seconds"):
+            try:
+                path = await done[url]
+                updates.append(("ready", path, None, time.time(), image_id))
+                result = "ready"
+            except ImageRejected as e:
+                updates.append(("failed", None, str(e)[:500], time.time(), image_id))
+                result = "failed"
+                logger.warning(f"Image of product {product_id} rejected: {url}: {e}",
+                               extra={"product_id": product_id})
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                updates.append((None, None, str(e)[:500] or type(e).__name__, time.time(), image_id))
+                result = "retry"
+                logger.warning(f"Image of product {product_id} unavailable, will retry: {url}: {e}",
+                               extra={"product_id": product_id, "dedup": "image:network"})
+            except Exception as e:
+                # запись в кэш (OSError), Pillow вне prepare и т.п. — повтор позже, пачка всё равно записывается
+                updates.append((None, None, f"{type(e).__name__}: {e}"[:500], time.time(), image_id))
+                result = "retry"
+                logger.exception(f"Image of product {product_id} failed, will retry: {url}: {e}",
+                                 extra={"product_id": product_id, "dedup": "image:error"})
+        counts[result] += 1
+        metrics.inc("images_total", result=result)
+
+    timeout = aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        await asyncio.gather(*(handle(*row) for row in rows))
+
+    # смена status пишет товар в ленту изменений — вотчер обновит кэш товара и очередь автопоста
+    await db.executemany(
+        "UPDATE product_images SET status = ?, path = ?, error = ?, checked_at = ? WHERE id = ?",
+        updates
+    )
+    return counts
+
+
+async def image_loop(db: Database, interval: float = IMAGE_INTERVAL):
+    """Фоновый этап в боте: готовит новые картинки пачками, пока есть что готовить."""
+    with ThreadPoolExecutor(IMAGE_WORKERS, thread_name_prefix="images") as pool:
+        while True:
+            try:
+                counts = await prepare_images(db, pool=pool)
+                if sum(counts.values()):
+                    bot_logger.info(f"Images: {counts}")
+                if sum(counts.values()) >= IMAGE_BATCH:
+                    continue
+            except Exception as e:
+                logger.exception(f"Image loop error: {e}")
+            await asyncio.sleep(interval)
+
+
+async def gc_cache(db: Database, cache_dir: str = IMAGE_CACHE_DIR) -> int:
+    """Удаляет файлы кэша, на которые не ссылается ни одна картинка. Возвращает число удалённых."""
+    used = {path for path, in await db.fetchall("SELECT DISTINCT path FROM product_images WHERE path IS NOT NULL")}
+    removed = 0
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.abspath(os.path.join(root, name))
+            if path not in used:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Validate and resize product images into the local cache")
+    parser.add_argument("--limit", type=int, default=IMAGE_BATCH, help="images per pass")
+    parser.add_argument("--gc", action="store_true", help="remove cached files no image refers to")
+    args = parser.parse_args()
+
+    async with Database(DB_NAME) as db:
+        if args.gc:
+            print(f"Удалено файлов: {await gc_cache(db)}")
+            return
+        total = {"ready": 0, "failed": 0, "retry": 0}
+        with ThreadPoolExecutor(IMAGE_WORKERS, thread_name_prefix="images") as pool:
+            while True:
+                counts = await prepare_images(db, args.limit, pool=pool)
+                for key, n in counts.items():
+                    total[key] += n
+                if sum(counts.values()) < args.limit:
+                    break
+        print(f"Готово: {total['ready']}, отклонено: {total['failed']}, повторить позже: {total['retry']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
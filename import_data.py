@@ -1,70 +1,231 @@
-import pandas as pd
+import argparse
 import asyncio
+import os
+import tempfile
 import aiosqlite
 from config import DB_NAME, EXCEL_FILE
+from database import Database
+from migrations import migrate
+from content_hash import row_hash, changed_fields, DiffSummary
+from ingest import norm_article, norm_stock, read_chunks
+from preview import copy_database, report_preview
 
 
-COLUMN_MAP = {
-    "Артикул": "article",
-    "Название товара или услуги": "name",
-    "Описание": "description",
-    "Цена продажи": "price",
-    "Старая цена": "old_price",
-    "Остаток": "stock",
-    "Размещение на сайте": "category",
-    "URL": "url",
-    "Видимость на витрине": "visible",
-    "Изображения": "image"  # Now mapping images column
-}
+# Поля товара, которые импорт пишет в products
+PRODUCT_FIELDS = ("name", "description", "price", "old_price", "stock", "category", "url", "visible")
+# Поля, которые видны в посте: их изменение => существующий пост устарел (needs_update = 1)
+POSTED_FIELDS = ("name", "description", "url", "images")
+# пропало из файла больше этой доли товаров на витрине — скорее битая выгрузка, чем снятие с продажи
+MAX_REMOVAL_SHARE = 0.2
+
+
+def to_values(row: dict) -> dict:
+    """Строка выгрузки (ключи из COLUMN_MAP) -> {field: value, ..., "images": (...)}."""
+    return {
+        "name": row.get("name"),
+        "description": row.get("description"),
+        "price": row.get("price"),
+        "old_price": row.get("old_price"),
+        "stock": norm_stock(row.get("stock")),
+        "category": row.get("category"),
+        "url": row.get("url"),
+        "visible": 1 if row.get("visible") == "выставлен" else 0,
+        "images": tuple(str(row.get("image") or "").split()),
+    }
+
+
+def chunk_by_article(chunk: list[dict]) -> dict:
+    """{article: values} по пачке строк; строки без артикула пропускаются (не сопоставить с базой)."""
+    sheet = {}
+    for row in chunk:
+        article = norm_article(row.get("article"))
+        if article:
+            sheet[article] = to_values(row)
+    return sheet
+
+
+async def load_existing(db: aiosqlite.Connection, articles: list[str]):
+    """{article: (id, {field: value}, content_hash)} + id товаров, у которых есть посты — только для пачки."""
+    marks = ",".join("?" * len(articles))
+    existing = {}
+    posted = set()
+    async with db.execute(
+        f"SELECT id, article, content_hash, {', '.join(PRODUCT_FIELDS)}, "
+        f"EXISTS (SELECT 1 FROM product_messages pm WHERE pm.product_id = products.id) "
+        f"FROM products WHERE article IN ({marks})",
+        articles
+    ) as cur:
+        async for row in cur:
+            values = dict(zip(PRODUCT_FIELDS, row[3:-1]))
+            values["images"] = ()
+            existing[norm_article(row[1])] = (row[0], values, row[2])
+            if row[-1]:
+                posted.add(row[0])
+
+    ids = {product_id: values for product_id, values, _ in existing.values()}
+    if ids:
+        async with db.execute(
+            f"SELECT product_id, image_url FROM product_images "
+            f"WHERE product_id IN ({','.join('?' * len(ids))}) ORDER BY id",
+            list(ids)
+        ) as cur:
+            async for product_id, url in cur:
+                ids[product_id]["images"] += (url,)
+
+    return existing, posted
+
+
+async def import_chunk(database: Database, sheet: dict, summary: DiffSummary):
+    """Сравнивает пачку с базой по хэшам и пишет изменения одной транзакцией."""
+    async with database.reader() as conn:
+        existing, posted = await load_existing(conn, list(sheet))
+
+    inserts = []          # (article, fields..., content_hash)
+    new_images = {}       # article -> urls для новых товаров
+    updates = []          # (fields..., content_hash, needs_update, id)
+    hash_only = []        # (content_hash, id) — строки из старых баз без хэша
+    image_updates = {}    # id -> urls
+
+    for article, values in sheet.items():
+        new_hash = row_hash(values)
+        fields = [values[f] for f in PRODUCT_FIELDS]
+        if article not in existing:
+            inserts.append((article, *fields, new_hash))
+            new_images[article] = values["images"]
+            summary.added += 1
+            continue
+
+        product_id, old_values, old_hash = existing[article]
+        if new_hash == old_hash:
+            summary.unchanged += 1
+            continue
+
+        diff = changed_fields(old_values, values)
+        if not diff:
+            hash_only.append((new_hash, product_id))
+            summary.unchanged += 1
+            continue
+
+        summary.record_change(diff)
+        stale_post = 1 if product_id in posted and any(f in POSTED_FIELDS for f in diff) else 0
+        updates.append((*fields, new_hash, stale_post, product_id))
+        if "images" in diff:
+            image_updates[product_id] = values["images"]
+
+    set_clause = ", ".join(f"{f} = ?" for f in PRODUCT_FIELDS)
+    async with database.transaction() as tx:
+        await tx.executemany("INSERT OR IGNORE INTO import_seen (article) VALUES (?)", [(a,) for a in sheet])
+        await tx.executemany(
+            f"INSERT INTO products (article, {', '.join(PRODUCT_FIELDS)}, content_hash, needs_update) "
+            f"VALUES (?, {', '.join('?' * len(PRODUCT_FIELDS))}, ?, 0)",
+            inserts
+        )
+        await tx.executemany(
+            f"UPDATE products SET {set_clause}, content_hash = ?, "
+            f"needs_update = CASE WHEN ? = 1 THEN 1 ELSE needs_update END WHERE id = ?",
+            updates
+        )
+        await tx.executemany("UPDATE products SET content_hash = ? WHERE id = ?", hash_only)
+
+        if new_images:
+            async with tx.execute(
+                f"SELECT id, article FROM products WHERE article IN ({','.join('?' * len(new_images))})",
+                list(new_images)
+            ) as cur:
+                ids = {article: pid for pid, article in await cur.fetchall()}
+            for article, urls in new_images.items():
+                image_updates[ids[article]] = urls
+
+        await tx.executemany(
+            "DELETE FROM product_images WHERE product_id = ?",
+            [(pid,) for pid in image_updates]
+        )
+        await tx.executemany(
+            "INSERT INTO product_images (product_id, image_url) VALUES (?, ?)",
+            [(pid, url) for pid, urls in image_updates.items() for url in urls]
+        )
+
+
+async def import_file(path: str, db_path: str = DB_NAME,
+                      allow_mass_removal: bool = False) -> tuple[DiffSummary, int, int]:
+    """
+    Импорт файла в базу db_path. Возвращает (summary, строк в файле, строк с артикулом).
+    Пропавшие из файла товары скрываются, но не когда в файле нет ни одного артикула
+    и не больше MAX_REMOVAL_SHARE витрины без allow_mass_removal (причина — в summary.removal_skipped).
+    """
+    await migrate(db_path)
+    summary = DiffSummary()
+    total_rows = 0
+    with_article = 0
+
+    async with Database(db_path, readers=1) as database:
+        # артикулы из файла — во временной таблице писателя, чтобы найти пропавшие товары
+        async with database.transaction() as tx:
+            await tx.execute("CREATE TEMP TABLE IF NOT EXISTS import_seen (article TEXT PRIMARY KEY)")
+            await tx.execute("DELETE FROM import_seen")
+
+        # пачка строк -> сравнение -> запись; файл целиком в памяти не держим
+        for chunk in read_chunks(path):
+            total_rows += len(chunk)
+            sheet = chunk_by_article(chunk)
+            with_article += len(sheet)
+            if sheet:
+                await import_chunk(database, sheet, summary)
+
+        # товары, пропавшие из выгрузки: скрываем и обнуляем остаток (вотчер удалит посты)
+        async with database.transaction() as tx:
+            async with tx.execute("""
+                SELECT COUNT(*), COALESCE(SUM(article NOT IN (SELECT article FROM import_seen)), 0)
+                FROM products
+                WHERE article IS NOT NULL AND (visible OR stock)
+            """) as cur:
+                active, missing = await cur.fetchone()
+            if not with_article:
+                summary.removal_skipped = "no rows with an article in the file (is the «Артикул» column missing?)"
+            elif missing > active * MAX_REMOVAL_SHARE and not allow_mass_removal:
+                summary.removal_skipped = (f"{missing} of {active} listed products are missing from the file "
+                                           f"(over {MAX_REMOVAL_SHARE:.0%}); rerun with --allow-mass-removal")
+            else:
+                async with tx.execute("""
+                    UPDATE products SET visible = 0, stock = 0, content_hash = NULL
+                    WHERE article IS NOT NULL
+                      AND article NOT IN (SELECT article FROM import_seen)
+                      AND (visible OR stock)
+                """) as cur:
+                    summary.removed = cur.rowcount
+            await tx.execute("DROP TABLE import_seen")
+
+    return summary, total_rows, with_article
+
 
 async def main():
-    # Clear table first
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM products;")
-        await db.execute("DELETE FROM product_images;")  # also clear images
-        await db.commit()
-        print("✅ Cleared 'products' and 'product_images' tables.")
-
-    # Import new data
-    df = pd.read_excel(EXCEL_FILE)
-    df = df.rename(columns=COLUMN_MAP)
-    df = df[[c for c in COLUMN_MAP.values() if c in df.columns]]
-    df = df.where(pd.notnull(df), None)
-
-    async with aiosqlite.connect(DB_NAME) as db:
-        for _, row in df.iterrows():
-            cursor = await db.execute(
-                """
-                INSERT INTO products
-                (article, name, description, price, old_price, stock, category, url, visible)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    row.get("article"),
-                    row.get("name"),
-                    row.get("description"),
-                    row.get("price"),
-                    row.get("old_price"),
-                    row.get("stock"),
-                    row.get("category"),
-                    row.get("url"),
-                    1 if row.get("visible") == "выставлен" else 0
-                )
-            )
-            product_id = cursor.lastrowid
-
-            # Insert images
-            image_urls = str(row.get("image") or "").split()
-            for url in image_urls:
-                await db.execute(
-                    "INSERT INTO product_images (product_id, image_url) VALUES (?, ?)",
-                    (product_id, url)
-                )
-        await db.commit()
-        print(f"✅ Imported {len(df)} products with their images.")
+    parser = argparse.ArgumentParser(description="Import products from an XLSX/CSV export")
+    parser.add_argument("path", nargs="?", default=EXCEL_FILE, help="XLSX or CSV file (default: EXCEL_FILE)")
+    parser.add_argument("--allow-mass-removal", action="store_true",
+                        help=f"hide missing products even if they are over {MAX_REMOVAL_SHARE:.0%} of the catalog")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="import into a copy of the database and preview the posts instead")
+    parser.add_argument("--report", help="with --dry-run: write the full preview (.json or .csv)")
+    args = parser.parse_args()
+    if not args.path:
+        parser.error("no file given and EXCEL_FILE is not set")
 
+    if args.dry_run:
+        # рабочая база не меняется: импорт в копию, затем сухой прогон рендера и очереди по ней
+        with tempfile.TemporaryDirectory(prefix="dry_run_") as workdir:
+            db_path = os.path.join(workdir, os.path.basename(DB_NAME))
+            copy_database(DB_NAME, db_path)
+            summary, total_rows, with_article = await import_file(args.path, db_path, args.allow_mass_removal)
+            print(f"Rows in sheet: {total_rows} ({with_article} with article)")
+            print(summary.report())
+            report_preview(db_path, args.report)
+        return
 
-if __name__ == "__main__":
-    asyncio.run(main())
+    summary, total_rows, with_article = await import_file(args.path, allow_mass_removal=args.allow_mass_removal)
 
+    print(f"✅ Rows in sheet: {total_rows} ({with_article} with article)")
+    print(summary.report())
 
+
+if __name__ == "__main__":
+    asyncio.run(main())
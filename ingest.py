@@ -0,0 +1,123 @@
+# ingest.py
+"""
+Потоковое чтение выгрузки товаров (XLSX или CSV).
+
+Строки читаются лениво (openpyxl read_only / csv), колонки переименовываются
+по COLUMN_MAP, и отдаются пачками по INGEST_CHUNK_SIZE — память не зависит
+от размера файла, весь лист в DataFrame не грузится.
+
+    for chunk in read_chunks(EXCEL_FILE):
+        ...  # chunk: list[dict] с ключами из COLUMN_MAP
+"""
+import csv
+import os
+import re
+from itertools import islice
+from typing import Iterator
+
+INGEST_CHUNK_SIZE = 500  # строк на пачку записи в базу (и плейсхолдеров в IN (...))
+
+COLUMN_MAP = {
+    "Артикул": "article",
+    "Название товара или услуги": "name",
+    "Описание": "description",
+    "Цена продажи": "price",
+    "Старая цена": "old_price",
+    "Остаток": "stock",
+    "Размещение на сайте": "category",
+    "URL": "url",
+    "Видимость на витрине": "visible",
+    "Изображения": "image"  # Now mapping images column
+}
+
+# в CSV всё — строки; эти колонки приводим к числам, как их отдаёт Excel
+NUMERIC_FIELDS = ("price", "old_price", "stock")
+
+
+def norm_article(value):
+    """Артикул как строка: 12345.0 из Excel и 12345 из базы должны совпасть."""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def norm_stock(value):
+    """Остаток как int: "10+" -> 10; текст без числа ("нет", "под заказ") -> None, как пустая ячейка."""
+    value = parse_number(value)
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.match(r"\s*(\d+)", str(value))
+    return int(match.group(1)) if match else None
+
+
+def parse_number(value):
+    """'1 200,50' / '5' из CSV -> число; числа из Excel не трогаем."""
+    if not isinstance(value, str):
+        return value
+    text = value.replace("\xa0", "").replace(" ", "").replace(",", ".")
+    try:
+        number = float(text)
+    except ValueError:
+        return value
+    return int(number) if number.is_integer() else number
+
+
+def _iter_xlsx(path: str) -> Iterator[tuple]:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from wb.active.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def _iter_csv(path: str) -> Iterator[tuple]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield from (tuple(row) for row in csv.reader(f, dialect))
+
+
+def iter_rows(path: str, columns: dict = COLUMN_MAP) -> Iterator[dict]:
+    """
+    Строки файла как {field: value} по COLUMN_MAP (колонки не из карты пропускаются).
+    Пустые ячейки -> None, числовые поля из CSV -> числа.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    rows = _iter_csv(path) if ext in (".csv", ".txt") else _iter_xlsx(path)
+
+    header = next(rows, None)
+    if header is None:
+        return
+    index = [(i, columns[str(h).strip()]) for i, h in enumerate(header)
+             if h is not None and str(h).strip() in columns]
+    numeric = [field for _, field in index if field in NUMERIC_FIELDS]
+
+    for row in rows:
+        values = {}
+        for i, field in index:
+            value = row[i] if i < len(row) else None
+            if isinstance(value, str) and not value.strip():
+                value = None
+            values[field] = value
+        if not any(v is not None for v in values.values()):
+            continue  # пустые строки в конце листа
+        for field in numeric:
+            values[field] = parse_number(values[field])
+        yield values
+
+
+def read_chunks(path: str, size: int = INGEST_CHUNK_SIZE, columns: dict = COLUMN_MAP) -> Iterator[list[dict]]:
+    rows = iter_rows(path, columns)
+    while chunk := list(islice(rows, size)):
+        yield chunk
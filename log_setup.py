@@ -0,0 +1,142 @@
+# log_setup.py
+"""
+Логирование без файлового I/O в event loop.
+
+Логгеры "bot" (INFO+, bot.log) и "errors" (WARNING+, errors.log) только кладут
+записи в очередь (QueueHandler); ротацию файлов и консоль обслуживает фоновый
+поток QueueListener — медленный диск не тормозит корутины.
+
+    bot_logger, error_logger = setup_logging()
+    bot_logger.info("Deleted message", extra={"product_id": 1, "message_id": 7, "sample": True})
+    logger.error("Flood control ...", extra={"dedup": "flood:send_photo"})
+
+LOG_FORMAT=json — одна JSON-строка на запись с полями из STRUCTURED_FIELDS.
+LOG_SAMPLE_RATE — какая доля событий «на каждое сообщение» (extra sample=True) пишется.
+Записи с одинаковым extra dedup чаще раза в DEDUP_WINDOW секунд схлопываются,
+следующая пропущенная запись сообщит, сколько повторов было скрыто.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from config import LOG_FORMAT, LOG_SAMPLE_RATE
+
+DEDUP_WINDOW = 60  # секунд
+STRUCTURED_FIELDS = ("product_id", "message_id", "channel", "job_id", "method", "suppressed")
+
+_listener: QueueListener | None = None
+_console: logging.Handler | None = None
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} (+{suppressed} similar suppressed)" if suppressed else text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_text or record.exc_info:
+            data["exc"] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DedupFilter(logging.Filter):
+    """Пропускает первую запись с данным ключом dedup, повторы в окне window — считает и глотает."""
+
+    def __init__(self, window: float = DEDUP_WINDOW):
+        super().__init__()
+        self.window = window
+        self._seen: dict[str, list] = {}  # key -> [время пропущенной записи, скрыто повторов]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "dedup", None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        entry = self._seen.get(key)
+        if entry and now - entry[0] < self.window:
+            entry[1] += 1
+            return False
+        if entry and entry[1]:
+            record.suppressed = entry[1]
+        self._seen[key] = [now, 0]
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """Пишет только долю rate записей с extra sample=True; остальные — всегда."""
+
+    def __init__(self, rate: float = LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not getattr(record, "sample", False) or self.rate >= 1 or random.random() < self.rate
+
+
+def setup_logging(fmt: str = LOG_FORMAT, sample_rate: float = LOG_SAMPLE_RATE):
+    """Настраивает "bot" и "errors" один раз на процесс и возвращает (bot_logger, error_logger)."""
+    global _listener, _console
+    bot_logger = logging.getLogger("bot")
+    error_logger = logging.getLogger("errors")
+    if _listener is not None:
+        return bot_logger, error_logger
+
+    formatter = JsonFormatter() if fmt == "json" else TextFormatter("%(asctime)s [%(levelname)s] %(message)s")
+
+    # General bot logger — INFO and above
+    bot_file = RotatingFileHandler(filename="bot.log", maxBytes=2 * 1024 * 1024, backupCount=5, encoding="utf-8")
+    bot_file.addFilter(logging.Filter("bot"))
+    # Error logger — WARNING and above; в bot.log ошибки не попадают
+    error_file = RotatingFileHandler(filename="errors.log", maxBytes=2 * 1024 * 1024, backupCount=3,
+                                     encoding="utf-8")
+    error_file.addFilter(logging.Filter("errors"))
+    _console = logging.StreamHandler()
+    for handler in (bot_file, error_file, _console):
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    # фильтры — в вызывающем потоке, до очереди: отброшенная запись ничего не стоит
+    to_queue = QueueHandler(records)
+    to_queue.addFilter(DedupFilter())
+    to_queue.addFilter(SampleFilter(sample_rate))
+
+    bot_logger.setLevel(logging.INFO)
+    error_logger.setLevel(logging.WARNING)
+    for logger in (bot_logger, error_logger):
+        logger.addHandler(to_queue)
+        logger.propagate = False
+
+    _listener = QueueListener(records, bot_file, error_file, _console, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return bot_logger, error_logger
+
+
+def set_console_level(level: int):
+    if _console is not None:
+        _console.setLevel(level)
+
+
+def stop_logging():
+    """Дописывает очередь на диск и останавливает фоновый поток."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
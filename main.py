@@ -1,74 +1,43 @@
-import logging
-from logging.handlers import RotatingFileHandler
-
 import asyncio
+import functools
+import time
 import aiosqlite
-import re
 from aiogram import Bot, types
 from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
-from config import DB_NAME, BOT_TOKEN, CHANNEL_ID
-
-
-CHECK_INTERVAL = 5  # seconds between watcher loops
-DELAY_BETWEEN_PRODUCTS = 1.5  # seconds between sending each product
-CONCURRENT_LIMIT = 1  # safest for SendMediaGroup-heavy posts
-MAX_RETRIES = 3  # retry attempts for flood control
-
-
-AUTOPOST_INTERVAL = 60 * 60   # 60 минут
-AUTOPOST_BATCH_SIZE = 1       # 1 товар за цикл
-MIN_STOCK_TO_POST = 2         # “если больше 1”
-
-
-MANAGER_URL = "https://t.me/tumi_kazakhstan"  # <-- замени на юзернейм менеджера
-
-def build_kb(product_url: str) -> types.InlineKeyboardMarkup:
-    rows = []
-    if product_url:
-        rows.append([types.InlineKeyboardButton(text="КУПИТЬ", url=product_url)])
-    rows.append([types.InlineKeyboardButton(text="НАПИСАТЬ МЕНЕДЖЕРУ", url=MANAGER_URL)])
-    return types.InlineKeyboardMarkup(inline_keyboard=rows)
+from config import DB_NAME, BOT_TOKEN
+from rate_limiter import TelegramSender, PRIORITY_DELETE, PRIORITY_UPDATE, PRIORITY_AUTOPOST
+from change_feed import ChangeFeed
+from database import Database
+from migrations import migrate
+import queries
+import metrics
+from autopost_queue import MIN_STOCK_TO_POST, refresh_queue, mark_posted, next_for_autopost
+from pipeline import CANCEL_GRACE, SendPipeline
+from reconciler import reconcile, reconcile_loop
+from scheduler import Scheduler
+from images import cached_photo, image_loop
+from runtime import Supervisor, stop_event
+from product_cache import product_cache
+from render import render_post
+from channels import CHANNELS, Channel, route
+from log_setup import setup_logging
+
+
+CHECK_INTERVAL = 5  # seconds to wait before retrying a failed watcher batch
+FULL_SCAN_INTERVAL = 5 * 60  # safety full pass if no changes arrived (missed/failed sends)
+QUEUE_REBUILD_INTERVAL = 6 * 3600  # safety rebuild of autopost_queue; otherwise it follows the change feed
+# concurrency (SEND_WORKERS) and per-product ordering live in pipeline.SendPipeline
+# pacing and flood-control retries live in rate_limiter.TelegramSender
+
+
+# каналы, их фильтры, ссылка менеджера и расписание автопоста — в channels.py
+# MIN_STOCK_TO_POST, правила приоритета и cooldown — в autopost_queue.py
+# клавиатура и рендер подписи — в render.py
 
 
 # --- Logging Setup ---
-
-# Formatter
-formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
-
-# General bot logger — INFO and above
-bot_logger = logging.getLogger("bot")
-bot_logger.setLevel(logging.INFO)
-
-bot_handler = RotatingFileHandler(
-    filename="bot.log",
-    maxBytes=2 * 1024 * 1024,
-    backupCount=5,
-    encoding="utf-8"
-)
-bot_handler.setFormatter(formatter)
-bot_logger.addHandler(bot_handler)
-
-# Error logger — WARNING and above
-error_logger = logging.getLogger("errors")
-error_logger.setLevel(logging.WARNING)
-
-error_handler = RotatingFileHandler(
-    filename="errors.log",
-    maxBytes=2 * 1024 * 1024,
-    backupCount=3,
-    encoding="utf-8"
-)
-error_handler.setFormatter(formatter)
-error_logger.addHandler(error_handler)
-
-# ✅ Critical line: prevent error logs from going to bot.log
-error_logger.propagate = False
-
-# Console output
-console = logging.StreamHandler()
-console.setFormatter(formatter)
-bot_logger.addHandler(console)
-error_logger.addHandler(console)
+# bot.log (INFO+), errors.log (WARNING+) и консоль пишет фоновый поток — см. log_setup.py
+bot_logger, error_logger = setup_logging()
 
 # --- Test ---
 # bot_logger.info("INFO: bot logger working")
@@ -76,263 +45,437 @@ error_logger.addHandler(console)
 
 
 
-def clean_html(text: str) -> str:
-    if not text:
-        return ""
-    # переносы
-    text = re.sub(r'</?p[^>]*>', '\n', text)
-    text = re.sub(r'<br\s*/?>', '\n', text)
-
-    # удаляем все теги КРОМЕ <b>...</b>
-    text = re.sub(r'</?(?!b\b)[a-zA-Z][^>]*>', '', text)
+def photo_file_id(msg) -> str | None:
+    """file_id самого большого размера фото из ответа Telegram."""
+    photo = getattr(msg, "photo", None)
+    return photo[-1].file_id if photo else None
 
-    return text.strip()
 
-
-async def send_images(bot: Bot, chat_id: str, image_urls: list[str], caption: str, keyboard: types.InlineKeyboardMarkup):
+async def send_images(sender: TelegramSender, chat_id: str, image_urls: list[str], caption: str,
+                      keyboard: types.InlineKeyboardMarkup, priority: int = PRIORITY_UPDATE,
+                      file_id: str | None = None, path: str | None = None) -> tuple[list[int], str | None]:
+    """
+    Возвращает (message_ids, file_id отправленной картинки).
+    Фото: по file_id, иначе файлом из кэша картинок (path), иначе по ссылке.
+    """
     # всегда берём только 1-ю картинку
     if image_urls:
-        msg = await bot.send_photo(
+        photo_kwargs = dict(
+            priority=priority,
             chat_id=chat_id,
-            photo=image_urls[0],
             caption=caption,
             parse_mode="HTML",
             reply_markup=keyboard
         )
-        return [msg.message_id]
+        msg = None
+        if file_id:
+            # уже загруженная картинка: Telegram не качает её с нашего CDN заново
+            try:
+                msg = await sender.call("send_photo", photo=file_id, **photo_kwargs)
+            except TelegramBadRequest as e:
+                error_logger.warning(f"Cached file_id rejected, falling back to URL {image_urls[0]}: {e}")
+        if msg is None:
+            msg = await sender.call("send_photo", photo=cached_photo(path) or image_urls[0], **photo_kwargs)
+        return [msg.message_id], photo_file_id(msg)
 
     # если картинок нет — просто текст + кнопки
-    msg = await bot.send_message(
+    msg = await sender.call(
+        "send_message",
+        priority=priority,
         chat_id=chat_id,
         text=caption,
         parse_mode="HTML",
         reply_markup=keyboard,
         disable_web_page_preview=True
     )
-    return [msg.message_id]
-
+    return [msg.message_id], None
 
-async def delete_previous_messages(db: aiosqlite.Connection, bot: Bot, product_id: int):
-    async with db.execute("SELECT message_id FROM product_messages WHERE product_id = ?", (product_id,)) as cur:
-        rows = await cur.fetchall()
 
-    for (msg_id,) in rows:
+async def edit_in_place(sender: TelegramSender, chat_id, message_id: int, old_state: tuple, new_state: tuple,
+                        caption: str, keyboard: types.InlineKeyboardMarkup,
+                        priority: int = PRIORITY_UPDATE, file_id: str | None = None,
+                        path: str | None = None) -> bool:
+    """
+    Правит существующий пост вместо delete + repost.
+    state = (kind, media, caption_hash, markup_hash).
+    True — пост актуален, False — редактировать нельзя, нужен перепост.
+    """
+    old_kind, old_media, old_caption, old_markup = old_state
+    kind, media, caption_hash, markup_hash = new_state
+    if old_kind is None or old_kind != kind:
+        return False  # старые записи без состояния или фото <-> текст — только перепост
+
+    target = dict(priority=priority, chat_id=chat_id, message_id=message_id)
+    try:
+        if kind == "photo" and media != old_media:
+            await sender.call(
+                "edit_message_media", **target,
+                media=types.InputMediaPhoto(media=file_id or cached_photo(path) or media, caption=caption,
+                                            parse_mode="HTML"),
+                reply_markup=keyboard
+            )
+        elif caption_hash != old_caption and kind == "photo":
+            await sender.call(
+                "edit_message_caption", **target,
+                caption=caption, parse_mode="HTML", reply_markup=keyboard
+            )
+        elif caption_hash != old_caption:
+            await sender.call(
+                "edit_message_text", **target,
+                text=caption, parse_mode="HTML", reply_markup=keyboard, disable_web_page_preview=True
+            )
+        elif markup_hash != old_markup:
+            await sender.call("edit_message_reply_markup", **target, reply_markup=keyboard)
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            return True
+        error_logger.warning(f"Edit of message {message_id} failed, falling back to repost: {e}")
+        return False
+    return True
+
+
+async def get_message_ids(db: Database, channel: str, product_id: int) -> list[int]:
+    snapshot = await product_cache.get(db, product_id)
+    if snapshot is not None:
+        return snapshot.message_ids(channel)
+    # товар удалён из products, а посты остались
+    rows = await db.fetchall(queries.PRODUCT_MESSAGE_IDS, (product_id, channel))
+    return [row[0] for row in rows]
+
+
+async def delete_channel_messages(sender: TelegramSender, chat_id, product_id: int, message_ids: list[int],
+                                  priority: int = PRIORITY_DELETE):
+    """Удаляет сообщения из канала; записи в product_messages чистит вызывающий."""
+    async def delete_one(msg_id: int):
         try:
-            await bot.delete_message(chat_id=CHANNEL_ID, message_id=msg_id)
-            print(f"🗑️ Deleted message {msg_id}")
-            bot_logger.info(f"Deleted message {msg_id} for product {product_id}")
+            await sender.call("delete_message", priority=priority, chat_id=chat_id, message_id=msg_id)
+            bot_logger.info(f"🗑️ Deleted message {msg_id} for product {product_id}",
+                            extra={"product_id": product_id, "message_id": msg_id, "sample": True})
         except TelegramBadRequest:
-            print(f"⚠️ Message {msg_id} could not be deleted (already removed).")
-            error_logger.warning(f"Failed to delete message {msg_id} for product {product_id}")
+            error_logger.warning(f"⚠️ Message {msg_id} for product {product_id} could not be deleted "
+                                 f"(already removed)", extra={"product_id": product_id, "message_id": msg_id})
 
+    # темп задаёт sender, поэтому удаления можно отдавать пачкой
+    await asyncio.gather(*(delete_one(msg_id) for msg_id in message_ids))
 
-    await db.execute("DELETE FROM product_messages WHERE product_id = ?", (product_id,))
-    await db.commit()
 
-async def delete_out_of_stock(bot: Bot, db: aiosqlite.Connection, product_id: int):
-    """ Deletes Telegram messages when stock is gone """
-    print(f"🚫 Product {product_id} is OUT OF STOCK — removing posts...")
-    bot_logger.info(f"Product {product_id} OUT OF STOCK — deleting messages")
+async def delete_previous_messages(db: Database, sender: TelegramSender, channel: Channel, product_id: int,
+                                   priority: int = PRIORITY_DELETE):
+    message_ids = await get_message_ids(db, channel.key, product_id)
+    await delete_channel_messages(sender, channel.chat_id, product_id, message_ids, priority)
+
+    async with db.transaction() as tx:
+        await tx.execute("DELETE FROM product_messages WHERE product_id = ? AND channel = ?",
+                         (product_id, channel.key))
+    product_cache.invalidate([product_id])
 
-    await delete_previous_messages(db, bot, product_id)
+async def delete_out_of_stock(sender: TelegramSender, db: Database, channel: Channel, product_id: int):
+    """ Deletes Telegram messages when stock is gone """
+    # задача могла пролежать в очереди — товар с тех пор вернули на витрину: живой пост не трогаем
+    product = await product_cache.get(db, product_id)
+    if product and product.visible and (product.stock or 0) > 0:
+        bot_logger.info(f"Product {product_id} is back in stock, delete in {channel.key} skipped",
+                        extra={"product_id": product_id, "channel": channel.key})
+        return
+    bot_logger.info(f"🚫 Product {product_id} OUT OF STOCK — deleting messages in {channel.key}",
+                    extra={"product_id": product_id, "channel": channel.key})
+
+    await delete_previous_messages(db, sender, channel, product_id, PRIORITY_DELETE)
+    # поста больше нет — товар снова кандидат на автопост, когда вернётся на витрину
+    await refresh_queue(db, [product_id])
 
     # Optional: hide it from further processing
     # await db.execute("UPDATE products SET needs_update = 0 WHERE id = ?", (product_id,))
-    # await db.commit()
 
 
-async def save_message_ids(db: aiosqlite.Connection, product_id: int, message_ids: list[int]):
-    await db.executemany(
-        "INSERT INTO product_messages (product_id, message_id) VALUES (?, ?)",
-        [(product_id, mid) for mid in message_ids]
+async def save_message_ids(tx: aiosqlite.Connection, channel: str, product_id: int, message_ids: list[int],
+                           state: tuple = (None, None, None, None)):
+    """
+    Пишет в открытую транзакцию db.transaction(); commit делает вызывающий.
+    state — (kind, media, caption_hash, markup_hash) отправленного поста, нужен для edit-in-place.
+    """
+    await tx.executemany(
+        "INSERT INTO product_messages (product_id, channel, message_id, kind, media, caption_hash, markup_hash) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(product_id, channel, mid, *state) for mid in message_ids]
     )
-    await db.commit()
 
 
-# async def get_products_to_update(db: aiosqlite.Connection):
-#     async with db.execute("SELECT id FROM products WHERE visible = 1 AND needs_update = 1") as cursor:
-#         rows = await cursor.fetchall()
-#         return [r[0] for r in rows]
+async def mark_product_sent(tx: aiosqlite.Connection, product_id: int):
+    await tx.execute("UPDATE products SET needs_update = 0 WHERE id = ?", (product_id,))
 
-async def get_products_to_update(db: aiosqlite.Connection):
+
+async def finish_cancelled_send(sending: asyncio.Future, checkpoint=None):
     """
-    Возвращает два списка:
-      - update_list: товары, которые нужно отправить/обновить (needs_update = 1 и есть остаток)
-      - delete_list: товары, чьи посты нужно удалить (stock = 0 и есть сообщения в product_messages)
+    Остановка бота прервала отправку, а запрос мог уже уйти в Telegram: ждём его не дольше CANCEL_GRACE
+    и сохраняем checkpoint — после рестарта задача только допишет базу, второго поста не будет.
     """
-    # 1. Товары, которые нужно отправить / обновить
-    async with db.execute("""
-        SELECT id
-        FROM products
-        WHERE visible = 1
-          AND needs_update = 1
-          AND stock IS NOT NULL
-          AND stock > 0
-    """) as cursor:
-        rows = await cursor.fetchall()
-        update_list = [row[0] for row in rows]
-
-    # 2. Товары, по которым НУЖНО удалить посты (есть сообщения и нет остатков)
-    async with db.execute("""
-        SELECT DISTINCT p.id
-        FROM products p
-        JOIN product_messages pm ON pm.product_id = p.id
-        WHERE p.visible = 1
-          AND (p.stock IS NULL OR p.stock = 0)
-    """) as cursor:
-        rows = await cursor.fetchall()
-        delete_list = [row[0] for row in rows]
-
-    return update_list, delete_list
-
+    done, _ = await asyncio.wait([sending], timeout=CANCEL_GRACE)
+    if not done:
+        sending.cancel()  # всё ещё ждёт токен sender'а — в канал ничего не ушло
+        return
+    if not sending.cancelled() and sending.exception() is None and checkpoint:
+        message_ids, file_id = sending.result()
+        await checkpoint({"message_ids": message_ids, "file_id": file_id})
 
 
-async def mark_product_sent(db: aiosqlite.Connection, product_id: int):
-    await db.execute("UPDATE products SET needs_update = 0 WHERE id = ?", (product_id,))
-    await db.commit()
-
+async def send_product(sender: TelegramSender, db: Database, channel: Channel, product_id: int,
+                       priority: int = PRIORITY_UPDATE, sent: dict | None = None, checkpoint=None):
+    """
+    Публикует / обновляет пост товара. Ошибка Telegram пробрасывается — задачу повторит pipeline.
+    sent — checkpoint прошлой попытки ({"message_ids", "file_id"}): пост уже ушёл, осталось записать в базу.
+    checkpoint(result) — сохранить такой checkpoint сразу после отправки.
+    """
+    # товар, картинки и посты — из снимка (обычно уже прогретого get_many), без запросов к базе
+    product = await product_cache.get(db, product_id)
+    if not product:
+        return
+    # задача могла пролежать в очереди (backoff, лимиты) — товар с тех пор скрыли или раскупили
+    min_stock = MIN_STOCK_TO_POST if priority == PRIORITY_AUTOPOST else 1
+    if not sent and (not product.visible or (product.stock or 0) < min_stock):
+        bot_logger.info(f"Product {product_id} is no longer eligible for {channel.key}, send skipped",
+                        extra={"product_id": product_id, "channel": channel.key})
+        return
+
+    image_urls = [image_url for image_url, _, _ in product.images]
+    _, cached_file_id, cached_path = product.images[0] if product.images else (None, None, None)
+
+    # подпись и клавиатура из LRU по content_hash — неизменённый товар не рендерится заново
+    caption, kb, caption_hash, markup_hash = render_post(product.content_hash, product.name, product.description,
+                                                         product.url, bool(image_urls), channel.manager_url)
+    state = (
+        "photo" if image_urls else "text",
+        image_urls[0] if image_urls else None,
+        caption_hash,
+        markup_hash,
+    )
 
-async def send_product(bot: Bot, db: aiosqlite.Connection, product_id: int):
-    async with db.execute(
-        "SELECT name, description, url FROM products WHERE id = ? AND visible = 1",
-        (product_id,)
-    ) as cursor:
-        product = await cursor.fetchone()
-        if not product:
+    # 1 пост в канале -> пробуем отредактировать его (1 запрос вместо N удалений + отправки)
+    old_posts = product.posts.get(channel.key, [])
+    if sent:
+        # пост ушёл в прошлой попытке — его не трогаем и не шлём заново
+        old_posts = [row for row in old_posts if row[0] not in sent["message_ids"]]
+    elif len(old_posts) == 1:
+        message_id, *old_state = old_posts[0]
+        try:
+            edited = await edit_in_place(sender, channel.chat_id, message_id, tuple(old_state), state, caption, kb,
+                                         priority, cached_file_id, cached_path)
+        except Exception as e:
+            error_logger.error(f"⚠️ Error editing product {product_id}: {e}",
+                               extra={"product_id": product_id, "message_id": message_id, "channel": channel.key})
+            raise  # needs_update остаётся 1 — pipeline повторит задачу
+        if edited:
+            async with db.transaction() as tx:
+                await tx.execute(
+                    "UPDATE product_messages SET kind = ?, media = ?, caption_hash = ?, markup_hash = ? "
+                    "WHERE product_id = ? AND channel = ? AND message_id = ?",
+                    (*state, product_id, channel.key, message_id)
+                )
+                await mark_product_sent(tx, product_id)
+            product_cache.invalidate([product_id])
+            metrics.inc("edits_total", channel=channel.key)
+            bot_logger.info(f"✏️ Product {product_id} updated in place in {channel.key} (message {message_id}).",
+                            extra={"product_id": product_id, "message_id": message_id, "channel": channel.key,
+                                   "sample": True})
             return
-    name, description, url = product
-    description = clean_html(description)
-
-    async with db.execute(
-        "SELECT image_url FROM product_images WHERE product_id = ?", (product_id,)
-    ) as cursor:
-        images = await cursor.fetchall()
-        image_urls = [img[0] for img in images if img[0]]
-
-    await delete_previous_messages(db, bot, product_id)
 
-    kb = build_kb(url)
+    old_message_ids = [row[0] for row in old_posts]
+    await delete_channel_messages(sender, channel.chat_id, product_id, old_message_ids, priority)
 
-    caption = f"🛒 <b>{name}</b>\n\n{description}"
-    message_ids = []
-
-    for attempt in range(1, MAX_RETRIES + 1):
+    error = None
+    if sent:
+        message_ids, file_id = sent["message_ids"], sent.get("file_id")
+    else:
         try:
-            message_ids = await send_images(bot, CHANNEL_ID, image_urls, caption, kb)
-            break
+            # sender сам ждёт токен и повторяет запрос после retry_after
+            sending = asyncio.ensure_future(send_images(sender, channel.chat_id, image_urls, caption, kb,
+                                                        priority, cached_file_id, cached_path))
+            try:
+                message_ids, file_id = await asyncio.shield(sending)
+            except asyncio.CancelledError:
+                await finish_cancelled_send(sending, checkpoint)
+                raise
         except TelegramRetryAfter as e:
-            wait = getattr(e, "retry_after", 5)
-            backoff = wait * attempt
-            print(f"⚠️ Flood control hit for product {product_id}. Retry {attempt}/{MAX_RETRIES} after {backoff}s.")
-            error_logger.error(f"⚠️ Flood control hit for product {product_id}. Retry {attempt}/{MAX_RETRIES} after {backoff}s.")
-            await asyncio.sleep(backoff)
+            error_logger.error(f"⚠️ Flood control: giving up on product {product_id} for now: {e}",
+                               extra={"product_id": product_id, "channel": channel.key, "dedup": "flood:give_up"})
+            message_ids, file_id, error = [], None, e
         except Exception as e:
-            print(f"⚠️ Unexpected error sending product {product_id}: {e}")
-            error_logger.error(f"⚠️ Unexpected error sending product {product_id}: {e}")
-            return  # skip this product
+            error_logger.error(f"⚠️ Unexpected error sending product {product_id}: {e}",
+                               extra={"product_id": product_id, "channel": channel.key})
+            message_ids, file_id, error = [], None, e  # skip this product
+        if message_ids and checkpoint:
+            # пост уже в канале: если запись ниже не пройдёт, повтор задачи не опубликует его второй раз
+            await checkpoint({"message_ids": message_ids, "file_id": file_id})
+
+    # старые сообщения уже удалены из канала — одна транзакция (один fsync) на весь товар
+    async with db.transaction() as tx:
+        await tx.execute("DELETE FROM product_messages WHERE product_id = ? AND channel = ?",
+                         (product_id, channel.key))
+        if message_ids:
+            await save_message_ids(tx, channel.key, product_id, message_ids, state)
+            await mark_product_sent(tx, product_id)
+            await mark_posted(tx, channel.key, product_id)
+            if file_id and file_id != cached_file_id:
+                await tx.execute(
+                    "UPDATE product_images SET file_id = ? WHERE product_id = ? AND image_url = ?",
+                    (file_id, product_id, image_urls[0])
+                )
+    product_cache.invalidate([product_id])
+
+    if not message_ids and old_message_ids:
+        # старый пост удалён, новый не ушёл — товар снова кандидат на автопост
+        await refresh_queue(db, [product_id])
+
+    if error:
+        raise error
+
+    metrics.inc("posts_total", channel=channel.key)
+    bot_logger.info(f"✅ Product {product_id} posted to {channel.key}.",
+                    extra={"product_id": product_id, "message_id": message_ids[0] if message_ids else None,
+                           "channel": channel.key, "sample": True})
+
+
+async def get_changed_products(db: Database, product_ids: list[int]):
+    """
+    Что делать с товарами из ленты изменений:
+      - update_list: товары, которые нужно отправить/обновить (needs_update = 1 и есть остаток)
+      - delete_list: (channel, product_id) постов, которые нужно удалить (stock = 0, скрыт или удалён)
+    Полная сверка всех постов — reconciler.reconcile.
+    """
+    if not product_ids:
+        return [], []
+    marks = ",".join("?" * len(product_ids))
 
-    if message_ids:
-        await save_message_ids(db, product_id, message_ids)
-        await mark_product_sent(db, product_id)
-        print(f"✅ Product {product_id} posted.")
-        bot_logger.info(f"Product {product_id} posted.")
+    with metrics.timer("db_query_seconds", query="changed_to_update"):
+        rows = await db.fetchall(queries.CHANGED_TO_UPDATE.format(marks=marks), product_ids)
+    update_list = [row[0] for row in rows]
 
-    await asyncio.sleep(DELAY_BETWEEN_PRODUCTS)
+    with metrics.timer("db_query_seconds", query="changed_to_delete"):
+        delete_list = await db.fetchall(queries.CHANGED_TO_DELETE.format(marks=marks), product_ids)
 
+    return update_list, delete_list
 
-async def watch_products(bot: Bot):
-    semaphore = asyncio.Semaphore(CONCURRENT_LIMIT)
-    async with aiosqlite.connect(DB_NAME, timeout=30) as db:
-        while True:
-            try:
-                update_list, delete_list = await get_products_to_update(db)
-                # ⭐ Delete products that are OUT OF STOCK
-                for pid in delete_list:
-                    await delete_out_of_stock(bot, db, pid)
-
-                # Process normal updates
-                if update_list:
-                    async def sem_task(pid):
-                        async with semaphore:
-                            await send_product(bot, db, pid)
-                    await asyncio.gather(*(sem_task(pid) for pid in update_list))
-                else:
-                    print("⏱️ No updates found.")
 
-            except Exception as e:
-                print(f"⚠️ Error in watcher loop: {e}")
-                error_logger.error(f"⚠️ Error in watcher loop: {e}")
-            await asyncio.sleep(CHECK_INTERVAL)
-
-def get_type_priority(name: str, category: str) -> int:
-    n = (name or "").lower()
-    c = (category or "").lower()
-
-    if "каталог/рюкзаки" in c or "рюкзак" in n:
-        return 1
-    if "каталог/плечевые сумки" in c or "сумка" in n:
-        return 2
-    if "каталог/багаж" in c or "чемодан" in n or "ручная кладь" in c:
-        return 3
-    return 99
-
-
-
-async def get_products_for_autopost(db: aiosqlite.Connection, limit: int):
-    async with db.execute("""
-        SELECT p.id, p.name, p.category
-        FROM products p
-        LEFT JOIN product_messages pm ON pm.product_id = p.id
-        WHERE p.visible = 1
-          AND p.stock IS NOT NULL
-          AND p.stock >= ?
-          AND pm.product_id IS NULL
-    """, (MIN_STOCK_TO_POST,)) as cur:
-        rows = await cur.fetchall()
-
-    # ВАЖНО: передаём и name, и category
-    rows_sorted = sorted(rows, key=lambda x: get_type_priority(x[1], x[2]))
-    return [pid for pid, _, _ in rows_sorted[:limit]]
-
-async def autopost_loop(bot: Bot):
-    async with aiosqlite.connect(DB_NAME, timeout=30) as db:
+def make_pipeline(sender: TelegramSender, db: Database) -> SendPipeline:
+    async def handle(job, checkpoint):
+        channel = CHANNELS.get(job.channel)
+        if channel is None:
+            error_logger.warning(f"Job {job.id}: channel {job.channel!r} is not in the registry, skipped")
+            return
+        if job.kind == "delete":
+            await delete_out_of_stock(sender, db, channel, job.product_id)
+        else:
+            await send_product(sender, db, channel, job.product_id, job.priority, job.result, checkpoint)
+    return SendPipeline(db, handle)
+
+
+async def process_products(pipeline: SendPipeline, db: Database, update_list: list[int],
+                           delete_list: list[tuple[str, int]], origins: dict[int, float] | None = None):
+    """origins — {product_id: время изменения} из ленты изменений, для метрики задержки."""
+    # ⭐ Delete products that are OUT OF STOCK — у sender удаления в приоритетной полосе
+    # задачи durable: после enqueue их выполнение переживёт и падение вотчера, и рестарт
+    for key in CHANNELS:
+        await pipeline.enqueue("delete", [pid for channel, pid in delete_list if channel == key],
+                               PRIORITY_DELETE, key, origins)
+    # один товар -> все каналы, под фильтр которых он подходит
+    for key, ids in (await route(db, update_list)).items():
+        await pipeline.enqueue("send", ids, PRIORITY_UPDATE, key, origins)
+
+
+async def watch_products(pipeline: SendPipeline, db: Database):
+    feed = ChangeFeed(db)
+    await feed.start()
+    # тёплый старт: курсор ленты сохранён — всё, что изменилось за время простоя, придёт из outbox,
+    # а очередь автопоста, задачи и расписание лежат в базе; полный проход — только при первом запуске
+    # (и дальше по таймауту FULL_SCAN_INTERVAL, как страховка)
+    full_scan = not feed.resumed
+    rebuilt_at = None  # время последней полной пересборки очереди автопоста (monotonic)
+    try:
         while True:
             try:
-                ids = await get_products_for_autopost(db, AUTOPOST_BATCH_SIZE)
-                if ids:
-                    bot_logger.info(f"Autopost: posting {len(ids)} products")
-                    for pid in ids:
-                        await send_product(bot, db, pid)
-                        await asyncio.sleep(DELAY_BETWEEN_PRODUCTS)
+                if full_scan:
+                    product_cache.clear()  # изменения могли пройти мимо ленты (например, ручной SQL)
+                    # один проход сверки вместо двух полных запросов; остальное — по бюджету в следующий раз
+                    plan = await reconcile(pipeline, db)
+                    # очередь ведётся по ленте изменений; целиком — при первом проходе после старта,
+                    # если сверка нашла расхождения, и раз в QUEUE_REBUILD_INTERVAL
+                    if (rebuilt_at is None or len(plan) or plan.deferred
+                            or time.monotonic() - rebuilt_at >= QUEUE_REBUILD_INTERVAL):
+                        await refresh_queue(db)
+                        rebuilt_at = time.monotonic()
+                    full_scan = False
+                elif await feed.wait(timeout=FULL_SCAN_INTERVAL):
+                    ids, seq = await feed.read()
+                    product_cache.invalidate(ids)
+                    update_list, delete_list = await get_changed_products(db, ids)
+                    await process_products(pipeline, db, update_list, delete_list, feed.changed_at)
+                    await refresh_queue(db, ids)
+                    await feed.ack(seq)
                 else:
-                    bot_logger.info("Autopost: nothing to post")
-            except Exception as e:
-                error_logger.exception(f"Autopost loop error: {e}")
+                    full_scan = True
 
-            await asyncio.sleep(AUTOPOST_INTERVAL)
+            except Exception as e:
+                error_logger.error(f"⚠️ Error in watcher loop: {e}", extra={"dedup": "watcher"})
+                # курсор не сдвинут — эта же пачка будет обработана повторно
+                await asyncio.sleep(CHECK_INTERVAL)
+    finally:
+        await feed.close()
+
+async def collect_metrics(pipeline: SendPipeline, db: Database):
+    """Gauge, которые дешевле посчитать раз в минуту, чем вести на каждом событии."""
+    await pipeline.collect_metrics()
+    for key, queued in await db.fetchall("SELECT channel, COUNT(*) FROM autopost_queue GROUP BY channel"):
+        metrics.set_gauge("autopost_queue_size", queued, channel=key)
+    for key, posted in await db.fetchall(
+        "SELECT channel, COUNT(*) FROM channel_posts WHERE last_posted_at >= ? GROUP BY channel",
+        (time.time() - 3600,)
+    ):
+        metrics.set_gauge("posts_last_hour", posted, channel=key)
+
+
+async def autopost(pipeline: SendPipeline, db: Database, channel: Channel, slots: int = 1):
+    """Один слот расписания (после простоя — несколько): autopost_batch товаров на слот."""
+    ids = await next_for_autopost(db, channel.key, channel.autopost_batch * slots)
+    if ids:
+        await product_cache.get_many(db, ids)  # одна выборка на всю пачку, задачи возьмут из кэша
+        bot_logger.info(f"Autopost [{channel.key}]: posting {len(ids)} products")
+        await pipeline.enqueue("send", ids, PRIORITY_AUTOPOST, channel.key)
+    else:
+        bot_logger.info(f"Autopost [{channel.key}]: nothing to post")
+
+
+def make_scheduler(pipeline: SendPipeline, db: Database) -> Scheduler:
+    scheduler = Scheduler(db)
+    for channel in CHANNELS.values():
+        scheduler.add(channel.key, channel.schedule, functools.partial(autopost, pipeline, db, channel),
+                      channel.catch_up)
+    return scheduler
 
 
 if __name__ == "__main__":
 
-    bot = Bot(token=BOT_TOKEN)
     async def main():
-    # ensures session closes even after crash / KeyboardInterrupt
-        async with bot:
-            while True:
-                try:
-                    bot_logger.info("Starting watcher loop...")
-                    await asyncio.gather(
-                        watch_products(bot),   # удаление stock=0 + ручные обновления по needs_update
-                        autopost_loop(bot),    # автопостинг раз в 60 минут
-                    )
-                except KeyboardInterrupt:
-                    bot_logger.info("Bot stopped manually.")
-                    break
-                except Exception as e:
-                    error_logger.exception(f"Bot crashed: {e}. Restarting in 10s...")
-                    await asyncio.sleep(10)
-                else:
-                    bot_logger.warning("Watcher exited unexpectedly. Restarting in 5s...")
-                    await asyncio.sleep(5)
+        await migrate()  # схема, индексы, outbox и триггеры ленты изменений
+        stop = stop_event()  # SIGTERM / SIGINT
+        # выход в обратном порядке: циклы -> pipeline доделывает начатые отправки (DRAIN_TIMEOUT) ->
+        # sender -> база -> сессия бота; недоделанные задачи остаются в jobs до следующего старта
+        async with Bot(token=BOT_TOKEN) as bot, TelegramSender(bot) as sender, Database(DB_NAME) as db, \
+                make_pipeline(sender, db) as pipeline:
+            metrics_server = await metrics.serve()  # METRICS_PORT не задан — None
+            # каждый цикл перезапускается отдельно, соединения и pipeline живут весь процесс
+            supervisor = Supervisor()
+            supervisor.add("watcher", lambda: watch_products(pipeline, db))  # stock=0 + needs_update
+            # автопостинг: окна и частота у каждого канала свои, один таймер на все
+            supervisor.add("scheduler", lambda: make_scheduler(pipeline, db).run())
+            supervisor.add("reconciler", lambda: reconcile_loop(pipeline, db, sender))  # сверка с каналом
+            supervisor.add("images", lambda: image_loop(db))  # проверка и ресайз картинок до автопоста
+            supervisor.add("metrics", lambda: metrics.dump_loop(collect=lambda: collect_metrics(pipeline, db)))
+            bot_logger.info("Bot started.")
+            try:
+                await supervisor.run(stop)
+            finally:
+                if metrics_server:
+                    metrics_server.close()
+        bot_logger.info("Bot stopped.")
 
     asyncio.run(main())
@@ -1,9 +1,9 @@
 # mark_updated.py
-import sqlite3
 from config import DB_NAME
+from database import connect_sync
 
 def mark_product_updated(product_id: int):
-    conn = sqlite3.connect(DB_NAME)
+    conn = connect_sync(DB_NAME)
     cursor = conn.cursor()
 
     cursor.execute(
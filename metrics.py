@@ -0,0 +1,185 @@
+# metrics.py
+"""
+Счётчики, gauge и гистограммы латентности в памяти процесса — без зависимостей.
+
+    metrics.inc("telegram_calls_total", method="send_photo", result="ok")
+    metrics.observe("telegram_call_seconds", 0.42, method="send_photo")
+    with metrics.timer("db_query_seconds", query="products_to_update"):
+        ...
+
+Снаружи: Prometheus text format по HTTP (METRICS_PORT, GET /metrics)
+и/или JSON-снимок в файл раз в METRICS_INTERVAL секунд (METRICS_FILE).
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from config import METRICS_FILE, METRICS_PORT
+
+logger = logging.getLogger("errors")
+bot_logger = logging.getLogger("bot")
+
+METRICS_INTERVAL = 60  # как часто писать JSON-снимок
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+_counters: dict[tuple, float] = {}
+_gauges: dict[tuple, float] = {}
+_histograms: dict[tuple, list] = {}   # key -> [counts по BUCKETS + inf, sum, count]
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name: str, value: float = 1, **labels):
+    key = _key(name, labels)
+    _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    _gauges[_key(name, labels)] = value
+
+
+def observe(name: str, seconds: float, **labels):
+    key = _key(name, labels)
+    hist = _histograms.get(key)
+    if hist is None:
+        hist = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+    counts = hist[0]
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            counts[i] += 1
+            break
+    else:
+        counts[-1] += 1
+    hist[1] += seconds
+    hist[2] += 1
+
+
+@contextmanager
+def timer(name: str, **labels):
+    """Время блока (в т.ч. с await внутри) в гистограмму name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def _labels(labels: tuple, extra: str = "") -> str:
+    parts = [f'{k}="{str(v)}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render_prometheus() -> str:
+    lines = []
+    for kind, series in (("counter", _counters), ("gauge", _gauges)):
+        seen = set()
+        for (name, labels), value in sorted(series.items()):
+            if name not in seen:
+                lines.append(f"# TYPE {name} {kind}")
+                seen.add(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+    seen = set()
+    for (name, labels), (counts, total, count) in sorted(_histograms.items()):
+        if name not in seen:
+            lines.append(f"# TYPE {name} histogram")
+            seen.add(name)
+        cumulative = 0
+        for bound, n in zip(BUCKETS + ("+Inf",), counts):
+            cumulative += n
+            le = 'le="%s"' % bound
+            lines.append(f"{name}_bucket{_labels(labels, le)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {total}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def _quantile(counts: list, count: int, q: float):
+    """Оценка квантиля по корзинам: верхняя граница корзины, где накопилась доля q."""
+    if not count:
+        return None
+    target = q * count
+    cumulative = 0
+    for bound, n in zip(BUCKETS + (float("inf"),), counts):
+        cumulative += n
+        if cumulative >= target:
+            return bound
+    return None
+
+
+def snapshot() -> dict:
+    """Всё текущее состояние метрик словарём (для JSON-снимка)."""
+    def name_of(name, labels):
+        return name + _labels(labels)
+
+    return {
+        "time": time.time(),
+        "counters": {name_of(*k): v for k, v in sorted(_counters.items())},
+        "gauges": {name_of(*k): v for k, v in sorted(_gauges.items())},
+        "histograms": {
+            name_of(*k): {
+                "count": count,
+                "avg": total / count if count else None,
+                "p50": _quantile(counts, count, 0.5),
+                "p95": _quantile(counts, count, 0.95),
+                "p99": _quantile(counts, count, 0.99),
+            }
+            for k, (counts, total, count) in sorted(_histograms.items())
+        },
+    }
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass  # заголовки не нужны
+        path = request.split()[1].decode() if len(request.split()) > 1 else "/"
+        if path.startswith("/metrics.json"):
+            body, ctype, status = json.dumps(snapshot()), "application/json", "200 OK"
+        elif path.startswith("/metrics"):
+            body, ctype, status = render_prometheus(), "text/plain; version=0.0.4", "200 OK"
+        else:
+            body, ctype, status = "not found\n", "text/plain", "404 Not Found"
+        data = body.encode("utf-8")
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+        await writer.drain()
+    except Exception as e:
+        logger.warning(f"Metrics request failed: {e}")
+    finally:
+        writer.close()
+
+
+async def serve(port: int | None = METRICS_PORT, host: str = "127.0.0.1"):
+    """HTTP /metrics (Prometheus) и /metrics.json на localhost; без порта — ничего не делает."""
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle_http, host, int(port))
+    bot_logger.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+    return server
+
+
+async def dump_loop(path: str | None = METRICS_FILE, interval: float = METRICS_INTERVAL, collect=None):
+    """
+    Раз в interval секунд: collect() (обновить gauge из базы и т.п.) и JSON-снимок в path.
+    Без path только collect().
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if collect is not None:
+                await collect()
+            if path:
+                tmp = f"{path}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(snapshot(), f, ensure_ascii=False, indent=1)
+                os.replace(tmp, path)
+        except Exception as e:
+            logger.warning(f"Metrics snapshot failed: {e}")
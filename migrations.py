@@ -0,0 +1,364 @@
+# migrations.py
+"""
+Версионные миграции схемы (PRAGMA user_version) — заменяют init_db и init_message_table.py.
+
+    python migrations.py               # применить недостающие миграции
+    python migrations.py --check-plans # EXPLAIN QUERY PLAN горячих запросов, exit 1 при full scan
+"""
+import argparse
+import asyncio
+import re
+import sys
+
+import aiosqlite
+
+from config import DB_NAME
+from database import connect
+from change_feed import (CREATE_TABLE_PRODUCT_CHANGES, CREATE_TABLE_CHANGE_CURSORS, CREATE_CHANGE_TRIGGERS,
+                         CREATE_IMAGE_CHANGE_TRIGGER)
+from queries import HOT_QUERIES, INTENDED_SCANS
+from pipeline import CREATE_TABLE_JOBS
+from channels import DEFAULT_CHANNEL
+
+CREATE_TABLE_PRODUCTS = """
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,            -- Название товара или услуги
+    url TEXT,             -- URL
+    description TEXT,     -- Описание (HTML ok)
+    visible BOOLEAN ,      -- 1 => выставлен, 0 => скрыт
+    category TEXT,        -- Размещение на сайте
+    article TEXT,         -- Артикул
+    price REAL,           -- Цена продажи
+    old_price REAL,       -- Старая цена
+    stock INTEGER,        -- Остаток
+    message_id INTEGER    -- message_id in Telegram channel (optional)
+);
+"""
+
+CREATE_TABLE_IMAGES = """
+CREATE TABLE IF NOT EXISTS product_images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,
+    image_url TEXT NOT NULL,
+    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+);
+"""
+
+CREATE_TABLE_MESSAGES = """
+CREATE TABLE IF NOT EXISTS product_messages (
+    product_id INTEGER,
+    message_id INTEGER
+);
+"""
+
+
+async def column_names(db: aiosqlite.Connection, table: str) -> set[str]:
+    async with db.execute(f"PRAGMA table_info({table})") as cur:
+        return {row[1] for row in await cur.fetchall()}
+
+
+async def add_column(db: aiosqlite.Connection, table: str, column: str, ddl: str):
+    """ALTER TABLE ADD COLUMN, если колонки ещё нет (старые базы живут без миграций)."""
+    if column not in await column_names(db, table):
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+async def _v1_base_schema(db: aiosqlite.Connection):
+    await db.execute(CREATE_TABLE_PRODUCTS)
+    await db.execute(CREATE_TABLE_IMAGES)
+    await db.execute(CREATE_TABLE_MESSAGES)
+    # mark_updater.py и вотчер давно рассчитывают на needs_update
+    await add_column(db, "products", "needs_update", "INTEGER DEFAULT 0")
+    await add_column(db, "products", "content_hash", "TEXT")
+
+
+async def _v2_change_feed(db: aiosqlite.Connection):
+    await db.execute(CREATE_TABLE_PRODUCT_CHANGES)
+    await db.execute(CREATE_TABLE_CHANGE_CURSORS)
+    for trigger in CREATE_CHANGE_TRIGGERS:
+        await db.execute(trigger)
+
+
+async def _v3_message_keys(db: aiosqlite.Connection):
+    # у product_messages не было ключа — пересобираем с PRIMARY KEY, дубли схлопываются
+    await db.execute("""
+        CREATE TABLE product_messages_new (
+            product_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            PRIMARY KEY (product_id, message_id)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("""
+        INSERT OR IGNORE INTO product_messages_new (product_id, message_id)
+        SELECT product_id, message_id FROM product_messages
+        WHERE product_id IS NOT NULL AND message_id IS NOT NULL
+    """)
+    await db.execute("DROP TABLE product_messages")
+    await db.execute("ALTER TABLE product_messages_new RENAME TO product_messages")
+
+
+async def _v4_unique_article(db: aiosqlite.Connection):
+    # импорт всегда работал с первым товаром артикула — лишние копии скрываем и отвязываем
+    async with db.execute("""
+        SELECT COUNT(*) FROM products
+        WHERE article IS NOT NULL
+          AND id > (SELECT MIN(p2.id) FROM products p2 WHERE p2.article = products.article)
+    """) as cur:
+        duplicates = (await cur.fetchone())[0]
+    if duplicates:
+        print(f"⚠️ {duplicates} duplicate articles hidden and detached before adding the unique index.")
+        await db.execute("""
+            UPDATE products SET article = NULL, visible = 0, stock = 0
+            WHERE article IS NOT NULL
+              AND id > (SELECT MIN(p2.id) FROM products p2 WHERE p2.article = products.article)
+        """)
+    await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_article ON products(article)")
+
+
+async def _v5_hot_query_indexes(db: aiosqlite.Connection):
+    # вотчер: needs_update = 1 — обычно единицы строк, partial index почти ничего не весит
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_products_needs_update
+        ON products(id, visible, stock) WHERE needs_update = 1
+    """)
+    # вотчер: кандидаты на удаление постов (скрыт или нет остатка)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_products_unlisted
+        ON products(id) WHERE visible = 0 OR stock IS NULL OR stock = 0
+    """)
+    # автопост: видимые товары по остатку
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_products_visible_stock
+        ON products(stock, id) WHERE visible = 1
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_product_images_product ON product_images(product_id)")
+    await db.execute("ANALYZE")
+
+
+async def _v6_autopost_queue(db: aiosqlite.Connection):
+    await add_column(db, "products", "last_posted_at", "REAL")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS autopost_queue (
+            product_id INTEGER PRIMARY KEY,
+            priority INTEGER NOT NULL,
+            last_posted_at REAL
+        )
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_autopost_queue_order
+        ON autopost_queue(priority, last_posted_at, product_id)
+    """)
+    # триггер ленты изменений теперь следит и за name/category (от них зависит приоритет)
+    await db.execute("DROP TRIGGER IF EXISTS products_changes_au")
+    for trigger in CREATE_CHANGE_TRIGGERS:
+        await db.execute(trigger)
+
+
+async def _v7_post_state(db: aiosqlite.Connection):
+    # что именно сейчас висит в канале — чтобы править пост, а не удалять и слать заново
+    await add_column(db, "product_messages", "kind", "TEXT")          # photo / text
+    await add_column(db, "product_messages", "media", "TEXT")         # источник фото
+    await add_column(db, "product_messages", "caption_hash", "TEXT")
+    await add_column(db, "product_messages", "markup_hash", "TEXT")
+
+
+async def _v8_image_file_ids(db: aiosqlite.Connection):
+    # file_id от Telegram после первой отправки — повторные посты не качают картинку с CDN
+    await add_column(db, "product_images", "file_id", "TEXT")
+
+
+async def _v9_job_queue(db: aiosqlite.Connection):
+    await db.execute(CREATE_TABLE_JOBS)
+    # одна ждущая задача на ключ — на этом держится ON CONFLICT в enqueue
+    await db.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_pending_key
+        ON jobs(idem_key) WHERE state = 'pending'
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs(idem_key, state)")
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_ready
+        ON jobs(priority, id) WHERE state = 'pending'
+    """)
+    # автопост пропускает товары, по которым уже есть задача
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_active_product
+        ON jobs(product_id) WHERE state IN ('pending', 'in_flight')
+    """)
+
+
+async def _v10_channels(db: aiosqlite.Connection):
+    # посты, очередь автопоста, время последнего поста и задачи — по (channel, product_id);
+    # всё, что было до реестра каналов, относится к каналу DEFAULT_CHANNEL
+    await db.execute("""
+        CREATE TABLE product_messages_new (
+            product_id INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            message_id INTEGER NOT NULL,
+            kind TEXT,
+            media TEXT,
+            caption_hash TEXT,
+            markup_hash TEXT,
+            PRIMARY KEY (product_id, channel, message_id)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("""
+        INSERT INTO product_messages_new
+            (product_id, channel, message_id, kind, media, caption_hash, markup_hash)
+        SELECT product_id, ?, message_id, kind, media, caption_hash, markup_hash FROM product_messages
+    """, (DEFAULT_CHANNEL,))
+    await db.execute("DROP TABLE product_messages")
+    await db.execute("ALTER TABLE product_messages_new RENAME TO product_messages")
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS channel_posts (
+            channel TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            last_posted_at REAL NOT NULL,
+            PRIMARY KEY (channel, product_id)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("""
+        INSERT OR IGNORE INTO channel_posts (channel, product_id, last_posted_at)
+        SELECT ?, id, last_posted_at FROM products WHERE last_posted_at IS NOT NULL
+    """, (DEFAULT_CHANNEL,))
+
+    # очередь материализованная — пересоберётся при старте вотчера
+    await db.execute("DROP TABLE IF EXISTS autopost_queue")
+    await db.execute("""
+        CREATE TABLE autopost_queue (
+            channel TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            priority INTEGER NOT NULL,
+            last_posted_at REAL,
+            PRIMARY KEY (channel, product_id)
+        )
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_autopost_queue_order
+        ON autopost_queue(channel, priority, last_posted_at, product_id)
+    """)
+
+    await add_column(db, "jobs", "channel", f"TEXT NOT NULL DEFAULT '{DEFAULT_CHANNEL}'")
+    await db.execute("UPDATE jobs SET idem_key = kind || ':' || channel || ':' || product_id")
+
+
+async def _v11_message_checks(db: aiosqlite.Connection):
+    # когда reconciler последний раз убедился, что сообщение ещё есть в канале
+    await add_column(db, "product_messages", "checked_at", "REAL")
+
+
+async def _v12_content_hash_changes(db: aiosqlite.Connection):
+    # лента изменений ловит и смену content_hash — по ней сбрасывается product_cache
+    await db.execute("DROP TRIGGER IF EXISTS products_changes_au")
+    for trigger in CREATE_CHANGE_TRIGGERS:
+        await db.execute(trigger)
+
+
+
+async def _v13_schedule_state(db: aiosqlite.Connection):
+    # следующий слот автопоста каждого канала: рестарт не сбрасывает расписание
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS schedule_state (
+            channel TEXT PRIMARY KEY,
+            next_run REAL,
+            last_run REAL
+        )
+    """)
+
+
+
+async def _v14_image_status(db: aiosqlite.Connection):
+    # проверка и подготовка картинок (images.py): status NULL — ждёт, 'ready' — в локальном кэше, 'failed'
+    await add_column(db, "product_images", "status", "TEXT")
+    await add_column(db, "product_images", "path", "TEXT")
+    await add_column(db, "product_images", "error", "TEXT")
+    await add_column(db, "product_images", "checked_at", "REAL")
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_product_images_pending
+        ON product_images(id) WHERE status IS NULL AND image_url != ''
+    """)
+    # готовая картинка по той же ссылке у другого товара
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_product_images_url ON product_images(image_url)")
+    await db.execute(CREATE_IMAGE_CHANGE_TRIGGER)
+
+
+MIGRATIONS = [
+    (1, "base schema + needs_update/content_hash columns", _v1_base_schema),
+    (2, "change feed outbox and triggers", _v2_change_feed),
+    (3, "primary key on product_messages(product_id, message_id)", _v3_message_keys),
+    (4, "unique index on products.article", _v4_unique_article),
+    (5, "indexes for watcher/autopost hot queries", _v5_hot_query_indexes),
+    (6, "materialized autopost queue", _v6_autopost_queue),
+    (7, "rendered post state on product_messages", _v7_post_state),
+    (8, "telegram file_id cache on product_images", _v8_image_file_ids),
+    (9, "durable send job queue", _v9_job_queue),
+    (10, "per-channel posts, autopost queue and jobs", _v10_channels),
+    (11, "reconciler check time on product_messages", _v11_message_checks),
+    (12, "change feed tracks content_hash", _v12_content_hash_changes),
+    (13, "persisted autopost schedule", _v13_schedule_state),
+    (14, "image validation status and local cache path", _v14_image_status),
+]
+
+
+async def migrate(path: str = DB_NAME) -> int:
+    """Применяет недостающие миграции, каждую в своей транзакции. Возвращает версию схемы."""
+    db = await connect(path)
+    try:
+        async with db.execute("PRAGMA user_version") as cur:
+            version = (await cur.fetchone())[0]
+        for number, title, step in MIGRATIONS:
+            if number <= version:
+                continue
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                await step(db)
+                await db.execute(f"PRAGMA user_version = {number}")
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+            version = number
+            print(f"✅ Migration {number}: {title}")
+        return version
+    finally:
+        await db.close()
+
+
+# detail вида "SCAN products" / "SCAN p" — полный проход по таблице без индекса
+FULL_SCAN = re.compile(r"^SCAN \w+( AS \w+)?$")
+
+
+async def check_query_plans(path: str = DB_NAME) -> list[str]:
+    """EXPLAIN QUERY PLAN по HOT_QUERIES; возвращает список нарушений."""
+    db = await connect(path, readonly=True)
+    problems = []
+    try:
+        for name, (sql, params) in HOT_QUERIES.items():
+            async with db.execute(f"EXPLAIN QUERY PLAN {sql}", params) as cur:
+                details = [row[3] for row in await cur.fetchall()]
+            # SCAN подзапроса (CO-ROUTINE / MATERIALIZE) — проход по его результату, а не по таблице
+            subqueries = {d.split()[-1] for d in details if d.startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+            bad = [d for d in details if FULL_SCAN.match(d)
+                   and d.split()[-1] not in subqueries and d.split()[-1] != INTENDED_SCANS.get(name)]
+            status = "FULL SCAN" if bad else "ok"
+            print(f"{status:>9}  {name}: " + " | ".join(details))
+            problems += [f"{name}: {d}" for d in bad]
+    finally:
+        await db.close()
+    return problems
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Schema migrations")
+    parser.add_argument("--check-plans", action="store_true", help="fail if a hot query does a full table scan")
+    args = parser.parse_args()
+
+    version = await migrate()
+    print(f"Schema version: {version}")
+    if args.check_plans and await check_query_plans():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
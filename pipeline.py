@@ -0,0 +1,397 @@
+# pipeline.py
+"""
+Надёжная очередь задач отправки (таблица `jobs` в SQLite) и пул воркеров.
+
+Вотчер и автопост кладут задачи (send / delete по product_id) в `jobs`;
+N воркеров их забирают. Задача живёт в базе, поэтому падение или рестарт
+бота её не теряют: зависшие in_flight при старте возвращаются в pending.
+
+- idempotency key = "kind:channel:product_id": пока такая задача ждёт (pending),
+  повторная постановка её не дублирует (только поднимает приоритет);
+- задачи по одному товару выполняются строго по очереди (keyed lock);
+- ошибка -> повтор с экспоненциальной паузой, после MAX_ATTEMPTS — failed
+  (dead letter, `python pipeline.py --failed` / `--retry-failed`);
+- send-задача сохраняет message_ids сразу после отправки (checkpoint):
+  повтор после сбоя доделывает запись в базу, а не публикует пост второй раз;
+- готовых к запуску задач не больше SEND_QUEUE_SIZE: enqueue() ждёт, пока воркеры
+  не разберут очередь (backpressure для всплесков вотчера и сверки).
+
+Темп запросов к Telegram задаёт TelegramSender, а не sleep здесь.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import namedtuple
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+import metrics
+from channels import DEFAULT_CHANNEL
+
+if TYPE_CHECKING:
+    from database import Database
+
+logger = logging.getLogger("errors")
+
+SEND_WORKERS = 4          # параллельных воркеров
+SEND_QUEUE_SIZE = 1000    # готовых к запуску pending-задач; больше — enqueue() ждёт (backpressure)
+DRAIN_TIMEOUT = 30        # сколько ждать доработки начатых задач при остановке
+CANCEL_GRACE = 10         # прерванная по DRAIN_TIMEOUT отправка успевает дождаться ответа и записать checkpoint
+JOB_POLL_INTERVAL = 1.0   # как часто проверять отложенные (backoff) задачи
+MAX_ATTEMPTS = 5          # после этого — failed
+RETRY_BASE_DELAY = 30     # 30 с, 1 мин, 2 мин, 4 мин ...
+RETRY_MAX_DELAY = 3600
+FAILED_COOLDOWN = 24 * 3600   # столько failed-задача блокирует повторную постановку того же ключа
+DONE_RETENTION = 24 * 3600    # выполненные задачи храним сутки, потом чистим
+
+JOB_PENDING, JOB_IN_FLIGHT, JOB_DONE, JOB_FAILED = "pending", "in_flight", "done", "failed"
+
+CREATE_TABLE_JOBS = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idem_key TEXT NOT NULL,          -- "kind:channel:product_id"
+    kind TEXT NOT NULL,              -- send / delete
+    product_id INTEGER NOT NULL,
+    priority INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after REAL NOT NULL DEFAULT 0,
+    result TEXT,                     -- checkpoint send-задачи (JSON)
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+Job = namedtuple("Job", "id kind channel product_id priority attempts result")
+
+# handler(job, checkpoint): checkpoint(result) сохраняет промежуточный результат задачи
+Handler = Callable[[Job, Callable[[dict], Awaitable[None]]], Awaitable[None]]
+
+_CLAIM = """
+    UPDATE jobs SET state = 'in_flight', attempts = attempts + 1, updated_at = ?
+    WHERE id = (
+        SELECT id FROM jobs
+        WHERE state = 'pending' AND run_after <= ?
+        ORDER BY priority, id
+        LIMIT 1
+    )
+    RETURNING id, kind, channel, product_id, priority, attempts, result
+"""
+
+_ENQUEUE = """
+    INSERT INTO jobs (idem_key, kind, channel, product_id, priority, created_at, updated_at)
+    SELECT ?, ?, ?, ?, ?, ?, ?
+    WHERE NOT EXISTS (
+        SELECT 1 FROM jobs WHERE idem_key = ?1 AND state = 'failed' AND updated_at > ?8
+    )
+    ON CONFLICT (idem_key) WHERE state = 'pending'
+    DO UPDATE SET priority = MIN(priority, excluded.priority)
+    RETURNING id
+"""
+
+
+class KeyedLock:
+    """asyncio.Lock на ключ; освобождённые замки удаляются, чтобы словарь не рос."""
+
+    def __init__(self):
+        self._locks: dict = {}
+        self._waiters: dict = {}
+
+    async def acquire(self, key):
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            await lock.acquire()
+        except BaseException:
+            self._release_ref(key)
+            raise
+
+    def release(self, key):
+        self._locks[key].release()
+        self._release_ref(key)
+
+    def _release_ref(self, key):
+        self._waiters[key] -= 1
+        if not self._waiters[key]:
+            del self._waiters[key]
+            del self._locks[key]
+
+
+def retry_delay(attempts: int) -> float:
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+class SendPipeline:
+    def __init__(self, db: "Database", handler: Handler, workers: int = SEND_WORKERS,
+                 poll_interval: float = JOB_POLL_INTERVAL, maxsize: int = SEND_QUEUE_SIZE):
+        self.db = db
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.maxsize = maxsize
+        self._space = asyncio.Event()  # воркер забрал задачу — в очереди освободилось место
+        self.locks = KeyedLock()
+        self._waiters: dict[int, list[asyncio.Future]] = {}  # job id -> futures из run()
+        self._origins: dict[int, float] = {}  # job id -> время изменения товара (для метрик)
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self._running = 0
+        self._closing = False
+        self._last_prune = 0.0
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def start(self):
+        """Возвращает в очередь задачи, прерванные прошлым запуском, и запускает воркеров."""
+        if self._tasks:
+            return
+        async with self.db.transaction() as tx:
+            # на ключ остаётся одна задача — самая старая прерванная (у неё может быть checkpoint),
+            # она выполнится со свежими данными
+            await tx.execute(
+                "DELETE FROM jobs WHERE state = 'in_flight' AND id > ("
+                "    SELECT MIN(j2.id) FROM jobs j2 WHERE j2.idem_key = jobs.idem_key AND j2.state = 'in_flight')"
+            )
+            await tx.execute(
+                "DELETE FROM jobs WHERE state = 'pending' "
+                "AND idem_key IN (SELECT idem_key FROM jobs WHERE state = 'in_flight')"
+            )
+            async with tx.execute(
+                "UPDATE jobs SET state = 'pending', run_after = 0 WHERE state = 'in_flight'"
+            ) as cur:
+                recovered = cur.rowcount
+        if recovered:
+            logger.warning(f"Pipeline: {recovered} interrupted jobs returned to the queue")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def depth(self) -> int:
+        row = await self.db.fetchone("SELECT COUNT(*) FROM jobs WHERE state IN ('pending', 'in_flight')")
+        return row[0]
+
+    async def collect_metrics(self):
+        """Глубина очереди по состояниям и занятые воркеры — в gauge."""
+        counts = dict(await self.db.fetchall("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+        for state in ("pending", "in_flight", "failed"):
+            metrics.set_gauge("pipeline_jobs", counts.get(state, 0), state=state)
+        metrics.set_gauge("pipeline_busy_workers", self._running)
+
+    async def enqueue(self, kind: str, product_ids: list[int], priority: int,
+                      channel: str = DEFAULT_CHANNEL, origins: dict[int, float] | None = None) -> list[int]:
+        """
+        Ставит задачи и возвращает их id; очередь полна (SEND_QUEUE_SIZE) — ставит сколько влезает
+        одной транзакцией и ждёт, пока воркеры освободят место.
+        Уже ждущая задача того же ключа не дублируется; недавно упавшая (failed) — не ставится.
+        origins — {product_id: время изменения товара} для метрики «изменение -> выполнено».
+        """
+        product_ids = list(product_ids)
+        ids = []
+        while product_ids:
+            space = await self._wait_for_space()
+            batch, product_ids = product_ids[:space], product_ids[space:]
+            now = time.time()
+            async with self.db.transaction() as tx:
+                for pid in batch:
+                    async with tx.execute(
+                        _ENQUEUE, (f"{kind}:{channel}:{pid}", kind, channel, pid, priority, now, now,
+                                   now - FAILED_COOLDOWN)
+                    ) as cur:
+                        row = await cur.fetchone()
+                    if row:
+                        ids.append(row[0])
+                        if origins and pid in origins:
+                            self._origins.setdefault(row[0], origins[pid])
+            self._wakeup.set()
+        return ids
+
+    async def _wait_for_space(self) -> int:
+        """
+        Сколько задач ещё влезает; ждёт, пока готовых к запуску pending меньше maxsize.
+        Задачи в backoff не считаются — воркеров они не занимают.
+        """
+        while True:
+            if self._closing:
+                raise RuntimeError("pipeline is shutting down")
+            self._space.clear()
+            row = await self.db.fetchone(
+                "SELECT COUNT(*) FROM jobs WHERE state = 'pending' AND run_after <= ?", (time.time(),)
+            )
+            if row[0] < self.maxsize:
+                return self.maxsize - row[0]
+            metrics.inc("pipeline_backpressure_waits_total")
+            try:
+                await asyncio.wait_for(self._space.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, kind: str, product_ids: list[int], priority: int, channel: str = DEFAULT_CHANNEL):
+        """Поставить пачку задач и дождаться их выполнения (или ухода в backoff/failed)."""
+        loop = asyncio.get_running_loop()
+        futures = []
+        for job_id in await self.enqueue(kind, product_ids, priority, channel):
+            future = loop.create_future()
+            self._waiters.setdefault(job_id, []).append(future)
+            futures.append(future)
+        await asyncio.gather(*futures, return_exceptions=True)
+
+    async def _claim(self) -> Job | None:
+        now = time.time()
+        async with self.db.transaction() as tx:
+            async with tx.execute(_CLAIM, (now, now)) as cur:
+                row = await cur.fetchone()
+        if row is None:
+            return None
+        job_id, kind, channel, product_id, priority, attempts, result = row
+        return Job(job_id, kind, channel, product_id, priority, attempts, json.loads(result) if result else None)
+
+    async def _checkpoint(self, job: Job, result: dict):
+        await self.db.execute(
+            "UPDATE jobs SET result = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(result), time.time(), job.id)
+        )
+
+    async def _finish(self, job: Job, error: Exception | None):
+        now = time.time()
+        if error is None:
+            await self.db.execute(
+                "UPDATE jobs SET state = 'done', last_error = NULL, updated_at = ? WHERE id = ?", (now, job.id)
+            )
+            metrics.inc("pipeline_jobs_total", kind=job.kind, channel=job.channel, result="done")
+            origin = self._origins.pop(job.id, None)
+            if origin is not None:
+                metrics.observe("change_to_done_seconds", now - origin, kind=job.kind)
+        elif job.attempts >= MAX_ATTEMPTS:
+            logger.error(f"⚠️ Pipeline {job.kind} for product {job.product_id} ({job.channel}) failed "
+                         f"after {job.attempts} attempts, moved to dead letter: {error}",
+                         extra={"job_id": job.id, "product_id": job.product_id, "channel": job.channel})
+            await self.db.execute(
+                "UPDATE jobs SET state = 'failed', last_error = ?, updated_at = ? WHERE id = ?",
+                (str(error), now, job.id)
+            )
+            metrics.inc("pipeline_jobs_total", kind=job.kind, channel=job.channel, result="failed")
+            self._origins.pop(job.id, None)
+        else:
+            delay = retry_delay(job.attempts)
+            logger.error(f"⚠️ Pipeline {job.kind} failed for product {job.product_id} ({job.channel}) "
+                         f"(attempt {job.attempts}), retry in {delay:.0f}s: {error}",
+                         extra={"job_id": job.id, "product_id": job.product_id, "channel": job.channel})
+            await self.db.execute(
+                "UPDATE jobs SET state = 'pending', run_after = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                (now + delay, str(error), now, job.id)
+            )
+            metrics.inc("pipeline_jobs_total", kind=job.kind, channel=job.channel, result="retry")
+        for future in self._waiters.pop(job.id, []):
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    async def _prune(self):
+        now = time.time()
+        if now - self._last_prune < DONE_RETENTION / 24:
+            return
+        self._last_prune = now
+        await self.db.execute(
+            "DELETE FROM jobs WHERE state = 'done' AND updated_at < ?", (now - DONE_RETENTION,)
+        )
+
+    async def _worker(self):
+        while not self._closing:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                logger.error(f"⚠️ Pipeline claim failed: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._space.set()  # enqueue(), ждущий места, может ставить дальше
+            self._running += 1
+            await self.locks.acquire(job.product_id)
+            try:
+                error = None
+                try:
+                    with metrics.timer("pipeline_job_seconds", kind=job.kind):
+                        await self.handler(job, lambda result: self._checkpoint(job, result))
+                except Exception as e:
+                    error = e
+                await self._finish(job, error)
+                await self._prune()
+            except Exception as e:
+                # база недоступна — задача останется in_flight и вернётся в очередь при рестарте
+                logger.error(f"⚠️ Pipeline bookkeeping failed for job {job.id}: {e}")
+            finally:
+                self.locks.release(job.product_id)
+                self._running -= 1
+
+    async def close(self, timeout: float = DRAIN_TIMEOUT):
+        """
+        Перестаёт принимать и забирать задачи, даёт воркерам доделать уже начатые (не дольше timeout).
+        Потом отменяет их: send_product дожидается ушедшего запроса (CANCEL_GRACE) и пишет checkpoint,
+        прерванная задача остаётся in_flight и при следующем старте только допишет базу, без второго поста.
+        Ждущие задачи остаются в jobs и продолжатся при следующем старте.
+        """
+        self._closing = True
+        self._wakeup.set()
+        done, pending = await asyncio.wait(self._tasks, timeout=timeout) if self._tasks else (set(), set())
+        if pending:
+            logger.warning(f"Pipeline drain timed out, {len(pending)} workers still busy")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for futures in self._waiters.values():
+            for future in futures:
+                if not future.done():
+                    future.cancel()
+        self._waiters.clear()
+
+
+async def main():
+    from config import DB_NAME
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Send job queue")
+    parser.add_argument("--failed", action="store_true", help="list dead-lettered jobs")
+    parser.add_argument("--retry-failed", action="store_true", help="return dead-lettered jobs to the queue")
+    args = parser.parse_args()
+
+    async with Database(DB_NAME, readers=1) as db:
+        if args.retry_failed:
+            async with db.transaction() as tx:
+                async with tx.execute(
+                    "UPDATE jobs SET state = 'pending', attempts = 0, run_after = 0, updated_at = ? "
+                    "WHERE state = 'failed' AND NOT EXISTS ("
+                    "    SELECT 1 FROM jobs j2 WHERE j2.idem_key = jobs.idem_key AND j2.state = 'pending')"
+                    "  AND id = ("
+                    "    SELECT MAX(j3.id) FROM jobs j3 WHERE j3.idem_key = jobs.idem_key AND j3.state = 'failed')",
+                    (time.time(),)
+                ) as cur:
+                    print(f"Requeued: {cur.rowcount}")
+            return
+        if args.failed:
+            for row in await db.fetchall(
+                "SELECT id, kind, channel, product_id, attempts, last_error FROM jobs "
+                "WHERE state = 'failed' ORDER BY id"
+            ):
+                print(*row, sep="\t")
+            return
+        for state, n in await db.fetchall("SELECT state, COUNT(*) FROM jobs GROUP BY state ORDER BY state"):
+            print(f"{state}: {n}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,228 @@
+# preview.py
+"""
+Сухой прогон: что бот опубликовал бы по каждому товару — без Telegram и без записи в базу.
+
+Для каждого товара рендерит подпись и клавиатуру так же, как send_product
+(заголовок + clean_html описания, build_kb), и отмечает проблемы:
+  caption_too_long — подпись длиннее лимита Telegram и будет обрезана (с «…»);
+  missing_name     — нет названия;
+  missing_url      — нет ссылки на товар (только кнопка менеджера);
+  bad_url          — ссылка не http(s): Telegram отклонит клавиатуру, пост не уйдёт;
+  missing_image    — картинок нет, уйдёт текстовый пост;
+  image_failed     — все картинки отклонены images.py, в автопост не попадёт;
+  image_pending    — картинка ещё не проверена, в автопост попадёт после images.py.
+Плюс приоритет (get_type_priority) и место в очереди автопоста каждого канала с
+примерным временем слота по расписанию канала.
+
+Рендер — в пуле процессов пачками по PREVIEW_CHUNK; база читается одним проходом.
+
+    python preview.py                          # сводка по текущей базе
+    python preview.py --out report.csv         # полный отчёт (.csv или .json)
+    python import_data.py new_supplier.xlsx --dry-run --report report.json
+                                               # новый файл: импорт в копию базы + отчёт
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import queries
+from autopost_queue import AUTOPOST_COOLDOWN, MIN_STOCK_TO_POST, get_type_priority
+from channels import CHANNELS
+from config import DB_NAME
+from database import connect_sync
+from render import CAPTION_LIMIT, MESSAGE_LIMIT, build_kb, caption_length
+from scheduler import format_slot
+
+PREVIEW_CHUNK = 2000     # товаров на задачу пула
+ETA_SLOTS = 2000         # на сколько слотов вперёд считать время публикации
+REPORT_FIELDS = ("id", "article", "name", "priority", "eligible", "caption_length", "caption_limit",
+                 "buttons", "problems", "channels", "positions", "eta")
+
+# товар + статус первой годной картинки, как её выберет send_product ('pending' — не проверена,
+# NULL — годной нет), и сколько непустых ссылок на картинки всего
+PREVIEW_PRODUCTS = """
+    SELECT p.id, p.article, p.name, p.description, p.url, p.category, p.visible, p.stock,
+           (SELECT COALESCE(i.status, 'pending') FROM product_images i
+            WHERE i.product_id = p.id AND i.image_url != '' AND i.status IS NOT 'failed'
+            ORDER BY i.id LIMIT 1),
+           (SELECT COUNT(*) FROM product_images i WHERE i.product_id = p.id AND i.image_url != '')
+    FROM products p
+    ORDER BY p.id
+"""
+
+
+@lru_cache(maxsize=None)
+def keyboard_buttons(has_url: bool) -> tuple[str, ...]:
+    """Кнопки build_kb: раскладка зависит только от того, есть ли ссылка на товар."""
+    keyboard = build_kb("https://example.com" if has_url else "")
+    return tuple(button.text for row in keyboard.inline_keyboard for button in row)
+
+
+def check_product(row) -> dict:
+    """Рендер и проверки одного товара (в процессе пула)."""
+    (product_id, article, name, description, url, category, visible, stock, image_status, images) = row
+    limit = CAPTION_LIMIT if image_status else MESSAGE_LIMIT  # фото — если есть годная картинка
+    length = caption_length(name, description)
+
+    problems = []
+    if length > limit:
+        problems.append("caption_too_long")
+    if not name:
+        problems.append("missing_name")
+    if not url:
+        problems.append("missing_url")
+    elif not url.startswith(("http://", "https://")):
+        problems.append("bad_url")
+    if not images:
+        problems.append("missing_image")
+    elif image_status is None:
+        problems.append("image_failed")
+    elif image_status != "ready":
+        problems.append("image_pending")
+
+    return {
+        "id": product_id,
+        "article": article,
+        "name": name,
+        "priority": get_type_priority(name, category),
+        "eligible": bool(visible) and (stock or 0) >= MIN_STOCK_TO_POST,
+        "caption_length": length,
+        "caption_limit": limit,
+        "buttons": list(keyboard_buttons(bool(url))),
+        "problems": problems,
+        "channels": [key for key, channel in CHANNELS.items() if channel.matches(name, category)],
+    }
+
+
+def check_chunk(rows: list) -> list[dict]:
+    return [check_product(row) for row in rows]
+
+
+def queue_positions(conn, now: float) -> dict[str, dict[int, int]]:
+    """{channel: {product_id: место в очереди}} — тот же отбор и порядок, что autopost_queue + AUTOPOST_NEXT."""
+    positions = {}
+    for key, channel in CHANNELS.items():
+        rows = conn.execute(queries.AUTOPOST_CANDIDATES, (key, MIN_STOCK_TO_POST)).fetchall()
+        queued = sorted(
+            (get_type_priority(name, category), posted_at is not None, posted_at or 0, pid)
+            for pid, name, category, posted_at in rows
+            if channel.matches(name, category) and (posted_at is None or posted_at < now - AUTOPOST_COOLDOWN)
+        )
+        positions[key] = {item[-1]: i for i, item in enumerate(queued, 1)}
+    return positions
+
+
+def slot_times(channel, count: int, now: float) -> list[float]:
+    """Время ближайших count слотов канала."""
+    slots, slot = [], now
+    while len(slots) < count:
+        slot = channel.schedule.next_slot(slot)
+        if slot is None:
+            break
+        slots.append(slot)
+    return slots
+
+
+def preview(db_path: str = DB_NAME, workers: int | None = None) -> list[dict]:
+    """Отчёт по всем товарам базы db_path (по строке на товар)."""
+    now = time.time()
+    conn = connect_sync(db_path)
+    try:
+        rows = conn.execute(PREVIEW_PRODUCTS).fetchall()
+        positions = queue_positions(conn, now)
+    finally:
+        conn.close()
+    chunks = [rows[i:i + PREVIEW_CHUNK] for i in range(0, len(rows), PREVIEW_CHUNK)]
+    if len(chunks) > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            report = [item for chunk in pool.map(check_chunk, chunks) for item in chunk]
+    else:
+        report = [item for chunk in chunks for item in check_chunk(chunk)]
+
+    slots = {}
+    for key, channel in CHANNELS.items():
+        batch = max(channel.autopost_batch, 1)
+        slots[key] = (batch, slot_times(channel, min(ETA_SLOTS, len(positions[key]) // batch + 1), now))
+    for item in report:
+        item["positions"] = {key: positions[key][item["id"]] for key in item["channels"]
+                             if item["id"] in positions[key]}
+        item["eta"] = {}
+        for key, position in item["positions"].items():
+            batch, times = slots[key]
+            index = (position - 1) // batch
+            if index < len(times):
+                item["eta"][key] = format_slot(times[index])
+    return report
+
+
+def summary(report: list[dict]) -> str:
+    problems = Counter(problem for item in report for problem in item["problems"])
+    eligible = sum(item["eligible"] for item in report)
+    lines = [f"Товаров: {len(report)}, на витрине с остатком: {eligible}"]
+    lines += [f"  {problem}: {count}" for problem, count in problems.most_common()]
+    for key in CHANNELS:
+        queued = sorted((item["positions"][key], item) for item in report if key in item["positions"])
+        lines.append(f"Очередь {key}: {len(queued)}")
+        for position, item in queued[:5]:
+            lines.append(f"  {position:>4}. [{item['priority']}] {item['name']} — {item['eta'].get(key, '?')}")
+    return "\n".join(lines)
+
+
+def write_report(report: list[dict], path: str):
+    """JSON (список объектов) или CSV (по расширению; списки и словари — через "; ")."""
+    if path.endswith(".json"):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        return
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_FIELDS)
+        for item in report:
+            row = []
+            for field in REPORT_FIELDS:
+                value = item[field]
+                if isinstance(value, dict):
+                    value = "; ".join(f"{k}={v}" for k, v in value.items())
+                elif isinstance(value, list):
+                    value = "; ".join(map(str, value))
+                row.append(value)
+            writer.writerow(row)
+
+
+def copy_database(db_path: str, target: str):
+    """Консистентная копия базы (sqlite backup) — работающий бот не мешает."""
+    if not os.path.exists(db_path):
+        return  # новая база: импорт создаст схему сам
+    source, copy = connect_sync(db_path), connect_sync(target)
+    try:
+        source.backup(copy)
+    finally:
+        source.close()
+        copy.close()
+
+
+def report_preview(db_path: str, out: str | None = None, workers: int | None = None):
+    start = time.perf_counter()
+    report = preview(db_path, workers)
+    print(summary(report))
+    print(f"({time.perf_counter() - start:.1f} s)")
+    if out:
+        write_report(report, out)
+        print(f"Report: {out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preview what the bot would post for every product (dry run)")
+    parser.add_argument("--out", help="write the full report (.json or .csv)")
+    parser.add_argument("--workers", type=int, help="render processes (default: CPU count)")
+    args = parser.parse_args()
+    report_preview(DB_NAME, args.out, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# prewarm_images.py
+"""
+Предзагрузка картинок в Telegram до публикации.
+
+Для товаров из очереди автопоста, у первой картинки которых ещё нет file_id,
+отправляет фото в служебный чат PREWARM_CHAT_ID, запоминает file_id и сразу
+удаляет сообщение (проверенные картинки — файлом из кэша images.py).
+Потом пост в канал уходит по file_id — без скачивания с CDN.
+
+    python prewarm_images.py [--limit 200]
+"""
+import argparse
+import asyncio
+
+from aiogram import Bot
+
+from config import BOT_TOKEN, DB_NAME, PREWARM_CHAT_ID
+from rate_limiter import TelegramSender, PRIORITY_BULK
+from database import Database
+from images import cached_photo
+
+PREWARM_LIMIT = 200
+
+# первая картинка (как в send_product) у товаров из очереди автопоста, ещё без file_id
+MISSING_FILE_IDS = """
+    SELECT q.product_id, pi.image_url, pi.path
+    FROM autopost_queue q
+    JOIN product_images pi ON pi.id = (
+        SELECT MIN(id) FROM product_images
+        WHERE product_id = q.product_id AND image_url != '' AND status IS NOT 'failed'
+    )
+    WHERE pi.file_id IS NULL
+    GROUP BY q.product_id
+    ORDER BY MIN(q.priority), MIN(q.last_posted_at), q.product_id
+    LIMIT ?
+"""
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Upload queued product images to Telegram ahead of posting")
+    parser.add_argument("--limit", type=int, default=PREWARM_LIMIT)
+    args = parser.parse_args()
+
+    if not PREWARM_CHAT_ID:
+        print("PREWARM_CHAT_ID is not set — nothing to do.")
+        return
+
+    bot = Bot(token=BOT_TOKEN)
+    async with TelegramSender(bot) as sender, Database(DB_NAME, readers=1) as db:
+        rows = await db.fetchall(MISSING_FILE_IDS, (args.limit,))
+        print(f"Картинок без file_id: {len(rows)}")
+
+        cached = []
+        failed = 0
+
+        async def upload(product_id, image_url, path):
+            nonlocal failed
+            try:
+                msg = await sender.call("send_photo", priority=PRIORITY_BULK,
+                                        chat_id=PREWARM_CHAT_ID, photo=cached_photo(path) or image_url)
+            except Exception as e:
+                failed += 1
+                print(f"Не загрузилось: product_id={product_id}, url={image_url}, err={e}")
+                return
+            if msg.photo:
+                cached.append((msg.photo[-1].file_id, product_id, image_url))
+            try:
+                await sender.call("delete_message", priority=PRIORITY_BULK,
+                                  chat_id=PREWARM_CHAT_ID, message_id=msg.message_id)
+            except Exception as e:
+                print(f"Не удалилось служебное сообщение {msg.message_id}: {e}")
+
+        await asyncio.gather(*(upload(*row) for row in rows))
+
+        await db.executemany(
+            "UPDATE product_images SET file_id = ? WHERE product_id = ? AND image_url = ?",
+            cached
+        )
+        print(f"Сохранено file_id: {len(cached)}, ошибок: {failed}")
+
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+# product_cache.py
+"""
+Read-through кэш товаров для отправки постов.
+
+Товар, его картинки (с file_id и файлом в кэше) и записанные посты по каналам читаются одним
+запросом (queries.PRODUCT_SNAPSHOTS, картинки и посты — json_group_array), пачкой
+через get_many(ids). send_product, удаление постов и reconciler берут всё
+из снимка — без отдельных SELECT на товар, картинки и product_messages.
+
+Инвалидация:
+  - вотчер сбрасывает id из ленты изменений (триггер ловит и смену content_hash,
+    т.е. любую правку импорта / stock_sync, в том числе из других процессов);
+  - код бота сбрасывает товар после своих записей (посты, file_id, needs_update);
+  - на всякий случай снимок старше PRODUCT_CACHE_TTL перечитывается
+    (product_messages могут менять сервисные скрипты).
+Размер ограничен PRODUCT_CACHE_SIZE записями (LRU).
+"""
+import json
+import time
+from collections import OrderedDict
+
+import metrics
+import queries
+
+PRODUCT_CACHE_SIZE = 2000   # товаров в памяти; описание — основной вес, ~несколько КБ на товар
+PRODUCT_CACHE_TTL = 300     # секунд
+GET_MANY_CHUNK = 500        # id в одном IN (...)
+
+
+class ProductSnapshot:
+    """
+    Товар как его видит send_product. images: ((url, file_id, path в кэше картинок), ...) без отклонённых;
+    posts: {channel: [(message_id, kind, media, caption_hash, markup_hash)]}.
+    """
+    __slots__ = ("id", "name", "description", "url", "category", "visible", "stock", "content_hash",
+                 "images", "posts", "loaded_at")
+
+    def __init__(self, row, loaded_at: float):
+        (self.id, self.name, self.description, self.url, self.category, self.visible, self.stock,
+         self.content_hash, images, posts) = row
+        # только непустые ссылки, как отправляет send_images
+        self.images = tuple((url, file_id, path) for url, file_id, path in json.loads(images) if url)
+        self.posts = {}
+        for channel, *post in json.loads(posts):
+            self.posts.setdefault(channel, []).append(tuple(post))
+        self.loaded_at = loaded_at
+
+    def message_ids(self, channel: str) -> list[int]:
+        return [post[0] for post in self.posts.get(channel, ())]
+
+
+class ProductCache:
+    def __init__(self, size: int = PRODUCT_CACHE_SIZE, ttl: float = PRODUCT_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._items: OrderedDict[int, ProductSnapshot] = OrderedDict()
+        self._epoch = 0  # растёт при каждой инвалидации
+
+    def __len__(self):
+        return len(self._items)
+
+    async def get(self, db, product_id: int) -> ProductSnapshot | None:
+        """Снимок товара или None, если товара нет."""
+        return (await self.get_many(db, [product_id])).get(product_id)
+
+    async def get_many(self, db, product_ids: list[int]) -> dict[int, ProductSnapshot]:
+        """{id: снимок} — всё, чего нет в кэше, одним запросом на GET_MANY_CHUNK id."""
+        now = time.monotonic()
+        found, missing = {}, []
+        for pid in dict.fromkeys(product_ids):
+            snapshot = self._items.get(pid)
+            if snapshot is not None and now - snapshot.loaded_at < self.ttl:
+                self._items.move_to_end(pid)
+                found[pid] = snapshot
+            else:
+                missing.append(pid)
+        metrics.inc("product_cache_total", len(found), result="hit")
+        metrics.inc("product_cache_total", len(missing), result="miss")
+
+        for i in range(0, len(missing), GET_MANY_CHUNK):
+            chunk = missing[i:i + GET_MANY_CHUNK]
+            epoch = self._epoch
+            with metrics.timer("db_query_seconds", query="product_snapshots"):
+                rows = await db.fetchall(queries.PRODUCT_SNAPSHOTS.format(marks=",".join("?" * len(chunk))), chunk)
+            for row in rows:
+                snapshot = found[row[0]] = ProductSnapshot(row, now)
+                # пока читали, что-то сбросили — снимок мог устареть, не кэшируем
+                if epoch == self._epoch:
+                    self._items[snapshot.id] = snapshot
+                    self._items.move_to_end(snapshot.id)
+        while len(self._items) > self.size:
+            self._items.popitem(last=False)
+        return found
+
+    def invalidate(self, product_ids):
+        self._epoch += 1
+        for pid in product_ids:
+            self._items.pop(pid, None)
+
+    def clear(self):
+        self._epoch += 1
+        self._items.clear()
+
+
+product_cache = ProductCache()
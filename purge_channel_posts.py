@@ -1,39 +1,140 @@
+"""
+Удаление постов из канала пачками.
+
+    python purge_channel_posts.py                      # все посты
+    python purge_channel_posts.py --out-of-stock       # только товары без остатка
+    python purge_channel_posts.py --category рюкзаки --older-than 30
+    python purge_channel_posts.py --channel tumi       # только один канал из channels.py
+
+Сообщения удаляются через delete_messages по PURGE_BATCH_SIZE штук, темп задаёт
+TelegramSender. После каждой удачной пачки её строки сразу уходят из
+product_messages (это и есть чекпоинт): после падения или Ctrl+C повторный
+запуск продолжит с того, что ещё висит в канале.
+"""
+import argparse
 import asyncio
-import aiosqlite
+import time
+
 from aiogram import Bot
-from config import BOT_TOKEN, CHANNEL_ID, DB_NAME  # у тебя это уже есть в проекте
+from config import BOT_TOKEN, DB_NAME  # у тебя это уже есть в проекте
+from channels import CHANNELS, Channel
+from rate_limiter import TelegramSender, PRIORITY_BULK
+from database import Database
+from autopost_queue import refresh_queue
 
-async def main():
-    bot = Bot(token=BOT_TOKEN)
+PURGE_BATCH_SIZE = 100  # максимум message_ids в одном delete_messages
+
+PURGE_CANDIDATES = """
+    SELECT pm.channel, pm.product_id, pm.message_id
+    FROM product_messages pm
+    LEFT JOIN products p ON p.id = pm.product_id
+    WHERE 1 = 1
+"""
 
-    async with aiosqlite.connect(DB_NAME, timeout=30) as db:
-        async with db.execute("SELECT product_id, message_id FROM product_messages") as cur:
-            rows = await cur.fetchall()
 
-        print(f"Найдено сообщений для удаления: {len(rows)}")
+def build_query(channel: str | None, category: str | None, out_of_stock: bool,
+                older_than: float | None) -> tuple[str, list]:
+    sql, params = PURGE_CANDIDATES, []
+    if channel:
+        sql += " AND pm.channel = ?"
+        params.append(channel)
+    if category:
+        sql += " AND p.category LIKE ?"
+        params.append(f"%{category}%")
+    if out_of_stock:
+        sql += " AND (p.id IS NULL OR p.stock IS NULL OR p.stock = 0)"
+    if older_than is not None:
+        # время отправки текущего поста в этом канале; у старых постов его нет — считаем старыми
+        sql += (" AND NOT EXISTS (SELECT 1 FROM channel_posts cp WHERE cp.channel = pm.channel"
+                " AND cp.product_id = pm.product_id AND cp.last_posted_at >= ?)")
+        params.append(time.time() - older_than * 24 * 3600)
+    return sql + " ORDER BY pm.channel, pm.message_id", params
 
-        deleted = 0
-        failed = 0
 
-        for product_id, message_id in rows:
+async def purge_batch(sender: TelegramSender, db: Database, channel: Channel,
+                      batch: list[tuple[int, int]]) -> tuple[int, int]:
+    """Удаляет пачку одного канала и сразу вычёркивает её из product_messages. Возвращает (удалено, ошибок)."""
+    message_ids = [mid for _, mid in batch]
+    try:
+        # ненайденные сообщения Telegram просто пропускает
+        await sender.call("delete_messages", priority=PRIORITY_BULK,
+                          chat_id=channel.chat_id, message_ids=message_ids)
+        done = batch
+    except Exception as e:
+        print(f"Пачка {message_ids[0]}..{message_ids[-1]} не удалилась ({e}), удаляю по одному")
+        done = []
+        for product_id, message_id in batch:
             try:
-                await bot.delete_message(chat_id=CHANNEL_ID, message_id=message_id)
-                deleted += 1
+                await sender.call("delete_message", priority=PRIORITY_BULK,
+                                  chat_id=channel.chat_id, message_id=message_id)
+                done.append((product_id, message_id))
             except Exception as e:
-                failed += 1
                 print(f"Не удалилось: product_id={product_id}, message_id={message_id}, err={e}")
 
-            await asyncio.sleep(0.05)  # чтобы не упереться в лимиты
+    if done:
+        async with db.transaction() as tx:
+            await tx.executemany(
+                "DELETE FROM product_messages WHERE product_id = ? AND channel = ? AND message_id = ?",
+                [(pid, channel.key, mid) for pid, mid in done]
+            )
+            # чтобы ничего не перепостилось вручную
+            await tx.executemany(
+                "UPDATE products SET needs_update = 0 WHERE id = ?",
+                [(pid,) for pid in {pid for pid, _ in done}]
+            )
+    return len(done), len(batch) - len(done)
+
 
-        # Сбрасываем “историю публикаций”, чтобы автопостинг пошёл заново
-        await db.execute("DELETE FROM product_messages")
-        await db.execute("UPDATE products SET needs_update = 0")  # чтобы ничего не перепостилось вручную
-        await db.commit()
+async def purge(sender: TelegramSender, db: Database, channel: str | None = None, category: str | None = None,
+                out_of_stock: bool = False, older_than: float | None = None) -> tuple[int, int, int]:
+    """Удаляет подходящие посты и возвращает товары в очередь автопоста. Возвращает (найдено, удалено, ошибок)."""
+    purge_all = not (channel or category or out_of_stock or older_than is not None)
+    sql, params = build_query(channel, category, out_of_stock, older_than)
+    rows = await db.fetchall(sql, params)
 
-        print(f"Удалено: {deleted}, ошибок: {failed}")
-        print("product_messages очищена, needs_update сброшен.")
+    print(f"Найдено сообщений для удаления: {len(rows)}")
+
+    by_channel = {}
+    for key, pid, mid in rows:
+        by_channel.setdefault(key, []).append((pid, mid))
+    batches = []
+    for key, posts in by_channel.items():
+        if key not in CHANNELS:
+            print(f"Канал {key!r} не в реестре — пропущено сообщений: {len(posts)}")
+            continue
+        batches += [(CHANNELS[key], posts[i:i + PURGE_BATCH_SIZE])
+                    for i in range(0, len(posts), PURGE_BATCH_SIZE)]
+    # пачки идут параллельно, темп удаления задаёт sender (лимиты Telegram)
+    results = await asyncio.gather(*(purge_batch(sender, db, ch, batch) for ch, batch in batches))
+    deleted = sum(d for d, _ in results)
+    failed = sum(f for _, f in results)
+
+    # удалённые товары снова в очереди автопоста
+    if purge_all:
+        await refresh_queue(db)
+    else:
+        await refresh_queue(db, list({pid for _, pid, _ in rows}))
+    return len(rows), deleted, failed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Delete product posts from the channel")
+    parser.add_argument("--channel", choices=list(CHANNELS), help="only this channel")
+    parser.add_argument("--category", help="only products whose category contains this text")
+    parser.add_argument("--out-of-stock", action="store_true", help="only products with stock = 0")
+    parser.add_argument("--older-than", type=float, metavar="DAYS", help="only posts older than N days")
+    args = parser.parse_args()
+
+    bot = Bot(token=BOT_TOKEN)
+    async with TelegramSender(bot) as sender, Database(DB_NAME, readers=1) as db:
+        start = time.monotonic()
+        _, deleted, failed = await purge(sender, db, args.channel, args.category, args.out_of_stock,
+                                         args.older_than)
+        print(f"Удалено: {deleted}, ошибок: {failed}, за {time.monotonic() - start:.1f} с")
+        if failed:
+            print("Неудалённые сообщения остались в product_messages — запусти скрипт ещё раз.")
 
     await bot.session.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
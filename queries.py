@@ -0,0 +1,145 @@
+# queries.py
+"""
+Горячие SQL-запросы бота в одном месте: их использует main.py,
+а `python migrations.py --check-plans` проверяет, что ни один не делает full scan.
+"""
+
+# Товары, которые нужно отправить / обновить (needs_update = 1 и есть остаток)
+PRODUCTS_TO_UPDATE = """
+    SELECT id
+    FROM products
+    WHERE needs_update = 1
+      AND visible = 1
+      AND stock IS NOT NULL
+      AND stock > 0
+"""
+
+# Посты, которые НУЖНО удалить (товар скрыт или нет остатков): (channel, product_id).
+# Проход по product_messages (постов меньше, чем товаров), товар — по первичному ключу;
+# CROSS JOIN фиксирует этот порядок: после ANALYZE на живой базе планировщик иначе сканирует products.
+PRODUCTS_TO_DELETE = """
+    SELECT DISTINCT pm.channel, pm.product_id
+    FROM product_messages pm
+    CROSS JOIN products p ON p.id = pm.product_id
+    WHERE p.visible = 0 OR p.stock IS NULL OR p.stock = 0
+"""
+
+# То же по id из ленты изменений; {marks} — плейсхолдеры "?, ?, ..."
+CHANGED_TO_UPDATE = """
+    SELECT id
+    FROM products
+    WHERE id IN ({marks})
+      AND visible = 1
+      AND needs_update = 1
+      AND stock IS NOT NULL
+      AND stock > 0
+"""
+
+CHANGED_TO_DELETE = """
+    SELECT DISTINCT pm.channel, pm.product_id
+    FROM product_messages pm
+    LEFT JOIN products p ON p.id = pm.product_id
+    WHERE pm.product_id IN ({marks})
+      AND (p.id IS NULL OR p.visible = 0 OR p.stock IS NULL OR p.stock = 0)
+"""
+
+# кандидаты автопоста для канала: params (channel, MIN_STOCK_TO_POST)
+AUTOPOST_CANDIDATES = """
+    SELECT p.id, p.name, p.category, cp.last_posted_at
+    FROM products p
+    LEFT JOIN channel_posts cp ON cp.channel = ?1 AND cp.product_id = p.id
+    WHERE p.visible = 1
+      AND p.stock >= ?2
+      AND NOT EXISTS (SELECT 1 FROM product_messages pm WHERE pm.product_id = p.id AND pm.channel = ?1)
+      -- с картинками — только когда одна из них проверена (images.py); без картинок — текстовый пост
+      AND (NOT EXISTS (SELECT 1 FROM product_images i WHERE i.product_id = p.id AND i.image_url != '')
+           OR EXISTS (SELECT 1 FROM product_images i WHERE i.product_id = p.id AND i.status = 'ready'))
+"""
+
+# товары, по которым уже есть задача в jobs (ждёт повтора после ошибки и т.п.), пропускаем
+AUTOPOST_NEXT = """
+    SELECT q.product_id
+    FROM autopost_queue q
+    WHERE q.channel = ?
+      AND (q.last_posted_at IS NULL OR q.last_posted_at < ?)
+      AND NOT EXISTS (
+          SELECT 1 FROM jobs j
+          WHERE j.product_id = q.product_id AND j.channel = q.channel AND j.state IN ('pending', 'in_flight')
+      )
+    ORDER BY q.priority, q.last_posted_at, q.product_id
+    LIMIT ?
+"""
+
+# сверка (reconciler.py): все записанные посты с текущим состоянием товара и первой картинкой,
+# плюс товары с needs_update (channel = NULL). Полный проход по product_messages — намеренно, раз в цикл.
+RECONCILE = """
+    SELECT pm.channel, pm.product_id, pm.message_id, pm.kind, pm.media, pm.caption_hash, pm.markup_hash,
+           pm.checked_at, p.id IS NOT NULL, p.visible, p.stock, p.name, p.category, p.description, p.url,
+           p.content_hash,
+           (SELECT i.image_url FROM product_images i
+            WHERE i.product_id = pm.product_id AND i.image_url != '' AND i.status IS NOT 'failed'
+            ORDER BY i.id LIMIT 1)
+    FROM product_messages pm
+    LEFT JOIN products p ON p.id = pm.product_id
+    UNION ALL
+    SELECT NULL, id, NULL, NULL, NULL, NULL, NULL, NULL, 1, visible, stock, name, category, NULL, NULL,
+           NULL, NULL
+    FROM products
+    WHERE needs_update = 1
+      AND visible = 1
+      AND stock IS NOT NULL
+      AND stock > 0
+"""
+
+# product_cache.py: снимок товаров для send_product — картинки и посты в json_group_array; {marks} — id
+PRODUCT_SNAPSHOTS = """
+    SELECT p.id, p.name, p.description, p.url, p.category, p.visible, p.stock, p.content_hash,
+           (SELECT json_group_array(json_array(i.image_url, i.file_id, i.path))
+            FROM (SELECT image_url, file_id, path FROM product_images
+                  WHERE product_id = p.id AND status IS NOT 'failed' ORDER BY id) i),
+           (SELECT json_group_array(json_array(pm.channel, pm.message_id, pm.kind, pm.media,
+                                               pm.caption_hash, pm.markup_hash))
+            FROM product_messages pm WHERE pm.product_id = p.id)
+    FROM products p
+    WHERE p.id IN ({marks})
+"""
+
+# images.py: первая годная картинка товаров на витрине, ещё не проверенная (или пора повторить после
+# сетевой ошибки); следующая картинка товара проверяется, только если все предыдущие — failed
+IMAGES_PENDING = """
+    SELECT i.id, i.product_id, i.image_url
+    FROM product_images i
+    JOIN products p ON p.id = i.product_id
+    WHERE i.status IS NULL AND i.image_url != ''
+      AND (i.checked_at IS NULL OR i.checked_at < ?)
+      AND p.visible = 1 AND p.stock > 0
+      AND NOT EXISTS (
+          SELECT 1 FROM product_images j
+          WHERE j.product_id = i.product_id AND j.id < i.id AND j.image_url != '' AND j.status IS NOT 'failed'
+      )
+    ORDER BY i.id
+    LIMIT ?
+"""
+PRODUCT_MESSAGE_IDS = "SELECT message_id FROM product_messages WHERE product_id = ? AND channel = ?"
+
+# name -> таблица (алиас), полный проход по которой в этом запросе намеренный
+INTENDED_SCANS = {
+    "products_to_delete": "pm",
+    "reconcile": "pm",
+}
+
+# name -> (sql, пример параметров) для EXPLAIN QUERY PLAN
+HOT_QUERIES = {
+    "products_to_update": (PRODUCTS_TO_UPDATE, ()),
+    "products_to_delete": (PRODUCTS_TO_DELETE, ()),
+    "changed_to_update": (CHANGED_TO_UPDATE.format(marks="?, ?"), (1, 2)),
+    "changed_to_delete": (CHANGED_TO_DELETE.format(marks="?, ?"), (1, 2)),
+    "autopost_candidates": (AUTOPOST_CANDIDATES, ("default", 2)),
+    "autopost_next": (AUTOPOST_NEXT, ("default", 0, 1)),
+    "product_snapshots": (PRODUCT_SNAPSHOTS.format(marks="?, ?"), (1, 2)),
+    "reconcile": (RECONCILE, ()),
+    "images_pending": (IMAGES_PENDING, (0, 100)),
+    "product_message_ids": (PRODUCT_MESSAGE_IDS, (1, "default")),
+    "job_claim": ("SELECT id FROM jobs WHERE state = 'pending' AND run_after <= ? "
+                  "ORDER BY priority, id LIMIT 1", (0,)),
+}
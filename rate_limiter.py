@@ -0,0 +1,232 @@
+# rate_limiter.py
+"""
+Централизованный диспетчер всех вызовов Telegram Bot API.
+
+Каждый вызов (send_photo, send_message, delete_message, edit_*) проходит через
+TelegramSender: глобальный token bucket + bucket на (чат, тип вызова),
+приоритетные полосы (удаление stock=0 раньше автопоста) и адаптация
+под retry_after вместо фиксированных sleep по коду.
+"""
+import asyncio
+import itertools
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+import metrics
+
+logger = logging.getLogger("errors")
+
+# Приоритеты: чем меньше число, тем раньше уйдёт запрос
+PRIORITY_DELETE = 0     # удаление постов товаров без остатка
+PRIORITY_UPDATE = 1     # ручные обновления (needs_update)
+PRIORITY_AUTOPOST = 2   # автопостинг
+PRIORITY_BULK = 3       # сервисные скрипты (purge и т.п.)
+
+# Документированные лимиты Telegram: ~30 сообщений/сек на бота,
+# не больше 20 сообщений/мин в одну группу/канал.
+GLOBAL_RATE = 30.0                 # запросов в секунду на весь бот
+GLOBAL_BURST = 30
+CHAT_LIMITS = {
+    # kind: (запросов в секунду, burst)
+    "send": (20 / 60, 3),
+    "edit": (1.0, 3),
+    "delete": (10.0, 10),
+}
+MAX_RETRIES = 3          # повторов после retry_after
+MIN_RATE_FACTOR = 0.1    # ниже этой доли от базовой скорости не опускаемся
+RECOVERY_STEP = 0.05     # насколько восстанавливаем скорость после каждого успеха
+
+
+def method_kind(method: str) -> str:
+    if method.startswith("delete"):
+        return "delete"
+    if method.startswith("edit"):
+        return "edit"
+    return "send"
+
+
+class TokenBucket:
+    """Классический token bucket с паузой после retry_after и AIMD-подстройкой скорости."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до следующего токена (0 — можно сейчас)."""
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def penalize(self, retry_after: float):
+        now = time.monotonic()
+        self.blocked_until = max(self.blocked_until, now + retry_after)
+        self.rate = max(self.base_rate * MIN_RATE_FACTOR, self.rate / 2)
+        self.tokens = 0
+
+    def reward(self):
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * RECOVERY_STEP)
+
+
+class _Job:
+    __slots__ = ("method", "kwargs", "key", "future", "attempt", "queued_at")
+
+    def __init__(self, method: str, kwargs: dict, key: tuple, future: asyncio.Future):
+        self.method = method
+        self.kwargs = kwargs
+        self.key = key
+        self.future = future
+        self.attempt = 0
+        self.queued_at = time.monotonic()
+
+
+class TelegramSender:
+    """
+    Все вызовы Bot API идут через `await sender.call("send_photo", chat_id=..., ...)`.
+    Диспетчер выдаёт токены в порядке приоритета, сами запросы выполняются параллельно.
+    """
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._buckets: dict[tuple, TokenBucket] = {}
+        self._inflight: set[asyncio.Task] = set()
+        self._dispatcher: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def start(self):
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def close(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    def _bucket(self, key: tuple) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            rate, burst = CHAT_LIMITS[key[1]]
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    async def call(self, method: str, *, priority: int = PRIORITY_UPDATE, **kwargs):
+        self.start()
+        key = (str(kwargs.get("chat_id")), method_kind(method))
+        job = _Job(method, kwargs, key, asyncio.get_running_loop().create_future())
+        self._enqueue(priority, job)
+        return await job.future
+
+    async def _dispatch(self):
+        while True:
+            item = await self._queue.get()
+            self._wakeup.clear()
+            deferred = []
+            wait_min = None
+            launched = False
+
+            # берём самый приоритетный запрос, чей чат сейчас не упирается в лимит;
+            # запросы в «заблокированные» чаты не тормозят остальные
+            while item is not None:
+                priority, seq, job = item
+                if not job.future.done():  # вызывающий мог отмениться
+                    now = time.monotonic()
+                    global_wait = self._global.delay(now)
+                    wait = max(global_wait, self._bucket(job.key).delay(now))
+                    if wait <= 0:
+                        self._launch(priority, job)
+                        launched = True
+                        break
+                    deferred.append(item)
+                    wait_min = wait if wait_min is None else min(wait_min, wait)
+                    if global_wait > 0:
+                        break
+                item = None if self._queue.empty() else self._queue.get_nowait()
+
+            for d in deferred:
+                self._queue.put_nowait(d)
+            if not launched and wait_min is not None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait_min)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _launch(self, priority: int, job: _Job):
+        # сколько запрос простоял в очереди из-за лимитов
+        metrics.observe("telegram_queue_wait_seconds", time.monotonic() - job.queued_at, method=job.method)
+        metrics.set_gauge("telegram_queue_depth", self._queue.qsize())
+        self._global.take()
+        self._bucket(job.key).take()
+        task = asyncio.create_task(self._run(priority, job))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    def _enqueue(self, priority: int, job: _Job):
+        job.queued_at = time.monotonic()
+        self._queue.put_nowait((priority, next(self._seq), job))
+        metrics.set_gauge("telegram_queue_depth", self._queue.qsize())
+        self._wakeup.set()
+
+    async def _run(self, priority: int, job: _Job):
+        bucket = self._bucket(job.key)
+        start = time.monotonic()
+        try:
+            result = await getattr(self.bot, job.method)(**job.kwargs)
+        except TelegramRetryAfter as e:
+            metrics.inc("telegram_calls_total", method=job.method, result="retry_after")
+            retry_after = getattr(e, "retry_after", 5)
+            bucket.penalize(retry_after)
+            job.attempt += 1
+            # при флуде такие записи идут пачками — одна на DEDUP_WINDOW на (метод, чат)
+            logger.error(f"⚠️ Flood control on {job.method} chat={job.key[0]}: "
+                         f"retry {job.attempt}/{MAX_RETRIES} after {retry_after}s",
+                         extra={"method": job.method, "dedup": f"flood:{job.method}:{job.key[0]}"})
+            if job.attempt > MAX_RETRIES:
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            self._enqueue(priority, job)
+        except Exception as e:
+            metrics.inc("telegram_calls_total", method=job.method, result="error")
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            metrics.inc("telegram_calls_total", method=job.method, result="ok")
+            bucket.reward()
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            metrics.observe("telegram_call_seconds", time.monotonic() - start, method=job.method)
@@ -0,0 +1,214 @@
+# reconciler.py
+"""
+Сверка того, что должно висеть в каналах, с тем, что записано в product_messages.
+
+Один проход (queries.RECONCILE) по записанным постам и товарам с needs_update
+раскладывается на минимальный план:
+  delete — товар удалён, скрыт, распродан или больше не подходит под фильтр канала;
+  send   — needs_update (ручное обновление), во всех каналах под фильтр;
+  edit   — пост висит, но отрендеренная сейчас подпись / кнопки / фото другие;
+  probe  — пост вроде бы актуален: раз в цикл проверяем самые давно проверенные,
+           что сообщение вообще ещё есть в канале (удалили руками — забываем запись,
+           товар вернётся в очередь автопоста).
+Товары с уже поставленной задачей в jobs пропускаются. План режется по бюджету
+вызовов Bot API на цикл (RECONCILE_BUDGET): сначала удаления, потом send, edit, probe.
+
+    python reconciler.py            # показать план, ничего не делая
+"""
+import argparse
+import asyncio
+import logging
+import time
+from collections import namedtuple
+
+from aiogram.exceptions import TelegramBadRequest
+
+import metrics
+import queries
+from config import DB_NAME
+from database import Database
+from channels import CHANNELS
+from render import render_post
+from rate_limiter import PRIORITY_DELETE, PRIORITY_UPDATE, PRIORITY_BULK
+from autopost_queue import refresh_queue
+from product_cache import product_cache
+
+logger = logging.getLogger("errors")
+
+RECONCILE_INTERVAL = 30 * 60  # как часто сверять каналы (с проверкой сообщений)
+RECONCILE_BUDGET = 300        # вызовов Bot API на цикл
+PROBE_LIMIT = 50              # проверок существования сообщений на цикл (в пределах бюджета)
+# ответы Telegram, означающие, что сообщения в канале больше нет
+GONE_ERRORS = ("message to edit not found", "message_id_invalid", "message not found")
+
+# строка queries.RECONCILE; у товаров с needs_update без поста channel и поля поста — NULL
+Row = namedtuple("Row", "channel product_id message_id kind media caption_hash markup_hash checked_at "
+                        "exists visible stock name category description url content_hash image_url")
+
+
+class Plan:
+    """Что сделать, чтобы каналы совпали с базой; элементы — (channel, product_id[, message_id])."""
+
+    def __init__(self):
+        self.deletes: list[tuple[str, int]] = []
+        self.sends: list[tuple[str, int]] = []
+        self.edits: list[tuple[str, int]] = []
+        self.probes: list[tuple[str, int, int]] = []
+        self.costs: dict[tuple[str, int], int] = {}  # удаление поста из N сообщений — N вызовов
+        self.orphans = 0      # посты каналов, которых нет в реестре: chat_id неизвестен, не трогаем
+        self.skipped = 0      # уже есть задача в jobs
+        self.deferred = 0     # не влезло в бюджет, будет в следующем цикле
+
+    def __len__(self):
+        return len(self.deletes) + len(self.sends) + len(self.edits) + len(self.probes)
+
+    def trim(self, budget: int, probe_limit: int = PROBE_LIMIT):
+        """Оставляет то, что влезает в budget вызовов, в порядке важности."""
+        left = budget
+        for name in ("deletes", "sends", "edits", "probes"):
+            items, kept = getattr(self, name), []
+            for item in items[:probe_limit] if name == "probes" else items:
+                cost = self.costs.get(item[:2], 1)
+                if cost > left:
+                    break
+                left -= cost
+                kept.append(item)
+            self.deferred += len(items) - len(kept) if name != "probes" else 0
+            setattr(self, name, kept)
+        return self
+
+    def report(self) -> str:
+        return (f"delete: {len(self.deletes)}, send: {len(self.sends)}, edit: {len(self.edits)}, "
+                f"probe: {len(self.probes)}, deferred: {self.deferred}, already queued: {self.skipped}, "
+                f"unknown channels: {self.orphans}")
+
+
+def post_state(name, description, url, content_hash, image_url, manager_url):
+    """(kind, media, caption_hash, markup_hash) поста, каким его отправил бы send_product сейчас."""
+    rendered = render_post(content_hash, name, description, url, bool(image_url), manager_url)
+    return ("photo" if image_url else "text", image_url, rendered.caption_hash, rendered.markup_hash), rendered
+
+
+async def compute_plan(db, channels: dict = None) -> Plan:
+    """Один проход по записанным постам и needs_update; O(постов + товаров к обновлению)."""
+    channels = channels or CHANNELS
+    plan = Plan()
+    active = {(channel, pid) for channel, pid in await db.fetchall(
+        "SELECT channel, product_id FROM jobs WHERE state IN ('pending', 'in_flight')"
+    )}
+    with metrics.timer("db_query_seconds", query="reconcile"):
+        rows = await db.fetchall(queries.RECONCILE)
+
+    posted = {}  # (channel, product_id) -> первая запись поста
+    to_send = {}
+    for row in map(Row._make, rows):
+        key = (row.channel, row.product_id)
+        if row.channel is None:
+            to_send[row.product_id] = row
+        elif key in posted:
+            plan.costs[key] = plan.costs.get(key, 1) + 1
+        else:
+            posted[key] = row
+
+    # needs_update: во все каналы под фильтр (send_product сам правит или перепостит)
+    for pid, row in to_send.items():
+        plan.sends += [(key, pid) for key, channel in channels.items() if channel.matches(row.name, row.category)]
+
+    for (key, pid), row in posted.items():
+        channel = channels.get(key)
+        if channel is None:
+            plan.orphans += 1
+        elif not row.exists or not row.visible or not row.stock or not channel.matches(row.name, row.category):
+            plan.deletes.append((key, pid))
+        elif pid in to_send:
+            continue
+        elif row.kind is not None and post_state(
+            row.name, row.description, row.url, row.content_hash, row.image_url, channel.manager_url
+        )[0] != (row.kind, row.media, row.caption_hash, row.markup_hash):
+            plan.edits.append((key, pid))
+        else:
+            # пост актуален (или записан до сохранения состояния — сравнить не с чем): проверяем, что он жив
+            plan.probes.append((key, pid, row.message_id, row.checked_at or 0))
+
+    for name in ("deletes", "sends", "edits", "probes"):
+        items = getattr(plan, name)
+        kept = [item for item in items if item[:2] not in active]
+        plan.skipped += len(items) - len(kept)
+        setattr(plan, name, kept)
+    # давно не проверенные — первыми
+    plan.probes = [item[:3] for item in sorted(plan.probes, key=lambda item: item[3])]
+    return plan
+
+
+async def probe(sender, db, key: str, product_id: int, message_id: int) -> bool:
+    """
+    Проверяет, что сообщение есть в канале: ставит ему те же кнопки, что и сейчас.
+    "message is not modified" — сообщение на месте; не найдено — запись удаляется.
+    """
+    channel = CHANNELS[key]
+    product = await product_cache.get(db, product_id)
+    if product is None or not product.visible:
+        return True  # товар скрыли между планом и проверкой — удалит вотчер
+    _, rendered = post_state(product.name, product.description, product.url, product.content_hash,
+                             product.images[0][0] if product.images else None, channel.manager_url)
+    alive = True
+    try:
+        await sender.call("edit_message_reply_markup", priority=PRIORITY_BULK, chat_id=channel.chat_id,
+                          message_id=message_id, reply_markup=rendered.keyboard)
+    except TelegramBadRequest as e:
+        if any(text in str(e).lower() for text in GONE_ERRORS):
+            alive = False
+            logger.warning(f"Message {message_id} of product {product_id} is gone from {key}: {e}",
+                           extra={"product_id": product_id, "message_id": message_id, "channel": key})
+    async with db.transaction() as tx:
+        if alive:
+            await tx.execute(
+                "UPDATE product_messages SET checked_at = ? WHERE product_id = ? AND channel = ? AND message_id = ?",
+                (time.time(), product_id, key, message_id)
+            )
+        else:
+            await tx.execute("DELETE FROM product_messages WHERE product_id = ? AND channel = ?", (product_id, key))
+    product_cache.invalidate([product_id])
+    if not alive:
+        metrics.inc("reconcile_missing_total", channel=key)
+        await refresh_queue(db, [product_id])
+    return alive
+
+
+async def reconcile(pipeline, db, sender=None, budget: int = RECONCILE_BUDGET) -> Plan:
+    """Считает план и ставит его в pipeline; с sender ещё и проверяет сообщения (probe)."""
+    plan = (await compute_plan(db)).trim(budget, PROBE_LIMIT if sender else 0)
+    for key in CHANNELS:
+        await pipeline.enqueue("delete", [pid for k, pid in plan.deletes if k == key], PRIORITY_DELETE, key)
+        await pipeline.enqueue("send", [pid for k, pid in plan.sends + plan.edits if k == key],
+                               PRIORITY_UPDATE, key)
+    if sender:
+        await asyncio.gather(*(probe(sender, db, *item) for item in plan.probes))
+    for name in ("deletes", "sends", "edits", "probes"):
+        metrics.inc("reconcile_actions_total", len(getattr(plan, name)), action=name)
+    if len(plan) or plan.deferred:
+        logger.warning(f"Reconcile: {plan.report()}")
+    return plan
+
+
+async def reconcile_loop(pipeline, db, sender, interval: float = RECONCILE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await reconcile(pipeline, db, sender)
+        except Exception as e:
+            logger.exception(f"Reconcile loop error: {e}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Show what the reconciler would do (dry run)")
+    parser.add_argument("--budget", type=int, default=RECONCILE_BUDGET, help="Bot API calls per cycle")
+    args = parser.parse_args()
+
+    async with Database(DB_NAME, readers=1) as db:
+        plan = (await compute_plan(db)).trim(args.budget)
+    print(plan.report())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
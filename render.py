@@ -0,0 +1,232 @@
+# render.py
+"""
+Рендер поста: подпись (HTML для Telegram) и клавиатура.
+
+Описание из Excel проходит один раз через токенизатор: <p>/<br> -> перенос,
+<b> остаётся (теги всегда сбалансированы), остальные теги выкидываются,
+текст экранируется заново. Подпись обрезается по лимиту Telegram
+(1024 символа у фото, 4096 у текста — считаются без тегов, в UTF-16),
+не разрывая теги. Готовый пост кэшируется по products.content_hash.
+
+    python render.py --bench   # прогон по всей таблице products
+"""
+import argparse
+import hashlib
+import html
+import re
+import time
+from collections import OrderedDict, namedtuple
+
+from aiogram import types
+
+from config import MANAGER_URL
+
+CAPTION_LIMIT = 1024   # подпись к фото
+MESSAGE_LIMIT = 4096   # обычное сообщение
+ELLIPSIS = "…"
+RENDER_CACHE_SIZE = 2048
+
+# тег целиком или комментарий; group(1) — "/" у закрывающего, group(2) — имя тега
+_TAG = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9]*)\b[^>]*>|<!--.*?-->", re.S)
+_BREAK_TAGS = {"p", "br"}
+_KEEP_TAGS = {"b"}
+
+TEXT, OPEN, CLOSE = 0, 1, 2
+
+Rendered = namedtuple("Rendered", "caption keyboard caption_hash markup_hash")
+
+
+def build_kb(product_url: str, manager_url: str = MANAGER_URL) -> types.InlineKeyboardMarkup:
+    rows = []
+    if product_url:
+        rows.append([types.InlineKeyboardButton(text="КУПИТЬ", url=product_url)])
+    rows.append([types.InlineKeyboardButton(text="НАПИСАТЬ МЕНЕДЖЕРУ", url=manager_url)])
+    return types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def digest(text: str) -> str:
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def tg_len(text: str) -> int:
+    """Длина так, как её считает Telegram (UTF-16 code units)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def tokenize(text: str) -> list[tuple[int, str]]:
+    """
+    Один проход по HTML: [(TEXT, обычный текст) | (OPEN, "b") | (CLOSE, "b")].
+    Лишние закрывающие теги выкидываются, незакрытые <b> закрываются в конце.
+    """
+    tokens = []
+    if not text:
+        return tokens
+    pos = 0
+    open_tags = []
+    for m in _TAG.finditer(text):
+        if m.start() > pos:
+            tokens.append((TEXT, html.unescape(text[pos:m.start()])))
+        pos = m.end()
+        name = (m.group(2) or "").lower()
+        if name in _BREAK_TAGS:
+            tokens.append((TEXT, "\n"))
+        elif name in _KEEP_TAGS:
+            if m.group(1):
+                if name in open_tags:
+                    open_tags.remove(name)
+                    tokens.append((CLOSE, name))
+            elif name not in open_tags:
+                open_tags.append(name)
+                tokens.append((OPEN, name))
+    if pos < len(text):
+        tokens.append((TEXT, html.unescape(text[pos:])))
+    tokens += [(CLOSE, name) for name in reversed(open_tags)]
+    return _strip(tokens)
+
+
+def _strip(tokens: list) -> list:
+    """Как str.strip(), но по токенам: пробелы по краям текста, теги не трогаем."""
+    for i in range(len(tokens)):
+        kind, value = tokens[i]
+        if kind == TEXT:
+            tokens[i] = (TEXT, value.lstrip())
+            if tokens[i][1]:
+                break
+    for i in reversed(range(len(tokens))):
+        kind, value = tokens[i]
+        if kind == TEXT:
+            tokens[i] = (TEXT, value.rstrip())
+            if tokens[i][1]:
+                break
+    return tokens
+
+
+def to_html(tokens: list, limit: int | None = None) -> str:
+    """Собирает HTML; при limit обрезает видимый текст с «…», закрывая открытые теги."""
+    parts = []
+    open_tags = []
+    left = None
+    if limit is not None and sum(tg_len(v) for k, v in tokens if k == TEXT) > limit:
+        left = limit - tg_len(ELLIPSIS)  # место под «…» резервируем сразу
+    for kind, value in tokens:
+        if kind == OPEN:
+            open_tags.append(value)
+            parts.append(f"<{value}>")
+        elif kind == CLOSE:
+            open_tags.remove(value)
+            parts.append(f"</{value}>")
+        elif value:
+            if left is not None:
+                size = tg_len(value)
+                if size > left:
+                    parts.append(html.escape(_cut(value, left).rstrip(), quote=False) + ELLIPSIS)
+                    parts += [f"</{name}>" for name in reversed(open_tags)]
+                    break
+                left -= size
+            parts.append(html.escape(value, quote=False))
+    return "".join(parts)
+
+
+def _cut(text: str, units: int) -> str:
+    """Префикс text не длиннее units в UTF-16 (суррогатные пары не разрываются)."""
+    if units <= 0:
+        return ""
+    if tg_len(text) <= units:
+        return text
+    size = 0
+    for i, ch in enumerate(text):
+        size += 2 if ord(ch) > 0xFFFF else 1
+        if size > units:
+            return text[:i]
+    return text
+
+
+def clean_html(text: str) -> str:
+    return to_html(tokenize(text))
+
+
+def _caption_tokens(name: str, description: str) -> list:
+    head = [(TEXT, "🛒 "), (OPEN, "b"), (TEXT, name or ""), (CLOSE, "b"), (TEXT, "\n\n")]
+    body = tokenize(description)
+    if not body:
+        head.pop()  # без описания — без пустых строк в конце
+    return head + body
+
+
+def render_caption(name: str, description: str, limit: int | None = CAPTION_LIMIT) -> str:
+    return to_html(_caption_tokens(name, description), limit)
+
+
+def caption_length(name: str, description: str) -> int:
+    """Длина подписи без обрезки — так, как её сравнивает с лимитом Telegram."""
+    return sum(tg_len(value) for kind, value in _caption_tokens(name, description) if kind == TEXT)
+
+
+def _render(name: str, description: str, url: str, has_photo: bool, manager_url: str) -> Rendered:
+    caption = render_caption(name, description, CAPTION_LIMIT if has_photo else MESSAGE_LIMIT)
+    kb = build_kb(url, manager_url)
+    return Rendered(caption, kb, digest(caption), digest(kb.model_dump_json()))
+
+
+_cache: OrderedDict = OrderedDict()
+
+
+def render_post(content_hash: str | None, name: str, description: str, url: str,
+                has_photo: bool, manager_url: str = MANAGER_URL) -> Rendered:
+    """
+    Подпись и клавиатура поста. content_hash (products.content_hash) — ключ LRU:
+    пока товар не менялся, повторный рендер ничего не стоит. Без хэша — рендер без кэша.
+    manager_url у каждого канала свой (channels.Channel).
+    """
+    if not content_hash:
+        return _render(name, description, url, has_photo, manager_url)
+    key = (content_hash, has_photo, manager_url)
+    rendered = _cache.get(key)
+    if rendered is not None:
+        _cache.move_to_end(key)
+        return rendered
+    rendered = _cache[key] = _render(name, description, url, has_photo, manager_url)
+    if len(_cache) > RENDER_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return rendered
+
+
+def bench(path: str):
+    """Время рендера всей таблицы products: холодный кэш, тёплый кэш, только санитайзер."""
+    from database import connect_sync
+
+    conn = connect_sync(path)
+    try:
+        rows = conn.execute(
+            "SELECT p.content_hash, p.name, p.description, p.url, "
+            "EXISTS (SELECT 1 FROM product_images i WHERE i.product_id = p.id) "
+            "FROM products p"
+        ).fetchall()
+    finally:
+        conn.close()
+    print(f"Products: {len(rows)}")
+
+    def run(title, fn):
+        start = time.perf_counter()
+        for row in rows:
+            fn(row)
+        elapsed = time.perf_counter() - start
+        print(f"{title:>14}: {elapsed * 1000:8.1f} ms  ({elapsed / max(len(rows), 1) * 1e6:.1f} µs/product)")
+
+    _cache.clear()
+    run("sanitize", lambda r: clean_html(r[2]))
+    run("render cold", lambda r: render_post(r[0], r[1], r[2], r[3], bool(r[4])))
+    run("render warm", lambda r: render_post(r[0], r[1], r[2], r[3], bool(r[4])))
+    truncated = sum(1 for r in rows
+                    if render_post(r[0], r[1], r[2], r[3], bool(r[4])).caption != render_caption(r[1], r[2], None))
+    print(f"Truncated captions: {truncated}")
+
+
+if __name__ == "__main__":
+    from config import DB_NAME
+
+    parser = argparse.ArgumentParser(description="Post rendering")
+    parser.add_argument("--bench", action="store_true", help="render every product and report timings")
+    args = parser.parse_args()
+    if args.bench:
+        bench(DB_NAME)
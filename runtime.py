@@ -0,0 +1,93 @@
+# runtime.py
+"""
+Жизненный цикл процесса бота: фоновые циклы под присмотром и аккуратная остановка.
+
+Каждый цикл (вотчер, расписание, сверка, картинки, метрики) — своя задача.
+Упала — перезапускается только она, с паузой RESTART_BASE_DELAY * 2^n (не больше
+RESTART_MAX_DELAY); проработала дольше HEALTHY_AFTER — счётчик сбрасывается.
+Соединения с базой, TelegramSender и pipeline при этом не пересоздаются.
+
+SIGTERM / SIGINT: циклы отменяются, новые задачи не ставятся, pipeline доделывает
+уже начатые отправки не дольше pipeline.DRAIN_TIMEOUT (для systemd —
+TimeoutStopSec больше этого). Повторный Ctrl+C — немедленный выход.
+Незавершённое остаётся в jobs / schedule_state / change_cursors и продолжится после старта.
+
+    supervisor = Supervisor()
+    supervisor.add("watcher", lambda: watch_products(pipeline, db))
+    await supervisor.run(stop_event())
+"""
+import asyncio
+import logging
+import signal
+import time
+
+import metrics
+
+logger = logging.getLogger("errors")
+
+RESTART_BASE_DELAY = 1    # секунд
+RESTART_MAX_DELAY = 60
+HEALTHY_AFTER = 60        # столько проработал без ошибок — паузы снова с RESTART_BASE_DELAY
+
+
+def stop_event() -> asyncio.Event:
+    """Event, который выставят SIGTERM / SIGINT. После первого сигнала обработчики снимаются."""
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    signals = (signal.SIGTERM, signal.SIGINT)
+
+    def on_signal(sig):
+        logger.warning(f"{signal.Signals(sig).name} received, shutting down")
+        stop.set()
+        for s in signals:
+            loop.remove_signal_handler(s)  # второй Ctrl+C — обычный KeyboardInterrupt
+
+    for sig in signals:
+        try:
+            loop.add_signal_handler(sig, on_signal, sig)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: остаётся KeyboardInterrupt, остановка через отмену main()
+    return stop
+
+
+class Supervisor:
+    """Набор фоновых циклов; add(name, factory) — factory() возвращает новую корутину цикла."""
+
+    def __init__(self, base_delay: float = RESTART_BASE_DELAY, max_delay: float = RESTART_MAX_DELAY,
+                 healthy_after: float = HEALTHY_AFTER):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.healthy_after = healthy_after
+        self._factories = {}  # name -> () -> coroutine
+
+    def add(self, name: str, factory):
+        self._factories[name] = factory
+
+    async def _supervise(self, name: str, factory):
+        failures = 0
+        while True:
+            started = time.monotonic()
+            try:
+                await factory()
+                logger.warning(f"Task {name} exited, restarting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Task {name} crashed: {e}")
+            if time.monotonic() - started >= self.healthy_after:
+                failures = 0
+            delay = min(self.base_delay * 2 ** failures, self.max_delay)
+            failures += 1
+            metrics.inc("task_restarts_total", task=name)
+            await asyncio.sleep(delay)
+
+    async def run(self, stop: asyncio.Event):
+        """Запускает все циклы и держит их до stop; потом отменяет и дожидается их."""
+        tasks = [asyncio.create_task(self._supervise(name, factory), name=name)
+                 for name, factory in self._factories.items()]
+        try:
+            await stop.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
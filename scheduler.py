@@ -0,0 +1,229 @@
+# scheduler.py
+"""
+Расписание автопоста: окна публикации по дням недели и часам, частота в каждом окне.
+
+В CHANNELS_FILE у канала:
+
+    "schedule": [{"days": "mon-fri", "from": "18:00", "to": "23:00", "per_hour": 3},
+                 {"days": "sat,sun", "from": "11:00", "to": "01:00", "per_hour": 2}],
+    "catch_up": 2
+
+Вне окон канал молчит. Слоты выровнены по началу окна (18:00, 18:20, 18:40, ...),
+поэтому время публикаций не «уезжает» на длительность цикла. Без "schedule" —
+одно окно на всю неделю с частотой 3600 / autopost_interval (как раньше, но по часам).
+Время — в SCHEDULE_TZ (например "Asia/Almaty"), без неё — локальное время сервера.
+
+Один Scheduler ведёт все каналы: куча (время слота, канал), сон до ближайшего слота
+на монотонных часах event loop'а, не дольше MAX_SLEEP — перевод часов сервера и
+переход на летнее время подхватываются сами. Следующий слот каждого канала хранится
+в schedule_state и записывается ДО публикации: после рестарта пропущенные слоты
+не старше CATCH_UP_AGE догоняются (не больше catch_up за раз), а упавший посреди
+слота процесс слот не повторит.
+
+    python scheduler.py            # ближайшие слоты каждого канала
+"""
+import argparse
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta
+
+import metrics
+from config import SCHEDULE_TZ
+
+logger = logging.getLogger("errors")
+bot_logger = logging.getLogger("bot")
+
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+MAX_SLEEP = 60                # секунд; чаще сверяемся с часами сервера
+CATCH_UP_AGE = 60 * 60        # пропущенные слоты старше часа не догоняем
+DEFAULT_CATCH_UP = 2          # сколько пропущенных слотов публикуется за раз после простоя
+MAX_MISSED_SCAN = 1000        # предел перебора пропущенных слотов
+
+_tz = None
+if SCHEDULE_TZ:
+    from zoneinfo import ZoneInfo
+    _tz = ZoneInfo(SCHEDULE_TZ)
+
+
+def _parse_days(days) -> frozenset[int]:
+    """"*", "mon-fri", "sat,sun" или список — номера дней недели (0 = понедельник)."""
+    if days in (None, "*"):
+        return frozenset(range(7))
+    parts = days.split(",") if isinstance(days, str) else days
+    result = set()
+    for part in parts:
+        first, _, last = part.strip().lower().partition("-")
+        start, end = DAYS.index(first), DAYS.index(last or first)
+        span = DAYS[start:end + 1] if start <= end else DAYS[start:] + DAYS[:end + 1]  # "sat-mon"
+        result.update(DAYS.index(day) for day in span)
+    return frozenset(result)
+
+
+def _parse_time(value: str) -> int:
+    """"HH:MM" -> минуты от полуночи; "24:00" — конец суток."""
+    hours, _, minutes = value.partition(":")
+    total = int(hours) * 60 + int(minutes or 0)
+    if not 0 <= total <= 24 * 60:
+        raise ValueError(f"bad time {value!r} in schedule")
+    return total
+
+
+class Window:
+    """Окно публикации: дни недели, [from, to) в минутах (to <= from — через полночь), слоты в час."""
+    __slots__ = ("days", "start", "end", "per_hour")
+
+    def __init__(self, days="*", start: str = "00:00", end: str = "24:00", per_hour: float = 1):
+        self.days = _parse_days(days)
+        self.start = _parse_time(start)
+        self.end = _parse_time(end)
+        self.per_hour = float(per_hour)
+        if self.per_hour < 0:
+            raise ValueError("per_hour must be >= 0")
+
+    def slots_from(self, after: datetime):
+        """Первый слот окна строго после after (или None в ближайшие 8 дней)."""
+        if not self.per_hour:
+            return None
+        period = timedelta(hours=1 / self.per_hour)
+        length = (self.end - self.start) % (24 * 60) or 24 * 60
+        for offset in range(-1, 8):  # -1: окно, начавшееся вчера и идущее через полночь
+            day = (after + timedelta(days=offset)).date()
+            if day.weekday() not in self.days:
+                continue
+            opens = datetime.combine(day, datetime.min.time(), tzinfo=after.tzinfo) + timedelta(minutes=self.start)
+            closes = opens + timedelta(minutes=length)
+            if closes <= after:
+                continue
+            slot = opens if after < opens else opens + period * ((after - opens) // period + 1)
+            if slot < closes:
+                return slot
+        return None
+
+
+def format_slot(timestamp: float | None) -> str:
+    return datetime.fromtimestamp(timestamp, _tz).strftime("%a %Y-%m-%d %H:%M") if timestamp else "never"
+
+
+class Schedule:
+    def __init__(self, windows: list[Window]):
+        self.windows = windows
+
+    @classmethod
+    def parse(cls, raw: list[dict]) -> "Schedule":
+        return cls([Window(item.get("days", "*"), item.get("from", "00:00"), item.get("to", "24:00"),
+                           item.get("per_hour", 1)) for item in raw])
+
+    @classmethod
+    def every(cls, interval: float) -> "Schedule":
+        """Круглосуточно раз в interval секунд, слоты от полуночи."""
+        return cls([Window(per_hour=3600 / interval)])
+
+    def next_slot(self, after: float) -> float | None:
+        """Ближайший слот строго после after (unix time) или None, если окон нет."""
+        moment = datetime.fromtimestamp(after, _tz)
+        slots = [slot for slot in (window.slots_from(moment) for window in self.windows) if slot is not None]
+        return min(slots).timestamp() if slots else None
+
+    def missed(self, since: float, now: float) -> list[float]:
+        """Слоты в [since, now] — since сам считается слотом (это сохранённый next_run)."""
+        slots = [since]
+        while len(slots) < MAX_MISSED_SCAN:
+            slot = self.next_slot(slots[-1])
+            if slot is None or slot > now:
+                break
+            slots.append(slot)
+        return slots
+
+
+class Scheduler:
+    """
+    Таймер всех каналов. add(key, schedule, action, catch_up): action(slots) — корутина,
+    которой передаётся, сколько слотов публиковать сейчас (1, после простоя — до catch_up).
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._channels: dict[str, tuple] = {}  # key -> (schedule, action, catch_up)
+        self._heap: list[tuple[float, str]] = []
+
+    def add(self, key: str, schedule: Schedule, action, catch_up: int = DEFAULT_CATCH_UP):
+        self._channels[key] = (schedule, action, catch_up)
+
+    async def _load(self):
+        now = time.time()
+        saved = dict(await self.db.fetchall("SELECT channel, next_run FROM schedule_state"))
+        for key, (schedule, _, _) in self._channels.items():
+            next_run = saved.get(key)
+            # будущий слот пересчитываем — расписание в конфиге могло поменяться;
+            # прошедший оставляем, чтобы догнать пропущенное
+            if next_run is None or next_run > now:
+                next_run = schedule.next_slot(now)
+            if next_run is not None:
+                heapq.heappush(self._heap, (next_run, key))
+            bot_logger.info(f"Autopost [{key}]: next slot {format_slot(next_run)}")
+
+    async def _fire(self, key: str, slot: float, now: float):
+        schedule, action, catch_up = self._channels[key]
+        missed = schedule.missed(slot, now)
+        fresh = [s for s in missed if now - s <= CATCH_UP_AGE]
+        next_run = schedule.next_slot(now)
+        # сначала запоминаем следующий слот: упадём посреди публикации — этот слот не повторится
+        await self.db.execute(
+            """
+            INSERT INTO schedule_state (channel, next_run, last_run) VALUES (?, ?, ?)
+            ON CONFLICT(channel) DO UPDATE SET next_run = excluded.next_run, last_run = excluded.last_run
+            """,
+            (key, next_run, now)
+        )
+        if next_run is not None:
+            heapq.heappush(self._heap, (next_run, key))
+
+        slots = min(len(fresh), catch_up)
+        skipped = len(missed) - slots
+        if skipped:
+            metrics.inc("autopost_slots_total", skipped, channel=key, result="skipped")
+            bot_logger.info(f"Autopost [{key}]: skipped {skipped} missed slots since {format_slot(slot)}")
+        if slots:
+            metrics.inc("autopost_slots_total", slots, channel=key, result="run")
+            try:
+                await action(slots)
+            except Exception as e:
+                logger.exception(f"Autopost [{key}] error: {e}")
+
+    async def run(self):
+        await self._load()
+        while self._heap:
+            slot, key = self._heap[0]
+            delay = slot - time.time()
+            if delay > 0:
+                # сон на монотонных часах loop'а, но не дольше MAX_SLEEP: потом сверка с часами сервера
+                await asyncio.sleep(min(delay, MAX_SLEEP))
+                continue
+            heapq.heappop(self._heap)
+            await self._fire(key, slot, time.time())
+        logger.warning("Autopost: no channel has posting windows, nothing to schedule")
+        await asyncio.Event().wait()  # не выходим: супервизор перезапускал бы пустой цикл
+
+
+def main():
+    from channels import CHANNELS
+
+    parser = argparse.ArgumentParser(description="Show upcoming autopost slots of every channel")
+    parser.add_argument("--count", type=int, default=10, help="slots per channel")
+    args = parser.parse_args()
+
+    for channel in CHANNELS.values():
+        print(f"{channel.key}:")
+        slot = time.time()
+        for _ in range(args.count):
+            slot = channel.schedule.next_slot(slot)
+            if slot is None:
+                print("  (no posting windows)")
+                break
+            print(f"  {format_slot(slot)}  x{channel.autopost_batch}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# stock_sync.py
+"""
+Быстрая синхронизация остатков и цен (без полного импорта).
+
+    python stock_sync.py stock.xlsx        # или .csv — колонки "Артикул", "Остаток", "Цена продажи"
+    erp-export | python stock_sync.py -    # stdin: строки "article,stock[,price]" без заголовка
+
+Пары (артикул, остаток, цена) заливаются во временную таблицу (без блокировки
+основной базы, пока идёт разбор файла или поток из ERP) и применяются одним
+UPDATE ... FROM в одной короткой транзакции; строки, где ничего не поменялось,
+не трогаются. Триггер ленты изменений сразу ставит изменённые товары в outbox —
+вотчер бота удаляет посты распроданных и обновляет очередь автопоста за секунды.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import sys
+from itertools import islice
+from typing import Iterable
+
+from config import DB_NAME
+from database import Database
+from migrations import migrate
+from change_feed import notify_changes
+from content_hash import HASH_FIELDS, row_hash
+from autopost_queue import MIN_STOCK_TO_POST
+from ingest import INGEST_CHUNK_SIZE, norm_article, norm_stock, parse_number, read_chunks
+
+STOCK_COLUMNS = {"Артикул": "article", "Остаток": "stock", "Цена продажи": "price"}
+
+# товары, у которых остаток/цена действительно меняются: (id, старый остаток, новый остаток)
+_CHANGED = """
+    SELECT p.id, p.stock, s.stock
+    FROM stock_sync s
+    JOIN products p ON p.article = s.article
+    WHERE p.stock IS NOT s.stock
+       OR (s.price IS NOT NULL AND p.price IS NOT s.price)
+"""
+
+# content_hash пересчитывается тут же (row_hash — Python-функция на соединении): остаток и цена в него
+# входят, а с тем же хэшем, что посчитал бы импорт, не теряется кэш рендера и следующий импорт не перепишет строку
+_APPLY = """
+    UPDATE products
+    SET stock = s.stock,
+        price = COALESCE(s.price, products.price),
+        content_hash = row_hash(
+            products.name, products.description, COALESCE(s.price, products.price), products.old_price,
+            s.stock, products.category, products.url, products.visible,
+            (SELECT json_group_array(image_url)
+             FROM (SELECT image_url FROM product_images WHERE product_id = products.id ORDER BY id))
+        )
+    FROM stock_sync s
+    WHERE s.article = products.article
+      AND (products.stock IS NOT s.stock
+           OR (s.price IS NOT NULL AND products.price IS NOT s.price))
+"""
+
+
+class StockChanges:
+    """Что изменила синхронизация; id товаров, перешедших через 0 и MIN_STOCK_TO_POST."""
+
+    def __init__(self):
+        self.received = 0
+        self.unknown = 0          # артикулов нет в базе
+        self.changed: list[int] = []
+        self.sold_out: list[int] = []       # было > 0, стало 0 — посты удалит вотчер
+        self.back_in_stock: list[int] = []  # было 0, стало > 0
+        self.postable: list[int] = []       # стало >= MIN_STOCK_TO_POST — кандидат на автопост
+        self.unpostable: list[int] = []     # стало < MIN_STOCK_TO_POST
+
+    def record(self, product_id: int, old_stock, new_stock):
+        old, new = old_stock or 0, new_stock or 0
+        self.changed.append(product_id)
+        if old > 0 >= new:
+            self.sold_out.append(product_id)
+        elif new > 0 >= old:
+            self.back_in_stock.append(product_id)
+        if old < MIN_STOCK_TO_POST <= new:
+            self.postable.append(product_id)
+        elif new < MIN_STOCK_TO_POST <= old:
+            self.unpostable.append(product_id)
+
+    def report(self) -> str:
+        return (f"received: {self.received}, changed: {len(self.changed)}, unknown: {self.unknown}\n"
+                f"sold out: {len(self.sold_out)}, back in stock: {len(self.back_in_stock)}, "
+                f"postable: +{len(self.postable)} / -{len(self.unpostable)}")
+
+
+def _row(article, stock, price=None):
+    article = norm_article(article)
+    stock, price = norm_stock(stock), parse_number(price)
+    if not article or stock is None:
+        return None
+    return article, stock, price if isinstance(price, (int, float)) else None
+
+
+def _row_hash(*values) -> str:
+    """content_hash по полям products в порядке HASH_FIELDS; картинки — JSON-массив url."""
+    values = dict(zip(HASH_FIELDS, values))
+    values["images"] = tuple(json.loads(values["images"]))
+    return row_hash(values)
+
+
+async def sync_stock(db: Database, rows: Iterable[tuple], chunk_size: int = INGEST_CHUNK_SIZE) -> StockChanges:
+    """
+    rows — (article, stock, price|None). Всё применяется одной транзакцией.
+    Изменённые товары попадают в ленту изменений триггером — вотчер разберёт их сам.
+    """
+    changes = StockChanges()
+    rows = iter(rows)
+    # временная таблица — на писателе, но вне блокировки основной базы: rows — это разбор файла
+    # или поток из ERP, и писатель бота не должен ждать его дольше busy_timeout
+    async with db.transaction(immediate=False) as tx:
+        await tx.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS stock_sync (
+                article TEXT PRIMARY KEY,
+                stock INTEGER,
+                price REAL
+            )
+        """)
+        await tx.execute("DELETE FROM stock_sync")
+    while chunk := list(islice(rows, chunk_size)):
+        parsed = [r for r in (_row(*row) for row in chunk) if r]
+        changes.received += len(parsed)
+        async with db.transaction(immediate=False) as tx:
+            await tx.executemany("INSERT OR REPLACE INTO stock_sync (article, stock, price) VALUES (?, ?, ?)",
+                                 parsed)
+
+    # короткая транзакция записи: сверка и UPDATE ... FROM
+    async with db.transaction() as tx:
+        await tx.create_function("row_hash", len(HASH_FIELDS), _row_hash, deterministic=True)
+        async with tx.execute(
+            "SELECT COUNT(*) FROM stock_sync s WHERE NOT EXISTS "
+            "(SELECT 1 FROM products p WHERE p.article = s.article)"
+        ) as cur:
+            changes.unknown = (await cur.fetchone())[0]
+        async with tx.execute(_CHANGED) as cur:
+            async for product_id, old_stock, new_stock in cur:
+                changes.record(product_id, old_stock, new_stock)
+        await tx.execute(_APPLY)
+        await tx.execute("DROP TABLE stock_sync")
+
+    if changes.changed:
+        notify_changes()
+    return changes
+
+
+def read_file(path: str):
+    for chunk in read_chunks(path, columns=STOCK_COLUMNS):
+        for row in chunk:
+            yield row.get("article"), row.get("stock"), row.get("price")
+
+
+def read_stdin():
+    for row in csv.reader(sys.stdin):
+        if len(row) >= 2:
+            yield row[0], row[1], row[2] if len(row) > 2 else None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Sync stock and prices by article")
+    parser.add_argument("path", help="XLSX/CSV file, or - for 'article,stock[,price]' lines on stdin")
+    args = parser.parse_args()
+
+    await migrate()
+    rows = read_stdin() if args.path == "-" else read_file(args.path)
+    async with Database(DB_NAME, readers=1) as db:
+        changes = await sync_stock(db, rows)
+    print(f"✅ {changes.report()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,9 +1,17 @@
-import pandas as pd
+import argparse
+import asyncio
 import sqlite3
 import math
 
-EXCEL_PATH = "tumi_excel_stock_updated_red.xlsx"  # твой Excel с новым "Описание"
-DB_PATH = "products.db"
+from config import DB_NAME, EXCEL_FILE
+from content_hash import row_hash, changed_fields, DiffSummary
+from database import connect_sync
+from migrations import migrate
+from import_data import PRODUCT_FIELDS
+from ingest import norm_article, read_chunks
+
+# только эти колонки выгрузки нужны для обновления описаний
+DESCRIPTION_COLUMNS = {"Артикул": "article", "Описание": "description"}
 
 def is_empty(x):
     if x is None: return True
@@ -14,39 +22,91 @@ def is_empty(x):
 def norm(x):
     return str(x).strip() if not is_empty(x) else None
 
+def load_products(cur: sqlite3.Cursor, articles: list[str]) -> tuple[dict, set]:
+    """{article: (id, {field: value}, content_hash)} по пачке артикулов + id товаров с постами."""
+    marks = ",".join("?" * len(articles))
+    products = {}
+    posted = set()
+    rows = cur.execute(
+        f"SELECT id, article, content_hash, {', '.join(PRODUCT_FIELDS)}, "
+        f"EXISTS (SELECT 1 FROM product_messages pm WHERE pm.product_id = products.id) "
+        f"FROM products WHERE article IN ({marks})",
+        articles
+    )
+    for row in rows.fetchall():
+        values = dict(zip(PRODUCT_FIELDS, row[3:-1]))
+        values["images"] = ()
+        products[norm_article(row[1])] = (row[0], values, row[2])
+        if row[-1]:
+            posted.add(row[0])
+
+    images = {product_id: values for product_id, values, _ in products.values()}
+    if images:
+        for product_id, url in cur.execute(
+            f"SELECT product_id, image_url FROM product_images "
+            f"WHERE product_id IN ({','.join('?' * len(images))}) ORDER BY id",
+            list(images)
+        ):
+            images[product_id]["images"] += (url,)
+    return products, posted
+
 def main():
-    df = pd.read_excel(EXCEL_PATH)
+    parser = argparse.ArgumentParser(description="Update product descriptions from an XLSX/CSV export")
+    parser.add_argument("path", nargs="?", default=EXCEL_FILE, help="XLSX or CSV file (default: EXCEL_FILE)")
+    args = parser.parse_args()
+    if not args.path:
+        parser.error("no file given and EXCEL_FILE is not set")
 
-    col_article = "Артикул"
-    col_desc = "Описание"
+    asyncio.run(migrate(DB_NAME))  # нужна колонка content_hash
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_sync(DB_NAME)
     cur = conn.cursor()
 
+    summary = DiffSummary()
     updated = 0
     skipped = 0
 
-    for _, row in df.iterrows():
-        article = norm(row.get(col_article))
-        desc = row.get(col_desc)
+    # пачками: прочитали -> сравнили с базой -> записали, файл целиком в памяти не держим
+    for chunk in read_chunks(args.path, columns=DESCRIPTION_COLUMNS):
+        rows = {}
+        for row in chunk:
+            article = norm_article(row.get("article"))
+            desc = row.get("description")
+            if not article or is_empty(desc):
+                skipped += 1
+                continue
+            rows[article] = str(desc)
+
+        products, posted = load_products(cur, list(rows)) if rows else ({}, set())
+        updates = []
+        for article, desc in rows.items():
+            if article not in products:
+                skipped += 1
+                continue
+
+            product_id, old_values, old_hash = products[article]
+            new_values = dict(old_values, description=desc)
+            new_hash = row_hash(new_values)
+            if new_hash == old_hash or not changed_fields(old_values, new_values):
+                summary.unchanged += 1
+                continue
 
-        if not article or is_empty(desc):
-            skipped += 1
-            continue
+            summary.record_change(["description"])
+            stale_post = 1 if product_id in posted else 0  # описание видно в посте
+            updates.append((desc, new_hash, stale_post, product_id))
 
-        cur.execute(
-            "UPDATE products SET description = ? WHERE article = ?",
-            (str(desc), article)
+        cur.executemany(
+            "UPDATE products SET description = ?, content_hash = ?, "
+            "needs_update = CASE WHEN ? = 1 THEN 1 ELSE needs_update END WHERE id = ?",
+            updates
         )
-        if cur.rowcount > 0:
-            updated += 1
-        else:
-            skipped += 1
+        conn.commit()
+        updated += len(updates)
 
-    conn.commit()
     conn.close()
     print(f"✅ Обновлено описаний: {updated}")
     print(f"⚠️ Пропущено строк: {skipped}")
+    print(summary.report())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()